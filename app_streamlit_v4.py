@@ -17,10 +17,18 @@ import plotly.graph_objects as go
 from datetime import datetime, timedelta, date
 import os
 import time
-import io
 
-# Importar a função de carregamento e limpeza de dados da versão corrigida
-from data_processor_streamlit_corrected_v2 import load_and_clean_data_streamlit, load_and_clean_data_streamlit_cached
+# Carregamento e limpeza de dados (versão corrigida) ficam atrás do store compartilhado
+from dataset_store import get_dataset_store, get_source_mtime, selection_key
+from export_jobs import EXPORT_FORMATS, EXCEL_MAX_ROWS, get_export_manager
+from multi_source_loader import is_multi_source
+from kpi_cube import build_daily_totals, compute_comparative_kpis
+from chart_aggregates import compute_dashboard_aggregates
+from query_backend import get_query_backend
+from perf_trace import get_perf_tracer, trace_stage, summarize_stages
+from table_pages import TABLE_PAGE_SIZES, DEFAULT_PAGE_SIZE, sort_order, page_count, get_page
+from cache_warmup import DEFAULT_WARMUP_SPECS, PERMALINKS_FILE_NAME, make_warmup, get_permalink_tracker
+from snapshot_store import get_snapshot_dir
 
 # --- Configuração da Página ---
 st.set_page_config(
@@ -37,75 +45,68 @@ else:
     # Running in a normal Python environment
     base_path = os.path.abspath(".")
 
+# Também aceita um diretório ou glob (ex.: upload/*.xlsx) quando o extrato vem dividido em vários arquivos
 DATA_FILE_PATH = os.path.join(base_path, "upload", "teste_d11.xlsx")
 IS_CSV = False
+# Motor dos agregados dos gráficos: "pandas" (em memória) ou "duckdb" (SQL embarcado sobre o snapshot Parquet)
+QUERY_BACKEND = "pandas"
+# Anos mantidos em memória (None = histórico inteiro). Com um valor, "Ano" vazio significa só esses anos;
+# anos anteriores são lidos das partições Ano/Mês do snapshot apenas quando selecionados
+HISTORY_YEARS_ONLINE = None
+# Diretório dos snapshots e agregados pré-calculados (None = .snapshot_cache ao lado da origem).
+# Deve ser o mesmo passado em "python dashboard_engine.py ... --snapshot-dir"
+SNAPSHOT_DIR = None
+
+# Store único do processo: o dataset é carregado uma vez e compartilhado por referência entre as sessões
+dataset_store = get_dataset_store(history_years=HISTORY_YEARS_ONLINE, snapshot_dir=SNAPSHOT_DIR)
+
+# Seleções pré-calculadas a cada nova versão dos dados (sem filtros, ano atual, cada canal, cada
+# organização de vendas), além dos permalinks mais abertos. Lista vazia desativa o pré-aquecimento
+WARMUP_SELECTIONS = DEFAULT_WARMUP_SPECS
+# Permalinks (filtros vindos da URL) contados em disco, ao lado dos snapshots, para sobreviver a reinícios
+permalink_tracker = get_permalink_tracker(os.path.join(get_snapshot_dir(DATA_FILE_PATH, SNAPSHOT_DIR), PERMALINKS_FILE_NAME))
+if WARMUP_SELECTIONS:
+    dataset_store.set_warmup(make_warmup(WARMUP_SELECTIONS, permalink_tracker, query_backend=QUERY_BACKEND))
+
+# Instrumentação por etapa: cada execução do script é um "run" com tempo, linhas e memória de cada etapa
+perf_tracer = get_perf_tracer()
+perf_run_id = perf_tracer.start_run("rerun")
 
-@st.cache_data(ttl=600)
 def load_data():
-    print(f"Tentando carregar dados de: {os.path.abspath(DATA_FILE_PATH)}")
-    if not os.path.exists(DATA_FILE_PATH):
+    if not (os.path.exists(DATA_FILE_PATH) or is_multi_source(DATA_FILE_PATH)):
         st.error(f"Arquivo de dados não encontrado em: {os.path.abspath(DATA_FILE_PATH)}")
         return None
-    start_time = time.time()
     try:
-        df_loaded = load_and_clean_data_streamlit_cached(DATA_FILE_PATH, IS_CSV)
-        if df_loaded is None:
+        # Só a primeira carga bloqueia; mudanças no arquivo são recarregadas em segundo plano
+        dataset_loaded = dataset_store.get_dataset(DATA_FILE_PATH, IS_CSV)
+        if dataset_loaded is None:
             st.error(f"Falha ao carregar ou processar dados de {DATA_FILE_PATH}.")
-            return None
-        if 'DataCriacao' not in df_loaded.columns or not pd.api.types.is_datetime64_any_dtype(df_loaded['DataCriacao']):
-             st.error("Coluna 'DataCriacao' não encontrada ou não está no formato datetime.")
-             return None
-        # Garantir que MesNome seja categórico ordenado após o carregamento
-        if 'MesNome' in df_loaded.columns and not isinstance(df_loaded['MesNome'].dtype, pd.CategoricalDtype):
-            month_order_pt = [
-                "Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
-                "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"
-            ]
-            present_months = df_loaded['MesNome'].unique().tolist()
-            ordered_present_months = [m for m in month_order_pt if m in present_months]
-            if ordered_present_months:
-                df_loaded['MesNome'] = pd.Categorical(df_loaded['MesNome'], categories=month_order_pt, ordered=True)
-                print("Coluna \"MesNome\" convertida para category ordenada (PT-BR) na app.")
-            else:
-                print("Warning: Nenhum mês encontrado para ordenação categórica de MesNome na app.")
-
-        end_time = time.time()
-        print(f"Dados carregados e verificados em {end_time - start_time:.2f} segundos.")
-        return df_loaded
+        return dataset_loaded
     except Exception as e:
         st.error(f"Erro crítico durante o carregamento dos dados: {e}")
         import traceback
         st.error(f"Traceback: {traceback.format_exc()}")
         return None
 
-# Add a button to reload data and clear cache
-if 'reload_data' not in st.session_state:
-    st.session_state.reload_data = False
-
-def reload_data_callback():
-    st.cache_data.clear()
-    st.session_state.reload_data = True
+dataset = load_data()
+df = dataset["df"] if dataset is not None else None
 
+# Botão de atualização: pede uma nova versão ao atualizador em segundo plano, sem bloquear a página;
+# todas as sessões continuam na versão atual até a nova ficar pronta
 if st.sidebar.button("Atualizar Dados"):
-    reload_data_callback()
-
-if st.session_state.reload_data:
-    df = load_data()
-    st.session_state.reload_data = False
+    dataset_store.request_refresh(DATA_FILE_PATH, IS_CSV)
+    st.sidebar.info("Atualização iniciada em segundo plano. A nova versão aparece na próxima interação.")
+if dataset_store.refresh_state["running"]:
+    st.sidebar.caption("Carregando nova versão dos dados em segundo plano...")
+elif dataset_store.refresh_state["last_error"]:
+    st.sidebar.warning(f"Última atualização falhou ({dataset_store.refresh_state['last_error']}). Servindo a versão anterior.")
+
+# Timestamp do arquivo de origem da versão servida (não do arquivo em disco, que pode estar sendo recarregado)
+served_source_time = get_source_mtime(dataset["source_signature"]) if dataset is not None else None
+if df is not None and not df.empty and served_source_time is not None:
+    last_update_str = f"{served_source_time.strftime('%d/%m/%Y %H:%M:%S')} (versão {dataset['version']})"
 else:
-    df = load_data()
-
-# Obter timestamp da última modificação do arquivo de dados
-last_update_timestamp = None
-try:
-    if df is not None and not df.empty and os.path.exists(DATA_FILE_PATH):
-        last_update_timestamp = datetime.fromtimestamp(os.path.getmtime(DATA_FILE_PATH))
-        last_update_str = last_update_timestamp.strftime("%d/%m/%Y %H:%M:%S")
-    else:
-        last_update_str = "N/A (Dados não carregados)"
-except Exception as e:
-    st.warning(f"Não foi possível obter o timestamp do arquivo de dados: {e}. Usando hora atual.")
-    last_update_str = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+    last_update_str = "N/A (Dados não carregados)"
 
 # --- Layout Principal ---
 
@@ -127,114 +128,143 @@ if df is None or df.empty:
     st.error("Erro ao carregar os dados ou dados vazios. Dashboard não pode ser exibido.")
     st.stop()
 
-# Função para obter opções de filtro, garantindo a ordem para MesNome
-@st.cache_data(show_spinner=False)
-def get_options(df_input, column_name):
-    if column_name not in df_input.columns:
-        return []
-    # Para MesNome, usar as categorias ordenadas definidas
-    if column_name == 'MesNome' and isinstance(df_input[column_name].dtype, pd.CategoricalDtype):
-        return df_input[column_name].cat.categories.tolist()
-    # Para outras colunas categóricas ordenadas
-    if isinstance(df_input[column_name].dtype, pd.CategoricalDtype) and df_input[column_name].cat.ordered:
-        return df_input[column_name].cat.categories.tolist()
-    # Para colunas numéricas ou outras
-    options = df_input[column_name].dropna().unique()
-    try:
-        # Tenta ordenar como números (Ano, SemanaAno)
-        options_sorted = sorted([int(opt) for opt in options])
-        return [str(opt) for opt in options_sorted]
-    except (ValueError, TypeError):
-        # Ordena como string
-        return sorted([str(opt) for opt in options])
+# --- Filtros facetados ---
+# Cada filtro mostra só os valores que ainda têm linhas com os demais filtros aplicados, com as
+# contagens (linhas | quantidade). Vêm do índice de posições por valor, em cache por seleção.
+SIDEBAR_FILTERS = [
+    # (rótulo, dimensão, parâmetro da URL), na ordem de FILTER_DIMENSIONS
+    ("Ano", "Ano", "ano"),
+    ("Mês", "MesNumero", "mes"),
+    ("Semana", "SemanaAno", "semana"),
+    ("Canal", "CanalBI", "canal"),
+    ("3P/LUX", "TresP_AH", "3p"),
+    ("Organização de vendas", "SalesOrgE", "sales_org"),
+    ("Franqueado", "Franqueado", "franqueado"),
+    ("Marca (Brand)", "BrandCode", "brand_code"),
+    ("Tipo do Produto", "CollectionDesc", "collection_desc"),
+    ("Categorização da marca", "BrandCategory", "brand_category"),
+    ("Otico / Sport", "OticoSport", "otico_sport"),
+]
 
 query_params = st.query_params
 def get_query_param_list(param_name):
     return query_params.get(param_name, [])
 
+def get_current_selection(param_name):
+    # Valor atual do widget (já atualizado antes do rerun) ou, na primeira execução, o da URL
+    widget_key = f"filtro_{param_name}"
+    if widget_key in st.session_state:
+        return list(st.session_state[widget_key])
+    default = get_query_param_list(param_name)
+    return [default] if isinstance(default, str) else list(default)
+
+def facet_option_formatter(facet):
+    def format_option(value):
+        return f"{value} ({facet['counts'].get(value, 0):,} | {facet['quantities'].get(value, 0):,})".replace(",", ".")
+    return format_option
+
 placeholder_text = "Escolha uma opção"
 
-selected_anos = st.sidebar.multiselect("Ano", options=get_options(df, "Ano"), default=get_query_param_list("ano"), placeholder=placeholder_text)
-# Usar a função get_options que retorna a lista ordenada completa para MesNome
-selected_meses = st.sidebar.multiselect("Mês", options=[str(i) for i in range(1,13)], default=get_query_param_list("mes"), placeholder=placeholder_text)
-selected_semanas = st.sidebar.multiselect("Semana", options=get_options(df, "SemanaAno"), default=get_query_param_list("semana"), placeholder=placeholder_text)
-selected_canais = st.sidebar.multiselect("Canal", options=get_options(df, "CanalBI"), default=get_query_param_list("canal"), placeholder=placeholder_text)
-selected_3p = st.sidebar.multiselect("3P/LUX", options=get_options(df, "TresP_AH"), default=get_query_param_list("3p"), placeholder=placeholder_text)
-selected_sales_org = st.sidebar.multiselect("Organização de vendas", options=get_options(df, "SalesOrgE"), default=get_query_param_list("sales_org"), placeholder=placeholder_text)
-franqueado_options = [opt for opt in get_options(df, "Franqueado") if opt and opt != "Não Especificado"]
-selected_franqueado = st.sidebar.multiselect("Franqueado", options=franqueado_options, default=get_query_param_list("franqueado"), placeholder=placeholder_text)
-selected_brand_code = st.sidebar.multiselect("Marca (Brand)", options=get_options(df, "BrandCode"), default=get_query_param_list("brand_code"), placeholder=placeholder_text)
-selected_collection_desc = st.sidebar.multiselect("Tipo do Produto", options=get_options(df, "CollectionDesc"), default=get_query_param_list("collection_desc"), placeholder=placeholder_text)
-selected_brand_category = st.sidebar.multiselect("Categorização da marca", options=get_options(df, "BrandCategory"), default=get_query_param_list("brand_category"), placeholder=placeholder_text)
-selected_otico_sport = st.sidebar.multiselect("Otico / Sport", options=get_options(df, "OticoSport"), default=get_query_param_list("otico_sport"), placeholder=placeholder_text)
+current_selections = {dimension: get_current_selection(param) for _, dimension, param in SIDEBAR_FILTERS}
+
+# Primeira execução da sessão aberta por um permalink: conta a seleção para o pré-aquecimento
+if "permalink_contado" not in st.session_state:
+    st.session_state["permalink_contado"] = True
+    permalink_tracker.record({dimension: get_current_selection(param) for _, dimension, param in SIDEBAR_FILTERS})
+filter_facets = dataset_store.get_facets(dataset, current_selections)
+
+filter_selections = {}
+for label, dimension, param in SIDEBAR_FILTERS:
+    facet = filter_facets.get(dimension, {"options": [], "counts": {}, "quantities": {}})
+    current = current_selections[dimension]
+    # Valores já selecionados ficam na lista mesmo sem linhas, para não sumirem da seleção
+    options = facet["options"] + [value for value in current if value not in facet["counts"]]
+    filter_selections[dimension] = st.sidebar.multiselect(
+        label, options=options, default=current, key=f"filtro_{param}", format_func=facet_option_formatter(facet),
+        placeholder=placeholder_text, help="Entre parênteses: linhas | quantidade com os demais filtros aplicados",
+    )
 
 # --- Filtrar DataFrame com base nas seleções ---
-@st.cache_data(show_spinner=False)
-def apply_filters(df_input, anos, meses, semanas, canais, p3, sales_org, franqueado, brand, collection, category, otico):
-    dff = df_input.copy()
-    # Usar get_options para verificar se *todas* as opções estão selecionadas (não aplicar filtro nesse caso)
-    if anos and len(anos) < len(get_options(df_input, "Ano")):
-        dff = dff[dff["Ano"].astype(str).isin(anos)]
-    if meses and len(meses) < len(get_options(df_input, "MesNumero")):
-        dff = dff[dff["MesNumero"].isin(meses)]
-    if semanas and len(semanas) < len(get_options(df_input, "SemanaAno")):
-        dff = dff[dff["SemanaAno"].astype(str).isin(semanas)]
-    if canais and len(canais) < len(get_options(df_input, "CanalBI")):
-        dff = dff[dff["CanalBI"].astype(str).isin(canais)]
-    if p3 and len(p3) < len(get_options(df_input, "TresP_AH")):
-        dff = dff[dff["TresP_AH"].astype(str).isin(p3)]
-    if sales_org and len(sales_org) < len(get_options(df_input, "SalesOrgE")):
-        dff = dff[dff["SalesOrgE"].astype(str).isin(sales_org)]
-    franqueado_all_options = [opt for opt in get_options(df_input, "Franqueado") if opt and opt != "Não Especificado"]
-    if franqueado and len(franqueado) < len(franqueado_all_options):
-        dff = dff[dff["Franqueado"].astype(str).isin(franqueado)]
-    if brand and len(brand) < len(get_options(df_input, "BrandCode")):
-        dff = dff[dff["BrandCode"].astype(str).isin(brand)]
-    if collection and len(collection) < len(get_options(df_input, "CollectionDesc")):
-        dff = dff[dff["CollectionDesc"].astype(str).isin(collection)]
-    if category and len(category) < len(get_options(df_input, "BrandCategory")):
-        dff = dff[dff["BrandCategory"].astype(str).isin(category)]
-    if otico and len(otico) < len(get_options(df_input, "OticoSport")):
-        dff = dff[dff["OticoSport"].astype(str).isin(otico)]
-    return dff
-
-# Convert selected_meses from string to int for filtering
-selected_meses_int = [int(m) for m in selected_meses] if selected_meses else []
-
-dff = apply_filters(df, selected_anos, selected_meses_int, selected_semanas, selected_canais, selected_3p, selected_sales_org, selected_franqueado, selected_brand_code, selected_collection_desc, selected_brand_category, selected_otico_sport)
-
-# --- Função para converter DataFrame para CSV --- 
-@st.cache_data
-def convert_df_to_csv(df_to_convert):
-    return df_to_convert.to_csv(index=False, sep=';', encoding='utf-8-sig').encode('utf-8-sig')
-
-# --- Função para converter DataFrame para Excel --- 
-@st.cache_data
-def convert_df_to_excel(df_to_convert):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df_to_convert.to_excel(writer, index=False, sheet_name='DadosFiltrados')
-    processed_data = output.getvalue()
-    return processed_data
+def apply_filters(dataset_input, selections):
+    # Seleção resolvida pelo índice de posições por valor (OR dentro da dimensão, AND entre dimensões)
+    # Dimensões com todas as opções selecionadas não filtram, como antes
+    # Cache LRU no store pela chave (versão do dataset, seleção), sem hash do DataFrame
+    return dataset_store.get_filtered_view(dataset_input, selections)
+
+# Convert selected months from string to int for filtering
+filter_selections["MesNumero"] = [int(m) for m in filter_selections["MesNumero"]]
+
+# Dataset em memória ou, se a seleção pede anos fora da janela, só as partições desses anos
+query_dataset = dataset_store.resolve_dataset(dataset, filter_selections)
+dff = apply_filters(query_dataset, filter_selections)
+
+# Agregados dos gráficos em cache LRU por (versão do dataset, seleção, id do agregado)
+def get_chart_data(aggregate_id, compute):
+    return dataset_store.get_aggregate(query_dataset, filter_selections, aggregate_id, compute)
+
+# --- Exportações sob demanda ---
+# O arquivo só é gerado quando o usuário pede, em thread de fundo, gravado em disco em blocos.
+# Sessões com a mesma seleção e formato compartilham o mesmo arquivo.
+export_manager = get_export_manager()
+
+def render_export_status(export_key):
+    job = export_manager.get_job(export_key)
+    if job is None:
+        return
+    if job["status"] == "running":
+        done_fraction = job["rows_written"] / job["rows_total"] if job["rows_total"] else 0.0
+        st.progress(done_fraction, text=f"Gerando arquivo... {job['rows_written']:,}/{job['rows_total']:,} linhas".replace(",", "."))
+        if not hasattr(st, "fragment"):
+            st.button("Atualizar status", key="export_refresh")
+    else:
+        # Terminou: a página inteira é recarregada para mostrar o botão de download
+        st.rerun()
+
+if hasattr(st, "fragment"):
+    render_export_status = st.fragment(run_every=1)(render_export_status)
 
 # --- Botões de Download na Sidebar ---
 st.sidebar.markdown("---")
 st.sidebar.header("Downloads")
 
-# Botão para baixar dados filtrados (Excel)
+# Exportação dos dados filtrados (Excel, CSV ou Parquet)
 if not dff.empty:
-    excel_filtered = convert_df_to_excel(dff)
-    st.sidebar.download_button(
-        label="Baixar Dados Filtrados (Excel)",
-        data=excel_filtered,
-        file_name=f'dados_filtrados_{datetime.now().strftime("%Y%m%d")}.xlsx',
-        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    export_format = st.sidebar.radio(
+        "Formato", options=list(EXPORT_FORMATS), format_func=lambda fmt: EXPORT_FORMATS[fmt]["label"], horizontal=True
     )
+    export_key = (dataset["version"], selection_key(query_dataset, filter_selections), export_format)
+    export_job = export_manager.get_job(export_key)
+    if export_format == "xlsx" and len(dff) > EXCEL_MAX_ROWS:
+        st.sidebar.warning(f"O Excel aceita no máximo {EXCEL_MAX_ROWS:,} linhas. Use CSV ou Parquet.".replace(",", "."))
+    elif export_job is None or export_job["status"] == "failed":
+        if export_job is not None:
+            st.sidebar.error(f"Falha ao gerar o arquivo: {export_job['error']}")
+        if st.sidebar.button(f"Gerar Dados Filtrados ({EXPORT_FORMATS[export_format]['label']})"):
+            export_manager.submit(export_key, dff, export_format)
+            st.rerun()
+    elif export_job["status"] == "running":
+        with st.sidebar:
+            render_export_status(export_key)
+    else:
+        # Limitação: o st.download_button não faz streaming do disco; o arquivo inteiro é lido para a
+        # memória a cada rerun em que o botão aparece. Só a geração da exportação evita esse pico
+        try:
+            with open(export_job["path"], "rb") as fp:
+                st.sidebar.download_button(
+                    label=f"Baixar Dados Filtrados ({EXPORT_FORMATS[export_format]['label']}, {export_job['size'] / 1024 ** 2:.1f} MB)",
+                    data=fp,
+                    file_name=f'dados_filtrados_{datetime.now().strftime("%Y%m%d")}.{export_format}',
+                    mime=EXPORT_FORMATS[export_format]["mime"],
+                )
+        except FileNotFoundError:
+            # O arquivo foi descartado por outra sessão (limite de arquivos): gera novamente
+            export_manager.submit(export_key, dff, export_format)
+            st.rerun()
 else:
     st.sidebar.info("Nenhum dado filtrado para baixar.")
 
 # Botão para baixar base original completa (Excel)
-if os.path.exists(DATA_FILE_PATH):
+if os.path.isfile(DATA_FILE_PATH):
     with open(DATA_FILE_PATH, "rb") as fp:
         st.sidebar.download_button(
             label="Baixar Base Original Completa",
@@ -246,6 +276,18 @@ else:
     st.sidebar.warning("Arquivo original não encontrado para download.")
 
 
+# Contadores do cache de resultados (visões filtradas e agregados dos gráficos)
+with st.sidebar.expander("Cache de resultados"):
+    cache_stats = dataset_store.results.stats()
+    st.caption(
+        f"Entradas: {cache_stats['entries']}/{cache_stats['max_entries']} | "
+        f"Memória: {cache_stats['bytes'] / 1024 ** 2:.1f}/{cache_stats['max_bytes'] / 1024 ** 2:.0f} MB"
+    )
+    st.caption(
+        f"Acertos: {cache_stats['hits']} | Faltas: {cache_stats['misses']} | "
+        f"Remoções: {cache_stats['evictions']} | Taxa de acerto: {cache_stats['hit_rate']:.0%}"
+    )
+
 # --- Exibição Principal do Dashboard ---
 if dff.empty:
     st.warning("Nenhum dado encontrado para os filtros selecionados.")
@@ -255,6 +297,13 @@ if dff.empty:
     st.markdown(f"**_BI After Sales EssilorLuxottica | {current_year_sig}_**")
     st.markdown("_<small>Created by Willian Aleixo</small>_", unsafe_allow_html=True)
 else:
+    # Dados de todos os gráficos e dos KPIs filtrados, calculados numa única passada (em cache por seleção)
+    def compute_dashboard_data():
+        if QUERY_BACKEND == "pandas":
+            return compute_dashboard_aggregates(dff)
+        return get_query_backend(query_dataset, QUERY_BACKEND).compute_aggregates(filter_selections)
+    dashboard_data = get_chart_data("dashboard", compute_dashboard_data)
+
     # --- KPIs Comparativos (Reestruturados) ---
     st.subheader("Indicadores Comparativos")
 
@@ -303,77 +352,38 @@ else:
         return markdown_string
 
     # --- Cálculos para KPIs Comparativos --- 
-    latest_data_date = df["DataCriacao"].max().date()
-    today = latest_data_date
-
-    current_year = today.year
-    current_month = today.month
-    current_day = today.day
-    current_day_of_year = today.timetuple().tm_yday
-
-    prev_year = current_year - 1
-    prev_month_year = current_year if current_month > 1 else current_year - 1
-    prev_month = current_month - 1 if current_month > 1 else 12
-    prev_week_date = today - timedelta(days=7)
-
-    # Períodos Atuais (YTD, MTD, WTD)
-    start_current_year = date(current_year, 1, 1)
-    start_current_month = date(current_year, current_month, 1)
-    start_current_week = today - timedelta(days=today.weekday()) # Segunda-feira da semana atual
-
-    df_ytd = df[(df['DataCriacao'].dt.date >= start_current_year) & (df['DataCriacao'].dt.date <= today)]
-    df_mtd = df[(df['DataCriacao'].dt.date >= start_current_month) & (df['DataCriacao'].dt.date <= today)]
-    df_wtd = df[(df['DataCriacao'].dt.date >= start_current_week) & (df['DataCriacao'].dt.date <= today)]
-
-    # Períodos Anteriores Correspondentes (YTD, MTD, WTD)
-    start_prev_year_ytd = date(prev_year, 1, 1)
-    try:
-        end_prev_year_ytd = date(prev_year, current_month, current_day)
-    except ValueError: # Dia não existe no ano anterior (ex: 29 Fev)
-        end_prev_year_ytd = date(prev_year, current_month, current_day -1)
-
-    start_prev_month_mtd = date(prev_month_year, prev_month, 1)
-    last_day_prev_month = (start_current_month - timedelta(days=1)).day
-    end_prev_month_mtd = date(prev_month_year, prev_month, min(current_day, last_day_prev_month))
-
-    start_prev_week_wtd = start_current_week - timedelta(days=7)
-    end_prev_week_wtd = prev_week_date
-
-    df_prev_ytd = df[(df['DataCriacao'].dt.date >= start_prev_year_ytd) & (df['DataCriacao'].dt.date <= end_prev_year_ytd)]
-    df_prev_mtd = df[(df['DataCriacao'].dt.date >= start_prev_month_mtd) & (df['DataCriacao'].dt.date <= end_prev_month_mtd)]
-    df_prev_wtd = df[(df['DataCriacao'].dt.date >= start_prev_week_wtd) & (df['DataCriacao'].dt.date <= end_prev_week_wtd)]
-
-    # Calcular KPIs CRIADOS
-    qtd_criada_ytd = df_ytd['QuantidadeKPI'].sum()
-    qtd_criada_prev_ytd = df_prev_ytd['QuantidadeKPI'].sum()
-    delta_criada_yoy = ((qtd_criada_ytd - qtd_criada_prev_ytd) / qtd_criada_prev_ytd * 100) if qtd_criada_prev_ytd != 0 else (float('inf') if qtd_criada_ytd > 0 else 0)
-
-    qtd_criada_mtd = df_mtd['QuantidadeKPI'].sum()
-    qtd_criada_prev_mtd = df_prev_mtd['QuantidadeKPI'].sum()
-    delta_criada_mom = ((qtd_criada_mtd - qtd_criada_prev_mtd) / qtd_criada_prev_mtd * 100) if qtd_criada_prev_mtd != 0 else (float('inf') if qtd_criada_mtd > 0 else 0)
-
-    qtd_criada_wtd = df_wtd['QuantidadeKPI'].sum()
-    qtd_criada_prev_wtd = df_prev_wtd['QuantidadeKPI'].sum()
-    delta_criada_wow = ((qtd_criada_wtd - qtd_criada_prev_wtd) / qtd_criada_prev_wtd * 100) if qtd_criada_prev_wtd != 0 else (float('inf') if qtd_criada_wtd > 0 else 0)
-
-    # Calcular KPIs FATURADOS
-    df_faturado_ytd = df_ytd[df_ytd['StatusKPI'] == "Faturado"]
-    df_faturado_prev_ytd = df_prev_ytd[df_prev_ytd['StatusKPI'] == "Faturado"]
-    qtd_faturada_ytd = df_faturado_ytd['QuantidadeKPI'].sum()
-    qtd_faturada_prev_ytd = df_faturado_prev_ytd['QuantidadeKPI'].sum()
-    delta_faturada_yoy = ((qtd_faturada_ytd - qtd_faturada_prev_ytd) / qtd_faturada_prev_ytd * 100) if qtd_faturada_prev_ytd != 0 else (float('inf') if qtd_faturada_ytd > 0 else 0)
-
-    df_faturado_mtd = df_mtd[df_mtd['StatusKPI'] == "Faturado"]
-    df_faturado_prev_mtd = df_prev_mtd[df_prev_mtd['StatusKPI'] == "Faturado"]
-    qtd_faturada_mtd = df_faturado_mtd['QuantidadeKPI'].sum()
-    qtd_faturada_prev_mtd = df_faturado_prev_mtd['QuantidadeKPI'].sum()
-    delta_faturada_mom = ((qtd_faturada_mtd - qtd_faturada_prev_mtd) / qtd_faturada_prev_mtd * 100) if qtd_faturada_prev_mtd != 0 else (float('inf') if qtd_faturada_mtd > 0 else 0)
-
-    df_faturado_wtd = df_wtd[df_wtd['StatusKPI'] == "Faturado"]
-    df_faturado_prev_wtd = df_prev_wtd[df_prev_wtd['StatusKPI'] == "Faturado"]
-    qtd_faturada_wtd = df_faturado_wtd['QuantidadeKPI'].sum()
-    qtd_faturada_prev_wtd = df_faturado_prev_wtd['QuantidadeKPI'].sum()
-    delta_faturada_wow = ((qtd_faturada_wtd - qtd_faturada_prev_wtd) / qtd_faturada_prev_wtd * 100) if qtd_faturada_prev_wtd != 0 else (float('inf') if qtd_faturada_wtd > 0 else 0)
+    # Somas por janela vêm das somas acumuladas do cubo diário (O(1) por janela), sem varrer as linhas
+    with trace_stage("kpi.comparative"):
+        # Séries diárias independem da seleção: em cache por versão (pré-aquecidas na carga)
+        daily_totals = dataset_store.get_aggregate(dataset, {}, "daily_totals", lambda: build_daily_totals(dataset["cube"]))
+        comparative_kpis = compute_comparative_kpis(daily_totals)
+    today = comparative_kpis["today"]
+    current_year = comparative_kpis["current_year"]
+    prev_year = comparative_kpis["prev_year"]
+    end_prev_month_mtd = comparative_kpis["end_prev_month_mtd"]
+    end_prev_week_wtd = comparative_kpis["end_prev_week_wtd"]
+
+    # KPIs CRIADOS
+    qtd_criada_ytd = comparative_kpis["criado_ytd"]
+    qtd_criada_prev_ytd = comparative_kpis["criado_prev_ytd"]
+    delta_criada_yoy = comparative_kpis["delta_criado_yoy"]
+    qtd_criada_mtd = comparative_kpis["criado_mtd"]
+    qtd_criada_prev_mtd = comparative_kpis["criado_prev_mtd"]
+    delta_criada_mom = comparative_kpis["delta_criado_mom"]
+    qtd_criada_wtd = comparative_kpis["criado_wtd"]
+    qtd_criada_prev_wtd = comparative_kpis["criado_prev_wtd"]
+    delta_criada_wow = comparative_kpis["delta_criado_wow"]
+
+    # KPIs FATURADOS
+    qtd_faturada_ytd = comparative_kpis["faturado_ytd"]
+    qtd_faturada_prev_ytd = comparative_kpis["faturado_prev_ytd"]
+    delta_faturada_yoy = comparative_kpis["delta_faturado_yoy"]
+    qtd_faturada_mtd = comparative_kpis["faturado_mtd"]
+    qtd_faturada_prev_mtd = comparative_kpis["faturado_prev_mtd"]
+    delta_faturada_mom = comparative_kpis["delta_faturado_mom"]
+    qtd_faturada_wtd = comparative_kpis["faturado_wtd"]
+    qtd_faturada_prev_wtd = comparative_kpis["faturado_prev_wtd"]
+    delta_faturada_wow = comparative_kpis["delta_faturado_wow"]
 
     # --- Exibir KPIs Comparativos (2 Fileiras) --- 
     st.markdown("##### Volume Criado")
@@ -400,11 +410,11 @@ else:
     st.subheader("Indicadores Chave (Filtro Aplicado)")
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
 
-    qtd_criada_filtrada = dff["QuantidadeKPI"].sum()
-    qtd_cancelada_filtrada = dff[dff["StatusKPI"] == "Cancelado"]["QuantidadeKPI"].sum()
-    qtd_faturada_filtrada = dff[dff["StatusKPI"] == "Faturado"]["QuantidadeKPI"].sum()
+    qtd_criada_filtrada = dashboard_data["status"]["criada"]
+    qtd_cancelada_filtrada = dashboard_data["status"]["cancelada"]
+    qtd_faturada_filtrada = dashboard_data["status"]["faturada"]
     # Aberta = Criada - Cancelada - Faturada (considerando apenas esses 3 status principais)
-    qtd_aberta_filtrada = qtd_criada_filtrada - qtd_cancelada_filtrada - qtd_faturada_filtrada
+    qtd_aberta_filtrada = dashboard_data["status"]["aberta"]
     # Ou, se houver outros status: qtd_aberta = dff[~dff["StatusKPI"].isin(["Cancelado", "Faturado"])]["QuantidadeKPI"].sum()
 
     kpi1.metric(label="Qtd. Criada (Filtro)", value=f"{qtd_criada_filtrada:,}".replace(",", "."))
@@ -419,26 +429,30 @@ else:
     col_tempo1, col_tempo2 = st.columns(2)
 
     with col_tempo1:
-        criado_tempo_mes = dff.resample("MS", on="DataCriacao")["QuantidadeKPI"].sum().reset_index()
-        fig_criado_tempo = px.line(criado_tempo_mes, x="DataCriacao", y="QuantidadeKPI", title="Volume Criado por Mês", markers=True, labels={"DataCriacao": "Mês", "QuantidadeKPI": "Quantidade"}, color_discrete_sequence=["black"])
-        fig_criado_tempo.update_layout(hovermode="x unified", margin=dict(l=20, r=20, t=40, b=20))
-        st.plotly_chart(fig_criado_tempo, use_container_width=True)
-
-        criado_ano = dff.groupby("Ano")["QuantidadeKPI"].sum().reset_index()
-        fig_criado_ano = px.bar(criado_ano, x="Ano", y="QuantidadeKPI", title="Volume Criado por Ano", labels={"Ano": "Ano", "QuantidadeKPI": "Quantidade"}, text_auto=True, color_discrete_sequence=["black"])
-        fig_criado_ano.update_layout(margin=dict(l=20, r=20, t=40, b=20))
-        st.plotly_chart(fig_criado_ano, use_container_width=True)
+        with trace_stage("chart.criado_mes"):
+            criado_tempo_mes = dashboard_data["criado_mes"]
+            fig_criado_tempo = px.line(criado_tempo_mes, x="DataCriacao", y="QuantidadeKPI", title="Volume Criado por Mês", markers=True, labels={"DataCriacao": "Mês", "QuantidadeKPI": "Quantidade"}, color_discrete_sequence=["black"])
+            fig_criado_tempo.update_layout(hovermode="x unified", margin=dict(l=20, r=20, t=40, b=20))
+            st.plotly_chart(fig_criado_tempo, use_container_width=True)
+
+        with trace_stage("chart.criado_ano"):
+            criado_ano = dashboard_data["criado_ano"]
+            fig_criado_ano = px.bar(criado_ano, x="Ano", y="QuantidadeKPI", title="Volume Criado por Ano", labels={"Ano": "Ano", "QuantidadeKPI": "Quantidade"}, text_auto=True, color_discrete_sequence=["black"])
+            fig_criado_ano.update_layout(margin=dict(l=20, r=20, t=40, b=20))
+            st.plotly_chart(fig_criado_ano, use_container_width=True)
 
     with col_tempo2:
-        faturado_tempo_mes = dff[dff["StatusKPI"] == "Faturado"].resample("MS", on="DataCriacao")["QuantidadeKPI"].sum().reset_index()
-        fig_faturado_tempo = px.line(faturado_tempo_mes, x="DataCriacao", y="QuantidadeKPI", title="Volume Faturado por Mês", markers=True, labels={"DataCriacao": "Mês", "QuantidadeKPI": "Quantidade Faturada"}, color_discrete_sequence=["black"])
-        fig_faturado_tempo.update_layout(hovermode="x unified", margin=dict(l=20, r=20, t=40, b=20))
-        st.plotly_chart(fig_faturado_tempo, use_container_width=True)
-
-        faturado_ano = dff[dff["StatusKPI"] == "Faturado"].groupby("Ano")["QuantidadeKPI"].sum().reset_index()
-        fig_faturado_ano = px.bar(faturado_ano, x="Ano", y="QuantidadeKPI", title="Volume Faturado por Ano", labels={"Ano": "Ano", "QuantidadeKPI": "Quantidade Faturada"}, text_auto=True, color_discrete_sequence=["black"])
-        fig_faturado_ano.update_layout(margin=dict(l=20, r=20, t=40, b=20))
-        st.plotly_chart(fig_faturado_ano, use_container_width=True)
+        with trace_stage("chart.faturado_mes"):
+            faturado_tempo_mes = dashboard_data["faturado_mes"]
+            fig_faturado_tempo = px.line(faturado_tempo_mes, x="DataCriacao", y="QuantidadeKPI", title="Volume Faturado por Mês", markers=True, labels={"DataCriacao": "Mês", "QuantidadeKPI": "Quantidade Faturada"}, color_discrete_sequence=["black"])
+            fig_faturado_tempo.update_layout(hovermode="x unified", margin=dict(l=20, r=20, t=40, b=20))
+            st.plotly_chart(fig_faturado_tempo, use_container_width=True)
+
+        with trace_stage("chart.faturado_ano"):
+            faturado_ano = dashboard_data["faturado_ano"]
+            fig_faturado_ano = px.bar(faturado_ano, x="Ano", y="QuantidadeKPI", title="Volume Faturado por Ano", labels={"Ano": "Ano", "QuantidadeKPI": "Quantidade Faturada"}, text_auto=True, color_discrete_sequence=["black"])
+            fig_faturado_ano.update_layout(margin=dict(l=20, r=20, t=40, b=20))
+            st.plotly_chart(fig_faturado_ano, use_container_width=True)
 
     st.markdown("---")
     st.subheader("Análise por Grupos")
@@ -446,26 +460,23 @@ else:
 
     with col_grupo1:
         if "Franqueado" in dff.columns:
-            franqueado_faturado = dff[dff["StatusKPI"] == "Faturado"]
-            franqueado_faturado = franqueado_faturado[franqueado_faturado["Franqueado"] != "Não Especificado"]
-            franqueado_faturado_vol = franqueado_faturado.groupby("Franqueado")["QuantidadeKPI"].sum().reset_index()
-            top_franqueados_faturado = franqueado_faturado_vol.nlargest(15, "QuantidadeKPI")
-            fig_franqueado_faturado = px.bar(top_franqueados_faturado, y="Franqueado", x="QuantidadeKPI", title="Top 15 Franqueados Faturados (Quantidade)", orientation="h", labels={"Franqueado": "Franqueado", "QuantidadeKPI": "Quantidade Total"}, color_discrete_sequence=["black"], text="QuantidadeKPI")
-            fig_franqueado_faturado.update_layout(xaxis_title="Quantidade Total", yaxis_title=None, margin=dict(l=20, r=20, t=40, b=20))
-            fig_franqueado_faturado.update_yaxes(autorange="reversed")
-            st.plotly_chart(fig_franqueado_faturado, use_container_width=True)
+            with trace_stage("chart.top_franqueados"):
+                top_franqueados_faturado = dashboard_data["top_franqueados"]
+                fig_franqueado_faturado = px.bar(top_franqueados_faturado, y="Franqueado", x="QuantidadeKPI", title="Top 15 Franqueados Faturados (Quantidade)", orientation="h", labels={"Franqueado": "Franqueado", "QuantidadeKPI": "Quantidade Total"}, color_discrete_sequence=["black"], text="QuantidadeKPI")
+                fig_franqueado_faturado.update_layout(xaxis_title="Quantidade Total", yaxis_title=None, margin=dict(l=20, r=20, t=40, b=20))
+                fig_franqueado_faturado.update_yaxes(autorange="reversed")
+                st.plotly_chart(fig_franqueado_faturado, use_container_width=True)
         else:
             st.info("Coluna 'Franqueado' não encontrada.")
 
     with col_grupo2:
         if "NomeCompletoZ" in dff.columns:
-            nome_faturado = dff[dff["StatusKPI"] == "Faturado"]
-            nome_faturado = nome_faturado[nome_faturado["NomeCompletoZ"] != "-"]
-            nome_faturado_vol = nome_faturado.groupby("NomeCompletoZ")["QuantidadeKPI"].sum().nlargest(10).reset_index()
-            fig_nome_faturado = px.bar(nome_faturado_vol, y="NomeCompletoZ", x="QuantidadeKPI", title="Top 10 Colaboradores Faturados (Quantidade)", orientation="h", labels={"NomeCompletoZ": "Colaborador", "QuantidadeKPI": "Quantidade Total"}, color_discrete_sequence=["black"], text="QuantidadeKPI")
-            fig_nome_faturado.update_layout(xaxis_title="Quantidade Total", yaxis_title=None, margin=dict(l=20, r=20, t=40, b=20))
-            fig_nome_faturado.update_yaxes(autorange="reversed")
-            st.plotly_chart(fig_nome_faturado, use_container_width=True)
+            with trace_stage("chart.top_colaboradores"):
+                nome_faturado_vol = dashboard_data["top_colaboradores"]
+                fig_nome_faturado = px.bar(nome_faturado_vol, y="NomeCompletoZ", x="QuantidadeKPI", title="Top 10 Colaboradores Faturados (Quantidade)", orientation="h", labels={"NomeCompletoZ": "Colaborador", "QuantidadeKPI": "Quantidade Total"}, color_discrete_sequence=["black"], text="QuantidadeKPI")
+                fig_nome_faturado.update_layout(xaxis_title="Quantidade Total", yaxis_title=None, margin=dict(l=20, r=20, t=40, b=20))
+                fig_nome_faturado.update_yaxes(autorange="reversed")
+                st.plotly_chart(fig_nome_faturado, use_container_width=True)
         else:
              st.info("Coluna 'NomeCompletoZ' não encontrada.")
 
@@ -475,39 +486,75 @@ else:
 
     with col_add1:
         if "BrandCategory" in dff.columns:
-            pie_data = dff.groupby("BrandCategory").size().reset_index(name='count')
-            fig_pie = px.pie(pie_data, names="BrandCategory", values="count", title="Distribuição por Categoria de Marca", color_discrete_sequence=px.colors.sequential.Darkmint)
-            fig_pie.update_layout(margin=dict(l=20, r=20, t=40, b=20))
-            st.plotly_chart(fig_pie, use_container_width=True)
+            with trace_stage("chart.pizza_categoria"):
+                pie_data = dashboard_data["pizza_categoria"]
+                fig_pie = px.pie(pie_data, names="BrandCategory", values="count", title="Distribuição por Categoria de Marca", color_discrete_sequence=px.colors.sequential.Darkmint)
+                fig_pie.update_layout(margin=dict(l=20, r=20, t=40, b=20))
+                st.plotly_chart(fig_pie, use_container_width=True)
         else:
             st.info("Coluna 'BrandCategory' não encontrada.")
 
     with col_add2:
         if "BrandCode" in dff.columns:
-            top10_brandcode = dff.groupby("BrandCode")["QuantidadeKPI"].sum().nlargest(10).reset_index()
-            fig_top10 = px.bar(top10_brandcode, x="BrandCode", y="QuantidadeKPI", title="Top 10 por Marca (Quantidade)", labels={"BrandCode": "Marca", "QuantidadeKPI": "Quantidade Total"}, color_discrete_sequence=["black"], text_auto=True)
-            fig_top10.update_layout(margin=dict(l=20, r=20, t=40, b=20))
-            st.plotly_chart(fig_top10, use_container_width=True)
+            with trace_stage("chart.top_marcas"):
+                top10_brandcode = dashboard_data["top_marcas"]
+                fig_top10 = px.bar(top10_brandcode, x="BrandCode", y="QuantidadeKPI", title="Top 10 por Marca (Quantidade)", labels={"BrandCode": "Marca", "QuantidadeKPI": "Quantidade Total"}, color_discrete_sequence=["black"], text_auto=True)
+                fig_top10.update_layout(margin=dict(l=20, r=20, t=40, b=20))
+                st.plotly_chart(fig_top10, use_container_width=True)
         else:
             st.info("Coluna 'BrandCode' não encontrada.")
 
     # --- Tabela de Dados Filtrados --- 
     st.markdown("---")
     st.subheader("Dados Filtrados")
-    # Usar st.dataframe para melhor interatividade (rolagem, ordenação)
-    # Selecionar colunas relevantes ou mostrar todas, se necessário
-    # Exemplo: Mostrar um subconjunto de colunas
+    # Tabela paginada no servidor: ordenação e recorte da página são feitos aqui e só a página
+    # visível é enviada ao navegador, qualquer que seja o número de linhas filtradas
     colunas_tabela = [
         'DataCriacao', 'Ano', 'MesNome', 'SemanaAno', 'NumPedido', 'StatusKPI', 
         'QuantidadeKPI', 'CanalBI', 'Franqueado', 'BrandCode', 'CollectionDesc'
     ]
     colunas_existentes_tabela = [col for col in colunas_tabela if col in dff.columns]
-    st.dataframe(dff[colunas_existentes_tabela], use_container_width=True)
-    # Ou mostrar todas as colunas do dataframe filtrado:
-    # st.dataframe(dff, use_container_width=True)
+    tab_col1, tab_col2, tab_col3, tab_col4 = st.columns([3, 2, 2, 2])
+    sort_column = tab_col1.selectbox("Ordenar por", options=["(ordem original)"] + colunas_existentes_tabela)
+    sort_descending = tab_col2.radio("Ordem", options=["Crescente", "Decrescente"], horizontal=True) == "Decrescente"
+    page_size = tab_col3.selectbox("Linhas por página", options=TABLE_PAGE_SIZES, index=TABLE_PAGE_SIZES.index(DEFAULT_PAGE_SIZE))
+    total_pages = page_count(len(dff), page_size)
+    page = tab_col4.number_input("Página", min_value=1, max_value=total_pages, value=1, step=1)
+
+    table_order = None
+    if sort_column in colunas_existentes_tabela:
+        # Ordem das linhas em cache por (versão, seleção, coluna, sentido), reutilizada entre páginas
+        table_order = get_chart_data(
+            f"table_order:{sort_column}:{'desc' if sort_descending else 'asc'}",
+            lambda: sort_order(dff, sort_column, ascending=not sort_descending),
+        )
+    with trace_stage("table.dados_filtrados", len(dff)) as stage:
+        page_df = get_page(dff, page, page_size, table_order, colunas_existentes_tabela)
+        st.dataframe(page_df, hide_index=True, use_container_width=True)
+        stage["rows_out"] = len(page_df)
+    first_row = (page - 1) * page_size + 1
+    st.caption(
+        f"Linhas {first_row:,}–{first_row + len(page_df) - 1:,} de {len(dff):,} | Página {page:,} de {total_pages:,}".replace(",", ".")
+    )
 
 # --- Assinatura Final --- (Fora do else para sempre aparecer, exceto se erro inicial)
 st.write("---")
 current_year_sig = datetime.now().year
 st.markdown(f"**_BI After Sales EssilorLuxottica | {current_year_sig}_**")
 st.markdown("_<small>Created by Willian Aleixo</small>_", unsafe_allow_html=True)
+
+# --- Painel de Desempenho (etapas desta execução, ao fim do script para incluir todas) ---
+with st.sidebar.expander("Desempenho"):
+    perf_records = perf_tracer.records(perf_run_id)
+    perf_seconds = sum(record["seconds"] for record in perf_records if record["depth"] == 0)
+    st.caption(f"Esta execução: {len(perf_records)} etapas medidas, {perf_seconds:.2f}s no total")
+    if perf_records:
+        perf_table = pd.DataFrame.from_records(perf_records, columns=["stage", "depth", "cache", "seconds", "rows_in", "rows_out", "rss_delta"])
+        perf_table["stage"] = ["  " * depth + stage for stage, depth in zip(perf_table["stage"], perf_table["depth"])]
+        perf_table["ms"] = (perf_table["seconds"] * 1000).round(1)
+        perf_table["memoria_mb"] = (perf_table["rss_delta"] / 1024 ** 2).round(1)
+        st.dataframe(perf_table[["stage", "ms", "rows_in", "rows_out", "memoria_mb", "cache"]], hide_index=True, use_container_width=True)
+    st.caption("Acumulado das execuções recentes (todas as sessões)")
+    st.dataframe(summarize_stages(perf_tracer.records()).round(3), hide_index=True, use_container_width=True)
+    if perf_tracer.log_path:
+        st.caption(f"Log JSONL: {os.path.abspath(perf_tracer.log_path)}")
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Times the dashboard hot paths on synthetic extracts and records throughput and peak memory.
+
+    python benchmarks/run_benchmarks.py                       # CSV 10k..1M, XLSX 10k..100k
+    python benchmarks/run_benchmarks.py --sizes 10000 10000000 --formats csv
+
+Each run appends one JSON line per (format, size, stage) to the results file, tagged with the
+current git commit, so numbers can be compared across commits.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import pandas as pd
+
+from synthetic_extract import XLSX_MAX_ROWS, generate_order_extract, write_extract
+from data_processor_streamlit_corrected_v2 import read_source_file, map_source_columns, clean_mapped_data, clean_csv_in_chunks, clean_excel_in_chunks
+from snapshot_store import save_snapshot, load_snapshot
+from filter_index import build_filter_index, apply_filter_index
+from kpi_cube import build_daily_cube, build_daily_totals, compute_comparative_kpis
+from chart_aggregates import compute_dashboard_aggregates
+from export_jobs import EXPORT_FORMATS, write_export
+from perf_trace import current_rss
+
+DEFAULT_SIZES = {"csv": [10000, 100000, 1000000], "xlsx": [10000, 100000]}
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+RESULTS_PATH = os.path.join(BENCH_DIR, "results", "results.jsonl")
+
+
+class _PeakSampler:
+    """Samples RSS in a background thread to catch the peak reached inside one stage."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start_rss = current_rss()
+        self.peak_rss = self.start_rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = current_rss()
+            if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+                self.peak_rss = rss
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        rss = current_rss()
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+
+def run_stage(results, context, stage, rows_in, func):
+    """Runs one stage, records wall time, rows, throughput and peak RSS above the stage start."""
+    with _PeakSampler() as sampler:
+        start = time.perf_counter()
+        output = func()
+        seconds = time.perf_counter() - start
+    rows_out = len(output) if isinstance(output, (pd.DataFrame, pd.Series)) else rows_in
+    peak_delta = (sampler.peak_rss - sampler.start_rss) if sampler.start_rss is not None else None
+    record = dict(context, stage=stage, seconds=round(seconds, 4), rows_in=rows_in, rows_out=rows_out,
+                  rows_per_sec=round(rows_in / seconds) if seconds > 0 else None,
+                  peak_mem_mb=round(peak_delta / 1024 ** 2, 1) if peak_delta is not None else None)
+    results.append(record)
+    print(f"  {stage:<24} {seconds:>9.3f}s  {record['rows_per_sec'] or 0:>12,} linhas/s  pico +{record['peak_mem_mb']} MB")
+    return output
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _extract_path(fmt, n_rows, seed):
+    path = os.path.join(DATA_DIR, f"extract_{n_rows}_{seed}.{fmt}")
+    if not os.path.exists(path):
+        print(f"Gerando extrato sintético de {n_rows} linhas ({fmt})...")
+        write_extract(generate_order_extract(n_rows, seed=seed), path)
+    return path
+
+
+def _quiet(func):
+    """Runs func with the pipeline's progress prints silenced, for stages without a verbose flag.
+
+    redirect_stdout swaps stdout for the whole process, which is fine here: the suite runs one
+    stage at a time and the RSS sampler thread does not print.
+    """
+    def wrapper():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func()
+    return wrapper
+
+
+def benchmark_extract(fmt, n_rows, seed, results, commit):
+    path = _extract_path(fmt, n_rows, seed)
+    context = {"commit": commit, "format": fmt, "rows": n_rows, "file_mb": round(os.path.getsize(path) / 1024 ** 2, 1)}
+    print(f"\n{fmt.upper()} {n_rows:,} linhas ({context['file_mb']} MB)")
+
+    clean_in_chunks = clean_csv_in_chunks if fmt == "csv" else clean_excel_in_chunks
+    run_stage(results, context, f"{fmt}_chunked_load", n_rows, _quiet(lambda: clean_in_chunks(path)[0]))
+
+    df_base = run_stage(results, context, "read", n_rows, _quiet(lambda: read_source_file(path, fmt == "csv", retries=1)))
+    df_mapped = run_stage(results, context, "map_columns", len(df_base), _quiet(lambda: map_source_columns(df_base)))
+    del df_base
+    df = run_stage(results, context, "clean", len(df_mapped), lambda: clean_mapped_data(df_mapped, verbose=False))
+    del df_mapped
+
+    snapshot_dir = tempfile.mkdtemp(prefix="bench_snapshot_")
+    try:
+        run_stage(results, context, "snapshot_write", len(df), _quiet(lambda: save_snapshot(df, path, snapshot_dir)))
+        run_stage(results, context, "snapshot_read", len(df), _quiet(lambda: load_snapshot(path, snapshot_dir)))
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    filter_index = run_stage(results, context, "filter_index_build", len(df), _quiet(lambda: build_filter_index(df)))
+    current_year = int(df["Ano"].max())
+    top_sales_org = str(df["SalesOrgE"].value_counts().index[0])
+    selections = {
+        "filter_ano": {"Ano": [str(current_year)]},
+        "filter_ano_faturado_org": {"Ano": [str(current_year)], "SalesOrgE": [top_sales_org], "CanalBI": ["Varejo", "Franquia"]},
+    }
+    views = {}
+    for name, selection in selections.items():
+        views[name] = run_stage(results, context, name, len(df), lambda: apply_filter_index(df, filter_index, selection))
+
+    cube = run_stage(results, context, "kpi_cube_build", len(df), _quiet(lambda: build_daily_cube(df)))
+    run_stage(results, context, "kpi_comparative", len(df), lambda: compute_comparative_kpis(build_daily_totals(cube)))
+    run_stage(results, context, "dashboard_aggregates", len(df), lambda: compute_dashboard_aggregates(df))
+
+    # Same work as the export behind the download buttons, capped at what one sheet can hold
+    export_view = views["filter_ano"].head(XLSX_MAX_ROWS)
+    export_dir = tempfile.mkdtemp(prefix="bench_export_")
+    try:
+        for export_format in EXPORT_FORMATS:
+            export_path = os.path.join(export_dir, f"export.{export_format}")
+            run_stage(results, context, f"export_{export_format}", len(export_view),
+                      lambda: write_export(export_view, export_format, export_path))
+    finally:
+        shutil.rmtree(export_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline do dashboard com extratos sintéticos.")
+    parser.add_argument("--sizes", type=int, nargs="+", help="Tamanhos (linhas); padrão depende do formato")
+    parser.add_argument("--formats", nargs="+", choices=["csv", "xlsx"], default=["csv", "xlsx"])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=RESULTS_PATH, help="Arquivo JSONL onde os resultados são acrescentados")
+    args = parser.parse_args(argv)
+
+    commit = _git_commit()
+    results = []
+    for fmt in args.formats:
+        for n_rows in (args.sizes or DEFAULT_SIZES[fmt]):
+            if fmt == "xlsx" and n_rows > XLSX_MAX_ROWS:
+                print(f"\nXLSX {n_rows:,} linhas ignorado: acima do limite de uma planilha ({XLSX_MAX_ROWS:,}).")
+                continue
+            benchmark_extract(fmt, n_rows, args.seed, results, commit)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    run_at = datetime.now().isoformat(timespec="seconds")
+    with open(args.output, "a", encoding="utf-8") as fp:
+        for record in results:
+            fp.write(json.dumps(dict(record, run_at=run_at), ensure_ascii=False) + "\n")
+    print(f"\n{len(results)} medições gravadas em {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Synthetic order extracts with the headers and cardinalities of the real BI export.
+
+    python benchmarks/synthetic_extract.py 100000 /tmp/extract_100k.csv
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Excel sheets stop at 1,048,576 rows (header included)
+XLSX_MAX_ROWS = 1048575
+
+STATUS_VALUES = ["Faturado", "Cancelado", "Em Aberto", "Bloqueado"]
+STATUS_WEIGHTS = [0.55, 0.15, 0.25, 0.05]
+CANAL_BI_VALUES = ["Varejo", "Franquia", "E-commerce", "Atacado", "Corporativo", "Óticas Parceiras"]
+CANAL_AA_VALUES = ["LOJA", "FRANQUIA", "DIGITAL", "B2B"]
+TRES_P_VALUES = ["3P", "LUX"]
+TIPO_CLIENTE_VALUES = ["Ótica", "Franquia", "Distribuidor", "Loja Própria"]
+COLLECTION_VALUES = ["Solar", "Receituário", "Esportivo", "Infantil", "Acessórios"]
+BRAND_CATEGORY_VALUES = ["Luxury", "Fashion", "Sport", "Proprietary"]
+OTICO_SPORT_VALUES = ["Otico", "Sport"]
+REJECT_REASON_VALUES = ["Z1", "Z2", "Z3", "Z4", "Z5", "Z6", "Z7", "Z8"]
+
+
+def _cardinality(n_rows, per_rows, minimum, maximum):
+    return int(min(max(n_rows // per_rows, minimum), maximum))
+
+
+def _pick(rng, pool, n_rows, weights=None, skew=None):
+    """Draws labels from pool; skew gives a Zipf-like popularity to high-cardinality pools."""
+    if skew is not None:
+        ranks = np.arange(1, len(pool) + 1, dtype=np.float64)
+        weights = 1.0 / ranks ** skew
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)
+        weights = weights / weights.sum()
+    codes = rng.choice(len(pool), size=n_rows, p=weights)
+    return pd.Categorical.from_codes(codes, categories=pool)
+
+
+def _with_missing(rng, values, rate):
+    """Blanks a share of the values, as the export does for optional fields."""
+    series = pd.Series(values)
+    if rate > 0:
+        series = series.astype(object)
+        series[rng.random(len(series)) < rate] = None
+    return series
+
+
+def generate_order_extract(n_rows, seed=42, start="2020-01-01", end="2025-06-30"):
+    """Builds an order-line extract with the source headers expected by map_source_columns.
+
+    Cardinalities grow with the row count the way they do in production: a few channels and
+    sales organizations, hundreds of brands, thousands of franchise groups and tens of
+    thousands of collaborators; orders carry three lines on average.
+    """
+    rng = np.random.default_rng(seed)
+    start_ts = pd.Timestamp(start)
+    n_days = (pd.Timestamp(end) - start_ts).days + 1
+
+    # Business days dominate; volume grows slowly over the years
+    day_offsets = np.sort((rng.random(n_rows) ** 0.8 * n_days).astype(np.int64))
+    dates = start_ts + pd.to_timedelta(day_offsets, unit="D")
+    weekend = dates.dayofweek >= 5
+    dates = dates.where(~(weekend & (rng.random(n_rows) < 0.7)), dates - pd.to_timedelta(dates.dayofweek - 4, unit="D"))
+
+    n_orders = max(n_rows // 3, 1)
+    order_numbers = 4000000000 + np.sort(rng.integers(0, n_orders, size=n_rows))
+
+    n_franqueados = _cardinality(n_rows, 500, 20, 3000)
+    n_colaboradores = _cardinality(n_rows, 50, 50, 40000)
+    n_brands = _cardinality(n_rows, 5000, 20, 180)
+    n_sales_orgs = _cardinality(n_rows, 100000, 3, 12)
+
+    franqueados = [f"GRUPO FRANQUEADO {i:04d}" for i in range(n_franqueados)]
+    colaboradores = [f"Colaborador {i:05d} da Silva" for i in range(n_colaboradores)] + ["-"]
+    brands = [f"BR{i:03d}" for i in range(n_brands)]
+    sales_orgs = [f"BR{i:02d}" for i in range(1, n_sales_orgs + 1)]
+
+    status = _pick(rng, STATUS_VALUES, n_rows, weights=STATUS_WEIGHTS)
+    quantities = rng.geometric(0.35, size=n_rows)
+    gross = np.round(quantities * rng.uniform(80, 1500, size=n_rows), 2)
+    reject = np.where(np.asarray(status) == "Cancelado", np.asarray(_pick(rng, REJECT_REASON_VALUES, n_rows), dtype=object), None)
+
+    df = pd.DataFrame({
+        "Order Creation Date: Date": dates,
+        "Tipo Cliente": _with_missing(rng, _pick(rng, TIPO_CLIENTE_VALUES, n_rows), 0.02),
+        "Nome Completo": _pick(rng, colaboradores, n_rows, skew=0.8),
+        "CANAL": _pick(rng, CANAL_AA_VALUES, n_rows),
+        "3P": _pick(rng, TRES_P_VALUES, n_rows, weights=[0.3, 0.7]),
+        "Customer By SO: Buying Group Name": _with_missing(rng, _pick(rng, franqueados, n_rows, skew=1.0), 0.05),
+        "Sales Organization Code": _pick(rng, sales_orgs, n_rows, skew=0.6),
+        "STATUS": status,
+        "Orders - TOTAL Orders Qty": quantities,
+        "Orders - TOTAL Gross Amount (Document Currency)": gross,
+        "Orders Detail - Order Document Number": order_numbers,
+        "Reject Reason Code": reject,
+        "Brand & Segment - Code": _pick(rng, brands, n_rows, skew=1.1),
+        "PLM Attributes - Collection Mix Desc": _pick(rng, COLLECTION_VALUES, n_rows),
+        "Brand & Segment - Category": _pick(rng, BRAND_CATEGORY_VALUES, n_rows),
+        "Otico/Sport": _pick(rng, OTICO_SPORT_VALUES, n_rows, weights=[0.8, 0.2]),
+        "Canal": _pick(rng, CANAL_BI_VALUES, n_rows, skew=0.7),
+    })
+    return df
+
+
+def write_extract(df, path):
+    """Writes the extract as XLSX or CSV depending on the file extension."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.lower().endswith(".csv"):
+        df.to_csv(path, index=False, date_format="%Y-%m-%d")
+    else:
+        if len(df) > XLSX_MAX_ROWS:
+            raise ValueError(f"XLSX suporta no máximo {XLSX_MAX_ROWS} linhas de dados ({len(df)} pedidas).")
+        with pd.ExcelWriter(path, engine="xlsxwriter") as writer:
+            df.to_excel(writer, index=False, sheet_name="Sheet1")
+    return path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    write_extract(generate_order_extract(int(sys.argv[1])), sys.argv[2])
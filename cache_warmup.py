@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Warm-up of the result cache for the most used filter views.
+
+Each time a dataset version is built, the declared popular selections (no filters, the current
+Ano, each CanalBI, each SalesOrgE...) and the permalinks most opened by users are computed once
+through the same DatasetStore calls the page makes (facets, filtered view, dashboard aggregates),
+so the first page load of those views after a deploy or a refresh is a cache hit.
+
+Warm-up specs map a dimension to values, to WARMUP_EACH (one selection per option of the
+dimension) or to WARMUP_CURRENT_YEAR (Ano only: the current year, else the latest one loaded).
+"""
+import json
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+
+from dataset_store import normalize_selection, selection_key
+from chart_aggregates import compute_dashboard_aggregates
+from kpi_cube import build_daily_totals
+from query_backend import get_query_backend
+from perf_trace import trace_stage
+
+WARMUP_EACH = "*"
+WARMUP_CURRENT_YEAR = "current"
+DEFAULT_WARMUP_SPECS = [
+    {},
+    {"Ano": WARMUP_CURRENT_YEAR},
+    {"CanalBI": WARMUP_EACH},
+    {"SalesOrgE": WARMUP_EACH},
+]
+# Permalinks warmed on each load, most opened first
+DEFAULT_MAX_PERMALINKS = 20
+PERMALINKS_FILE_NAME = "permalinks.json"
+
+
+def expand_warmup_specs(specs, catalog, today=None):
+    """Turns warm-up specs into concrete {dimension: [values]} selections, without duplicates.
+
+    catalog is the dataset's filter_catalog. Dimensions or values absent from the data are dropped,
+    and selections that only differ by a dimension with every option selected count once.
+    """
+    today = today or datetime.now()
+    expanded = []
+    for spec in specs:
+        selections = [{}]
+        for col, values in spec.items():
+            options = catalog.get(col, {}).get("options", [])
+            if values == WARMUP_EACH:
+                choices = [[value] for value in options]
+            elif values == WARMUP_CURRENT_YEAR:
+                year = str(today.year) if str(today.year) in options else (options[-1] if options else None)
+                choices = [[year]] if year is not None else []
+            else:
+                values = [values] if isinstance(values, str) else values
+                choices = [[str(value) for value in values if str(value) in options]]
+            selections = [dict(selection, **{col: choice}) for selection in selections for choice in choices if choice]
+        expanded.extend(selections)
+    unique = {}
+    for selection in expanded:
+        unique.setdefault(normalize_selection(selection, catalog), selection)
+    return list(unique.values())
+
+
+class PermalinkTracker:
+    """Counts the filter selections that sessions opened from URL query params (shared permalinks).
+
+    Counts are kept in memory and, when path is given, saved as JSON so they survive restarts.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as fp:
+                    for item in json.load(fp):
+                        self._counts[normalize_selection(item["selection"])] += int(item["count"])
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"Warning: Arquivo de permalinks ilegível ({path}): {e}")
+
+    def record(self, selections):
+        """Counts one opening of a permalink selection; selections with no values are ignored."""
+        key = normalize_selection(selections)
+        if not key:
+            return
+        with self._lock:
+            self._counts[key] += 1
+            items = [{"selection": {col: list(values) for col, values in key}, "count": count}
+                     for key, count in self._counts.most_common()]
+        self._save(items)
+
+    def top(self, n=DEFAULT_MAX_PERMALINKS):
+        """Returns the n most opened selections as {dimension: [values]}."""
+        with self._lock:
+            return [{col: list(values) for col, values in key} for key, _ in self._counts.most_common(n)]
+
+    def _save(self, items):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fp:
+                json.dump(items, fp, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Warning: Não foi possível salvar os permalinks em {self.path}: {e}")
+            self.path = None
+
+
+def warm_selection(store, dataset, selections, query_backend="pandas"):
+    """Computes and caches what the page needs for one selection: facets, view and dashboard data."""
+    store.get_facets(dataset, selections)
+    query_dataset = store.resolve_dataset(dataset, selections)
+    view = store.get_filtered_view(query_dataset, selections)
+
+    def compute_dashboard_data():
+        if query_backend == "pandas":
+            return compute_dashboard_aggregates(view)
+        return get_query_backend(query_dataset, query_backend).compute_aggregates(selections)
+    store.get_aggregate(query_dataset, selections, "dashboard", compute_dashboard_data)
+
+
+def warm_dataset(store, dataset, selections, query_backend="pandas"):
+    """Warms every selection in order; a failing selection is reported and skipped. Returns how many were warmed."""
+    # The comparative KPI series do not depend on the selection
+    store.get_aggregate(dataset, {}, "daily_totals", lambda: build_daily_totals(dataset["cube"]))
+    warmed = 0
+    with trace_stage("warmup", len(dataset["df"]), selections=len(selections), version=dataset["version"]) as stage:
+        for selection in selections:
+            try:
+                warm_selection(store, dataset, selection, query_backend)
+                warmed += 1
+            except Exception as e:
+                print(f"Warning: Falha no pré-aquecimento da seleção {selection}: {e}")
+        stage["rows_out"] = warmed
+    print(f"Pré-aquecimento do cache: {warmed} de {len(selections)} seleções (versão {dataset['version']}).")
+    return warmed
+
+
+def make_warmup(specs=None, permalinks=None, max_permalinks=DEFAULT_MAX_PERMALINKS, query_backend="pandas"):
+    """Builds the warm-up callback of DatasetStore.set_warmup from specs and a PermalinkTracker."""
+    specs = DEFAULT_WARMUP_SPECS if specs is None else specs
+
+    def warmup(store, dataset):
+        selections = expand_warmup_specs(specs, dataset["filter_catalog"])
+        if permalinks is not None:
+            selections += permalinks.top(max_permalinks)
+        unique = {}
+        for selection in selections:
+            unique.setdefault(selection_key(dataset, selection), selection)
+        return warm_dataset(store, dataset, list(unique.values()), query_backend)
+    return warmup
+
+
+_TRACKER = None
+_TRACKER_LOCK = threading.Lock()
+
+
+def get_permalink_tracker(path=None):
+    """Returns the single PermalinkTracker of this process (path applies when it is first created)."""
+    global _TRACKER
+    if _TRACKER is None:
+        with _TRACKER_LOCK:
+            if _TRACKER is None:
+                _TRACKER = PermalinkTracker(path)
+    return _TRACKER
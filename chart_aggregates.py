@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+from perf_trace import trace_stage
+
+STATUS_FATURADO = "Faturado"
+STATUS_CANCELADO = "Cancelado"
+TOP_FRANQUEADOS = 15
+TOP_COLABORADORES = 10
+TOP_MARCAS = 10
+# Ranking charts: aggregate id -> (dimension, N, billed rows only, sentinel labels left out of the ranking)
+TOP_RANKINGS = {
+    "top_franqueados": ("Franqueado", TOP_FRANQUEADOS, True, ("Não Especificado",)),
+    "top_colaboradores": ("NomeCompletoZ", TOP_COLABORADORES, True, ("-",)),
+    "top_marcas": ("BrandCode", TOP_MARCAS, False, ()),
+}
+
+
+def _codes_and_labels(series):
+    """Returns integer codes (-1 for missing) and the label of each code for a dimension column."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), series.cat.categories
+    codes, uniques = pd.factorize(series)
+    return codes, pd.Index(uniques)
+
+
+def _grouped_sum(codes, n_groups, weights):
+    """Sums weights per code with one bincount; missing codes (-1) are ignored."""
+    valid = codes >= 0
+    return np.bincount(codes[valid], weights=weights[valid], minlength=n_groups)
+
+
+def top_n_codes(totals, eligible, n):
+    """Returns the codes of the n largest totals among the eligible codes, largest first.
+
+    Ties keep code order (label order for sorted categories), like nlargest(keep='first').
+    The n-th largest total is found by partial selection (argpartition), so only the winners
+    are sorted: linear in the number of groups plus n log n.
+    """
+    candidates = np.flatnonzero(eligible)
+    if n <= 0:
+        return candidates[:0]
+    if len(candidates) > n:
+        values = totals[candidates]
+        kth = len(values) - n
+        threshold = values[np.argpartition(values, kth)[kth]]
+        above = candidates[values > threshold]
+        # Among groups tied at the threshold, the lowest codes make the cut
+        ties = candidates[values == threshold][:n - len(above)]
+        candidates = np.sort(np.concatenate([above, ties]))
+    return candidates[np.argsort(-totals[candidates], kind="stable")]
+
+
+def rank_top_n(series, weights, n, mask=None, exclude=()):
+    """Ranks the values of a dimension column by summed weights over the rows under mask.
+
+    Works on the integer category codes: one bincount for the totals and one for the row
+    counts of the masked codes, sentinel labels in exclude dropped by code, then top_n_codes.
+    Values with no row under mask are not ranked. Returns (labels, totals), largest first.
+    """
+    codes, labels = _codes_and_labels(series)
+    selected = codes >= 0
+    if mask is not None:
+        selected &= mask
+    selected_codes = codes[selected]
+    totals = np.bincount(selected_codes, weights=weights[selected], minlength=len(labels))
+    eligible = np.bincount(selected_codes, minlength=len(labels)) > 0
+    if exclude:
+        excluded = labels.get_indexer(list(exclude))
+        eligible[excluded[excluded >= 0]] = False
+    top = top_n_codes(totals, eligible, n)
+    return labels[top], totals[top]
+
+
+def _monthly_frame(month_index, weights, mask):
+    """Sums weights by calendar month over the contiguous range of months present under mask."""
+    if not mask.any():
+        return pd.DataFrame({"DataCriacao": pd.DatetimeIndex([]), "QuantidadeKPI": np.array([], dtype=np.int64)})
+    months = month_index[mask]
+    first_month = int(months.min())
+    totals = np.bincount(months - first_month, weights=weights[mask])
+    start = pd.Timestamp(year=first_month // 12, month=first_month % 12 + 1, day=1)
+    return pd.DataFrame({
+        "DataCriacao": pd.date_range(start, periods=len(totals), freq="MS"),
+        "QuantidadeKPI": totals.astype(np.int64),
+    })
+
+
+def _yearly_frame(years, weights, mask):
+    """Sums weights by year, for the years present under mask."""
+    if not mask.any():
+        return pd.DataFrame({"Ano": np.array([], dtype=years.dtype), "QuantidadeKPI": np.array([], dtype=np.int64)})
+    selected = years[mask]
+    first_year = int(selected.min())
+    totals = np.bincount(selected - first_year, weights=weights[mask])
+    counts = np.bincount(selected - first_year)
+    present = np.flatnonzero(counts)
+    return pd.DataFrame({"Ano": present + first_year, "QuantidadeKPI": totals[present].astype(np.int64)})
+
+
+def compute_dashboard_aggregates(dff):
+    """Computes the data of every dashboard chart and of the filtered status KPIs in one pass.
+
+    The status mask, the quantity weights and the month/year keys are derived once; each chart is
+    then a single bincount over integer (category) codes, and each ranking a rank_top_n. Returns a dict of small frames shaped
+    like the previous per-chart groupby results, plus the status totals.
+    """
+    n_rows = len(dff)
+    with trace_stage("aggregate.status", n_rows):
+        quantities = dff["QuantidadeKPI"].to_numpy(dtype=np.int64)
+        status_codes, status_labels = _codes_and_labels(dff["StatusKPI"])
+        status_totals = _grouped_sum(status_codes, len(status_labels), quantities)
+        status_by_label = dict(zip(map(str, status_labels), status_totals))
+
+        faturado_code = status_labels.get_indexer([STATUS_FATURADO])[0]
+        faturado = status_codes == faturado_code if faturado_code >= 0 else np.zeros(n_rows, dtype=bool)
+        everything = np.ones(n_rows, dtype=bool)
+
+        qtd_criada = int(quantities.sum())
+        qtd_cancelada = int(status_by_label.get(STATUS_CANCELADO, 0))
+        qtd_faturada = int(status_by_label.get(STATUS_FATURADO, 0))
+        aggregates = {
+            "status": {
+                "criada": qtd_criada,
+                "cancelada": qtd_cancelada,
+                "faturada": qtd_faturada,
+                # Aberta = Criada - Cancelada - Faturada (considerando apenas esses 3 status principais)
+                "aberta": qtd_criada - qtd_cancelada - qtd_faturada,
+            },
+        }
+
+    with trace_stage("aggregate.time_series", n_rows):
+        years = dff["Ano"].to_numpy().astype(np.int64)
+        month_index = years * 12 + (dff["MesNumero"].to_numpy().astype(np.int64) - 1)
+        aggregates["criado_mes"] = _monthly_frame(month_index, quantities, everything)
+        aggregates["faturado_mes"] = _monthly_frame(month_index, quantities, faturado)
+        aggregates["criado_ano"] = _yearly_frame(years, quantities, everything)
+        aggregates["faturado_ano"] = _yearly_frame(years, quantities, faturado)
+
+    for aggregate_id, (col, n, faturado_only, exclude) in TOP_RANKINGS.items():
+        if col not in dff.columns:
+            continue
+        with trace_stage(f"aggregate.{aggregate_id}", n_rows):
+            top_labels, top_totals = rank_top_n(dff[col], quantities, n, faturado if faturado_only else None, exclude)
+            aggregates[aggregate_id] = pd.DataFrame({col: top_labels, "QuantidadeKPI": top_totals.astype(np.int64)})
+
+    if "BrandCategory" in dff.columns:
+        with trace_stage("aggregate.pizza_categoria", n_rows):
+            codes, labels = _codes_and_labels(dff["BrandCategory"])
+            counts = np.bincount(codes[codes >= 0], minlength=len(labels))
+            present = np.flatnonzero(counts)
+            aggregates["pizza_categoria"] = pd.DataFrame({"BrandCategory": labels[present], "count": counts[present]})
+
+    return aggregates
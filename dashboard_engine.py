@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Headless processing engine of the dashboard: loading, cleaning, KPIs and chart data.
+
+Nothing here imports Streamlit or Plotly, so it can run from cron or a worker process.
+From the command line it cleans the source extract and writes the Parquet snapshot plus
+the precomputed daily cube and unfiltered dashboard aggregates, which the dashboard picks
+up on start instead of recomputing them:
+
+    python dashboard_engine.py upload/teste_d11.xlsx
+    python dashboard_engine.py export.csv --csv --snapshot-dir /srv/bi/cache
+    python dashboard_engine.py "upload/por_org/*.xlsx" --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from data_processor_streamlit_corrected_v2 import load_and_clean_data_with_snapshot
+from kpi_cube import build_daily_cube, build_daily_totals, compute_comparative_kpis
+from chart_aggregates import compute_dashboard_aggregates
+from snapshot_store import save_artifact, load_artifact
+from multi_source_loader import is_multi_source, load_and_clean_sources
+
+# Day x status cube; the name changed when the 8 filter dimensions were dropped, so older cubes are ignored
+CUBE_ARTIFACT = "cube_daily"
+DASHBOARD_ARTIFACT_PREFIX = "dashboard."
+DASHBOARD_FRAMES = [
+    "criado_mes", "faturado_mes", "criado_ano", "faturado_ano",
+    "top_franqueados", "top_colaboradores", "pizza_categoria", "top_marcas"
+]
+
+__all__ = [
+    "load_and_clean_data_with_snapshot", "build_daily_cube", "build_daily_totals", "compute_comparative_kpis",
+    "compute_dashboard_aggregates", "load_daily_cube", "save_dashboard_aggregates",
+    "load_dashboard_aggregates", "load_and_clean_sources", "precompute", "main",
+]
+
+
+def load_daily_cube(file_path, df=None, snapshot_dir=None):
+    """Returns the precomputed daily cube of the source if still current, else builds it from df."""
+    cube = load_artifact(file_path, CUBE_ARTIFACT, snapshot_dir)
+    if cube is not None:
+        print(f"Cubo diário pré-calculado carregado ({len(cube)} células).")
+        return cube
+    if df is None:
+        return None
+    return build_daily_cube(df)
+
+
+def save_dashboard_aggregates(aggregates, file_path, snapshot_dir=None):
+    """Stores the unfiltered dashboard aggregates beside the snapshot (one Parquet file per chart)."""
+    saved = save_artifact(pd.DataFrame([aggregates["status"]]), file_path, DASHBOARD_ARTIFACT_PREFIX + "status", snapshot_dir)
+    for name in DASHBOARD_FRAMES:
+        if name in aggregates:
+            saved = save_artifact(aggregates[name], file_path, DASHBOARD_ARTIFACT_PREFIX + name, snapshot_dir) and saved
+    return saved
+
+
+def load_dashboard_aggregates(file_path, snapshot_dir=None):
+    """Reassembles the precomputed unfiltered dashboard aggregates, or returns None if any is stale."""
+    status = load_artifact(file_path, DASHBOARD_ARTIFACT_PREFIX + "status", snapshot_dir)
+    if status is None or status.empty:
+        return None
+    aggregates = {"status": {key: int(value) for key, value in status.iloc[0].items()}}
+    for name in DASHBOARD_FRAMES:
+        frame = load_artifact(file_path, DASHBOARD_ARTIFACT_PREFIX + name, snapshot_dir)
+        if frame is not None:
+            aggregates[name] = frame
+    return aggregates
+
+
+def precompute(file_path, is_csv=False, snapshot_dir=None, incremental=True, all_sheets=False, max_workers=None):
+    """Cleans the source into its snapshot and writes the cube and unfiltered aggregates next to it.
+
+    A directory or glob source is loaded in parallel by load_and_clean_sources; its files get
+    their own snapshots, but no artifacts are written since those are keyed on a single file.
+    Returns a summary dict, or None when the source could not be loaded.
+    """
+    start_time = time.time()
+    multi_source = is_multi_source(file_path)
+    if multi_source:
+        df = load_and_clean_sources(file_path, all_sheets, max_workers, snapshot_dir)
+    else:
+        df = load_and_clean_data_with_snapshot(file_path, is_csv, snapshot_dir, incremental=incremental)
+    if df is None:
+        return None
+    load_seconds = time.time() - start_time
+
+    cube = build_daily_cube(df)
+    aggregates = compute_dashboard_aggregates(df)
+    if not multi_source:
+        save_artifact(cube, file_path, CUBE_ARTIFACT, snapshot_dir)
+        save_dashboard_aggregates(aggregates, file_path, snapshot_dir)
+    kpis = compute_comparative_kpis(build_daily_totals(cube))
+
+    return {
+        "source": os.path.abspath(file_path),
+        "rows": int(len(df)),
+        "cube_cells": int(len(cube)),
+        "load_seconds": round(load_seconds, 3),
+        "total_seconds": round(time.time() - start_time, 3),
+        "status": aggregates["status"],
+        "comparative_kpis": {key: value for key, value in kpis.items() if isinstance(value, (int, float))},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera o snapshot limpo e os agregados pré-calculados do dashboard.")
+    parser.add_argument("source", help="Arquivo de origem (XLSX ou CSV), ou diretório/glob com vários arquivos")
+    parser.add_argument("--csv", action="store_true", help="O arquivo de origem é CSV")
+    parser.add_argument("--snapshot-dir", default=None, help="Diretório do snapshot (padrão: .snapshot_cache ao lado da origem); use o mesmo SNAPSHOT_DIR no dashboard")
+    parser.add_argument("--full", action="store_true", help="Reprocessa o arquivo inteiro em vez da carga incremental (descarta o histórico de pedidos ausentes do arquivo)")
+    parser.add_argument("--all-sheets", action="store_true", help="Carrega todas as planilhas de cada arquivo (diretório/glob)")
+    parser.add_argument("--workers", type=int, default=None, help="Processos paralelos para diretório/glob (padrão: um por núcleo)")
+    args = parser.parse_args(argv)
+
+    if not (os.path.exists(args.source) or is_multi_source(args.source)):
+        print(f"Error: File not found at {args.source}", file=sys.stderr)
+        return 1
+    is_csv = args.csv or args.source.lower().endswith(".csv")
+    summary = precompute(args.source, is_csv, args.snapshot_dir, incremental=not args.full,
+                         all_sheets=args.all_sheets, max_workers=args.workers)
+    if summary is None:
+        print(f"Falha ao carregar ou processar dados de {args.source}.", file=sys.stderr)
+        return 1
+    print(json.dumps(summary, ensure_ascii=False, indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,35 +2,698 @@
 import pandas as pd
 import numpy as np
 import os
+import contextlib
+import hashlib
+import threading
 import time # Import time for retry delay
 import shutil # Import shutil for file copy
 import traceback # For detailed error logging
-import locale # Import locale for month names
 
-import streamlit as st
+from snapshot_store import load_snapshot, load_snapshot_history, save_snapshot, compute_content_hash, get_source_signature, read_manifest
+from partition_store import ensure_partitions
+from perf_trace import trace_stage, traced
 
-@st.cache_data(show_spinner=False)
-def load_and_clean_data_streamlit_cached(file_path, is_csv=False):
-    # Ensure locale setting is consistent across cached calls if needed,
-    # or handle locale within the non-cached function only.
-    # For simplicity, we call the main function which handles locale.
-    return load_and_clean_data_streamlit(file_path, is_csv)
+# Month names are a fixed table (no locale), ordered so MesNome sorts chronologically
+MONTH_NAMES_PT = [
+    "Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
+    "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"
+]
+MONTH_NAME_DTYPE = pd.CategoricalDtype(categories=MONTH_NAMES_PT, ordered=True)
 
-def load_and_clean_data_streamlit(file_path, is_csv=False, retries=3, delay=3):
-    """Loads data from the specified file (Excel or CSV), cleans it, and prepares it for the Streamlit dashboard."""
-    import traceback
+# Declared dtype plan of the cleaned frame (applied by apply_dtype_plan). Integer columns are
+# downcast only when every value fits; low-cardinality text is categorical, order numbers are
+# Arrow-backed strings.
+CATEGORICAL_COLUMNS = [
+    "TipoClienteY", "CanalAA", "TresP_AH", "SalesOrgE", "StatusKPI",
+    "BrandCode", "CollectionDesc", "BrandCategory", "OticoSport", "CanalBI",
+    "GrupoFranqueadoW", "MotivoRejeicao"
+]
+CATEGORICAL_FILL_VALUE = "Não Especificado"
+OUTPUT_DTYPE_PLAN = {
+    "Ano": "int16",
+    "MesNumero": "int8",
+    "SemanaAno": "int8",
+    "QuantidadeKPI": "int32",
+    "ValorFaturadoKPI": "float64",
+    "NumPedido": "string",
+    "NomeCompletoZ": "category",
+}
+try:
+    import pyarrow # noqa: F401
+    STRING_DTYPE = pd.StringDtype("pyarrow")
+except ImportError:
+    STRING_DTYPE = pd.StringDtype()
+
+# Rows are matched between refreshes by order number + creation date
+INCREMENTAL_KEY_COLUMNS = ["NumPedido", "DataCriacao"]
+
+# Source extracts are parsed in chunks of this many rows, so peak memory does not grow with the file
+SOURCE_CHUNK_ROWS = 200000
+
+# Columns clean_mapped_data cannot do without: a header lacking any of them fails before the rows are read
+REQUIRED_TARGET_COLUMNS = ["DataCriacao", "QuantidadeKPI", "ValorFaturadoKPI"]
+
+# Rust-based XLSX reader, several times faster than openpyxl; optional
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+def load_and_clean_data_with_snapshot(file_path, is_csv=False, snapshot_dir=None, incremental=True):
+    """Returns the cleaned frame from the on-disk snapshot, re-parsing the source only when it changed.
+
+    When the source changed and a previous snapshot exists, only new or changed orders are
+    cleaned and merged into it (see load_and_clean_data_incremental). The Ano/MesNumero
+    partitioned copy of the snapshot (partition_store) is kept in step with it.
+    That history is only kept in the snapshot cache: a full reprocess (incremental=False or
+    the fallback after a failed incremental load) rebuilds it from the current extract alone,
+    and a warning is printed when an existing history is dropped.
+    """
+    if not os.path.exists(file_path):
+        return load_and_clean_data_streamlit(file_path, is_csv)
+
+    df_snapshot = load_snapshot(file_path, snapshot_dir)
+    if df_snapshot is not None:
+        ensure_partitions(df_snapshot, file_path, snapshot_dir)
+        return df_snapshot
+
+    # Key of the source as it is before the parse: a file replaced meanwhile no longer matches it
+    source_signature = get_source_signature(file_path)
+    content_hash = compute_content_hash(file_path)
+    df_history, keys_history = (None, None)
+    if incremental:
+        df_history, keys_history = load_snapshot_history(file_path, snapshot_dir)
+    elif read_manifest(file_path, snapshot_dir):
+        print("Warning: Reprocessamento completo. O histórico do snapshot é substituído pelo arquivo fonte: "
+              "pedidos ausentes dele deixam de aparecer.")
+
+    df_clean, keys_clean = load_and_clean_data_incremental(file_path, df_history, keys_history, is_csv)
+    if df_clean is None and df_history is not None:
+        print("Warning: Carga incremental falhou. Reprocessando o arquivo completo: "
+              "pedidos do histórico ausentes do arquivo fonte deixam de aparecer.")
+        df_clean, keys_clean = load_and_clean_data_incremental(file_path, None, None, is_csv)
+    if df_clean is not None and save_snapshot(df_clean, file_path, snapshot_dir, content_hash=content_hash, row_keys=keys_clean,
+                                             source_signature=source_signature):
+        ensure_partitions(df_clean, file_path, snapshot_dir)
+    return df_clean
+
+def compute_key_ids(num_pedido, data_criacao):
+    """Hashes (NumPedido, DataCriacao) pairs into uint64 ids that match between raw and cleaned rows."""
+    num_pedido = pd.Series(num_pedido)
+    # Missing order numbers hash the same whether they arrive as NaN (raw) or <NA> (Arrow string)
+    key_frame = pd.DataFrame({
+        "NumPedido": num_pedido.astype(str).where(num_pedido.notna(), "").to_numpy(dtype=object),
+        "DataCriacao": pd.to_datetime(pd.Series(data_criacao), errors="coerce").astype("datetime64[ns]").to_numpy(),
+    })
+    return pd.util.hash_pandas_object(key_frame, index=False).to_numpy()
+
+def compute_group_hashes(df_mapped):
+    """Returns per-row key ids and one KeyHash/GroupHash pair per order group of the renamed raw frame.
+
+    GroupHash is the (wrapping) sum of the row hashes, so it does not depend on row order.
+    """
+    row_key_ids = compute_key_ids(df_mapped["NumPedido"], df_mapped["DataCriacao"])
+    row_hashes = pd.util.hash_pandas_object(df_mapped, index=False).to_numpy()
+    keys = (
+        pd.DataFrame({"KeyHash": row_key_ids, "GroupHash": row_hashes})
+        .groupby("KeyHash", sort=False)["GroupHash"].sum()
+        .reset_index()
+    )
+    return row_key_ids, keys
+
+def concat_cleaned_frames(frames):
+    """Concatenates cleaned frames keeping categorical columns categorical (categories are unioned)."""
+    frames = [frame for frame in frames if frame is not None]
+    if not frames:
+        return None
+    if len(frames) == 1:
+        return frames[0]
+
+    frames = [frame.copy(deep=False) for frame in frames]
+    for col in frames[0].columns:
+        dtypes = [frame[col].dtype for frame in frames if col in frame.columns]
+        if not all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+            continue
+        if all(dtype == dtypes[0] for dtype in dtypes):
+            continue
+        categories = dtypes[0].categories.append([dtype.categories for dtype in dtypes[1:]]).unique()
+        if not dtypes[0].ordered:
+            categories = categories.sort_values()
+        for frame in frames:
+            if col in frame.columns:
+                frame[col] = frame[col].cat.set_categories(categories, ordered=dtypes[0].ordered)
+    return pd.concat(frames, ignore_index=True)
+
+def load_and_clean_data_incremental(file_path, df_history=None, keys_history=None, is_csv=False, chunk_rows=SOURCE_CHUNK_ROWS):
+    """Upserts the source extract into an already cleaned history.
+
+    Only rows whose (NumPedido, DataCriacao) group is new or changed since the last load go
+    through clean_mapped_data. History groups absent from the extract are kept, since daily
+    drops only carry the latest orders. Without history every row is cleaned.
+    Groups are keyed by date too, so when an order's DataCriacao is corrected the group under
+    the old date is never removed: both stay, and that order's rows are counted twice.
+    Sources are streamed in chunks of chunk_rows. With history, the raw chunks are only hashed
+    (hash_and_keep_changed), keeping the raw rows of groups that may have changed; once the
+    file is read the exact changed groups are known and only their rows are cleaned, so the
+    refresh cost past the parse follows the delta. chunk_rows=None reads the whole file at once
+    with read_source_file instead.
+    Returns (df_clean, keys) or (None, None) on failure.
+    """
+    try:
+        has_history = df_history is not None and keys_history is not None and not df_history.empty
+        if chunk_rows and not has_history:
+            df_streamed, keys_new = clean_chunked_source(file_path, is_csv, chunk_rows)
+            if df_streamed is None or keys_new is None:
+                return df_streamed, None
+
+            def clean_delta(dirty_key_ids):
+                return df_streamed
+        elif chunk_rows:
+            source_label = "CSV" if is_csv else "XLSX"
+            with source_chunks(file_path, is_csv, chunk_rows) as (plan, chunks):
+                if plan is None or not plan["with_keys"]:
+                    # Without the key columns the caller reprocesses the whole file
+                    return None, None
+                candidates, keys_new = hash_and_keep_changed(chunks, keys_history, source_label)
+            if keys_new is None:
+                return None, None
+
+            def clean_delta(dirty_key_ids):
+                return clean_source_chunks(_keep_keys(candidates, dirty_key_ids), False, source_label)[0]
+        else:
+            plan = probe_source_schema(file_path, is_csv)
+            if plan is None:
+                return None, None
+            # Same parse types as the streamed chunks, so either path matches the other's group hashes
+            df_base = read_source_file(file_path, is_csv, usecols=plan["source_columns"],
+                                       dtype=plan["csv_dtypes"] if is_csv else None)
+            if df_base is None:
+                return None, None
+            df_mapped = map_source_columns(df_base)
+            if df_mapped is None:
+                return None, None
+            del df_base
+            if not is_csv:
+                df_mapped = apply_excel_parse_dtypes(df_mapped)
+
+            if not all(col in df_mapped.columns for col in INCREMENTAL_KEY_COLUMNS):
+                print(f"Warning: Colunas chave {INCREMENTAL_KEY_COLUMNS} ausentes. Carga incremental desativada.")
+                return clean_mapped_data(df_mapped), None
+            row_key_ids, keys_new = compute_group_hashes(df_mapped)
+
+            def clean_delta(dirty_key_ids):
+                dirty_rows = pd.Series(row_key_ids).isin(dirty_key_ids).to_numpy()
+                return clean_mapped_data(df_mapped[dirty_rows].copy())
+
+        new_key_ids = keys_new["KeyHash"].to_numpy()
+
+        if not has_history:
+            dirty_key_ids = new_key_ids
+            keys_kept = keys_new.iloc[0:0]
+        else:
+            positions = pd.Index(keys_history["KeyHash"].to_numpy()).get_indexer(new_key_ids)
+            previous_hashes = keys_history["GroupHash"].to_numpy()[positions]
+            dirty = (positions == -1) | (previous_hashes != keys_new["GroupHash"].to_numpy())
+            dirty_key_ids = new_key_ids[dirty]
+            keys_kept = keys_history[~keys_history["KeyHash"].isin(new_key_ids)]
+            print(f"Carga incremental: {int(dirty.sum())} de {len(new_key_ids)} pedidos novos ou alterados.")
+
+        keys_merged = pd.concat([keys_kept, keys_new], ignore_index=True)
+        if has_history and len(dirty_key_ids) == 0:
+            print("Nenhuma alteração encontrada no arquivo fonte. Histórico mantido.")
+            return df_history, keys_merged
+
+        df_delta = clean_delta(dirty_key_ids)
+        if df_delta is None:
+            return None, None
+        if not has_history:
+            return df_delta, keys_merged
+
+        history_key_ids = compute_key_ids(df_history["NumPedido"], df_history["DataCriacao"])
+        df_kept = df_history[~pd.Series(history_key_ids).isin(dirty_key_ids).to_numpy()]
+        df_merged = concat_cleaned_frames([df_kept, df_delta])
+        print(f"Histórico atualizado: {len(df_kept)} linhas mantidas, {len(df_delta)} linhas novas/alteradas.")
+        return df_merged, keys_merged
+
+    except KeyError as e:
+        print(f"Erro de Chave (Coluna não encontrada durante processamento): {e}. Verifique os nomes das colunas no arquivo fonte e mapeamento.")
+        traceback.print_exc()
+        return None, None
+    except Exception as e:
+        print(f"Ocorreu um erro inesperado durante a carga incremental: {e}")
+        traceback.print_exc()
+        return None, None
+
+def read_csv_header(file_path, retries=3, delay=3):
+    """Reads only the header row of a CSV extract (with retries); returns the column names or None."""
+    if not os.path.exists(file_path):
+        print(f"Error: File not found at {file_path}")
+        return None
+    if not os.access(file_path, os.R_OK):
+        print(f"Error: Read permission denied for file: {file_path}")
+        return None
+
+    for attempt in range(retries):
+        try:
+            return pd.read_csv(file_path, nrows=0).columns.tolist()
+        except pd.errors.EmptyDataError:
+            print(f"Error: The file at {file_path} is empty.")
+            return None
+        except Exception as e:
+            print(f"An unexpected error occurred while reading the CSV header on attempt {attempt + 1}: {e}")
+            if attempt < retries - 1:
+                print(f"Retrying in {delay} seconds...")
+                time.sleep(delay)
+    print("Max retries reached. Failed to read CSV header.")
+    return None
+
+def source_parse_dtype(target_name):
+    """Parse-time type of a mapped column: "category" for text dimensions, "string" for order
+    numbers, "float64" for amounts, "datetime" for the creation date, None for anything else."""
+    if target_name in CATEGORICAL_COLUMNS or target_name in ("NomeCompletoZ", "Franqueado"):
+        return "category"
+    if target_name == "NumPedido":
+        return "string"
+    if target_name in ("QuantidadeKPI", "ValorFaturadoKPI"):
+        return "float64"
+    if target_name == "DataCriacao":
+        return "datetime"
+    return None
+
+def csv_parse_dtypes(rename_map):
+    """Parse-time dtypes of the mapped CSV columns: text dimensions as category, order numbers as string.
+
+    Numeric columns are left to the C parser, which already yields int/float columns.
+    """
+    dtypes = {}
+    for source_name, target_name in rename_map.items():
+        dtype = source_parse_dtype(target_name)
+        if dtype == "category":
+            dtypes[source_name] = "category"
+        elif dtype == "string":
+            dtypes[source_name] = STRING_DTYPE
+    return dtypes
+
+_COLUMN_PLANS = {}
+_COLUMN_PLANS_LOCK = threading.Lock()
+
+def header_signature(header):
+    """Stable signature of a header row (names and order)."""
+    return hashlib.sha1("\x1f".join(header).encode("utf-8")).hexdigest()
+
+def compile_column_plan(header):
+    """Resolves a header row into the column plan of the reader, or None when it cannot be loaded.
+
+    The plan lists, in map_source_columns order, each mapped source column with its position in
+    the header, target name and parse type (source_parse_dtype), plus the CSV parse dtypes.
+    A header missing any of REQUIRED_TARGET_COLUMNS is rejected here, before any row is read.
+    Plans are cached per header signature and shared: treat them as read-only.
+    """
+    header = ["" if name is None else str(name) for name in header]
+    signature = header_signature(header)
+    with _COLUMN_PLANS_LOCK:
+        plan = _COLUMN_PLANS.get(signature)
+    if plan is not None:
+        print(f"Plano de colunas reutilizado ({len(plan['columns'])} de {len(header)} colunas, assinatura {signature[:12]}).")
+        return plan
+
+    rename_map = resolve_column_mapping(header)
+    if rename_map is None:
+        return None
+    missing_required = [col for col in REQUIRED_TARGET_COLUMNS if col not in rename_map.values()]
+    if missing_required:
+        print(f"Error: Colunas obrigatórias ausentes no cabeçalho: {missing_required}. Leitura do arquivo cancelada.")
+        return None
+
+    columns = tuple(
+        (source_name, target_name, header.index(source_name), source_parse_dtype(target_name))
+        for source_name, target_name in rename_map.items()
+    )
+    plan = {
+        "signature": signature,
+        "header_width": len(header),
+        "columns": columns,
+        "rename_map": dict(rename_map),
+        "source_columns": [column[0] for column in columns],
+        "targets": [column[1] for column in columns],
+        "positions": [column[2] for column in columns],
+        "csv_dtypes": csv_parse_dtypes(rename_map),
+        "with_keys": all(col in rename_map.values() for col in INCREMENTAL_KEY_COLUMNS),
+    }
+    with _COLUMN_PLANS_LOCK:
+        _COLUMN_PLANS[signature] = plan
+    return plan
+
+def read_excel_header(file_path, sheet=0):
+    """Reads only the header row of one sheet (streamed by openpyxl in read-only mode); returns the names or None."""
+    import openpyxl
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if sheet >= len(workbook.worksheets):
+            print(f"Error: No sheets found in the Excel file: {file_path}")
+            return None
+        header = next(workbook.worksheets[sheet].iter_rows(max_row=1, values_only=True), None)
+    finally:
+        workbook.close()
+    if header is None:
+        print(f"Error: No rows found in the Excel file: {file_path}")
+        return None
+    return ["" if name is None else str(name) for name in header]
+
+def _with_retries(read, retries=3, delay=3):
+    """Calls read() up to retries times, waiting delay seconds after each failure (file locked
+    or still being copied to the share). The last failure is raised."""
+    for attempt in range(retries):
+        try:
+            return read()
+        except (FileNotFoundError, pd.errors.EmptyDataError):
+            raise
+        except Exception as e:
+            if attempt == retries - 1:
+                raise
+            print(f"An unexpected error occurred while opening the file on attempt {attempt + 1}: {e}")
+            print(f"Retrying in {delay} seconds...")
+            time.sleep(delay)
+
+def probe_source_schema(file_path, is_csv=False, sheet=0, retries=3, delay=3):
+    """Schema probe: reads only the header of the extract and compiles its column plan.
+
+    Runs before the full parse, so a renamed or missing column fails in milliseconds instead
+    of after reading the whole file. The header read is retried (retries, delay). Returns the
+    plan (see compile_column_plan) or None.
+    """
+    if not os.path.exists(file_path):
+        print(f"Error: File not found at {file_path}")
+        return None
+    if not os.access(file_path, os.R_OK):
+        print(f"Error: Read permission denied for file: {file_path}")
+        return None
+    with trace_stage("source.probe", source="CSV" if is_csv else "XLSX") as stage:
+        try:
+            if is_csv:
+                header = read_csv_header(file_path, retries, delay)
+            else:
+                header = _with_retries(lambda: read_excel_header(file_path, sheet), retries, delay)
+        except Exception as e:
+            print(f"Error: Não foi possível ler o cabeçalho de {file_path}: {e}")
+            return None
+        plan = compile_column_plan(header) if header is not None else None
+        stage["columns"] = len(plan["columns"]) if plan else 0
+    return plan
+
+@contextlib.contextmanager
+def source_chunks(file_path, is_csv=False, chunk_rows=SOURCE_CHUNK_ROWS, sheet=0, retries=3, delay=3):
+    """Opens an extract as a stream of renamed raw chunks of chunk_rows rows, parsing only the mapped columns.
+
+    Yields (plan, chunks), where plan is the column plan of the header (probe_source_schema),
+    or (None, None) when the header cannot be mapped. The header probe and the opening of the
+    reader are retried (retries, delay); a failure while the chunks are read is not. The reader
+    is closed on exit.
+    """
+    if is_csv:
+        plan = probe_source_schema(file_path, is_csv=True, retries=retries, delay=delay)
+        if plan is None:
+            yield None, None
+            return
+        source_columns = plan["source_columns"]
+        print(f"Lendo CSV em blocos de {chunk_rows} linhas ({len(source_columns)} de {plan['header_width']} colunas)...")
+        open_reader = lambda: pd.read_csv(file_path, usecols=source_columns, dtype=plan["csv_dtypes"], chunksize=chunk_rows)
+        with _with_retries(open_reader, retries, delay) as reader:
+            # usecols keeps the file order; use the order of map_source_columns instead
+            yield plan, (chunk[source_columns].rename(columns=plan["rename_map"]) for chunk in reader)
+        return
+
+    plan = probe_source_schema(file_path, is_csv=False, sheet=sheet, retries=retries, delay=delay)
+    if plan is None:
+        yield None, None
+        return
+
+    def open_rows():
+        # The workbook is opened by the first next(); a failed generator cannot be resumed
+        rows = iter_excel_rows(file_path, sheet)
+        try:
+            return rows, next(rows, None)
+        except Exception:
+            rows.close()
+            raise
+    rows, header = _with_retries(open_rows, retries, delay)
+    try:
+        if header is None:
+            print(f"Error: No sheets or rows found in the Excel file: {file_path}")
+            yield None, None
+            return
+        header = ["" if name is None else str(name) for name in header]
+        if header_signature(header) != plan["signature"]:
+            # The readers disagree on the header text (e.g. numeric header cells); plan from this one
+            plan = compile_column_plan(header)
+            if plan is None:
+                yield None, None
+                return
+        positions = plan["positions"]
+        columns = plan["targets"]
+        header_width = plan["header_width"]
+
+        def select(row):
+            if len(row) < header_width:
+                row = tuple(row) + (None,) * (header_width - len(row))
+            return [row[position] for position in positions]
+
+        def chunks():
+            block = []
+            for row in rows:
+                block.append(select(row))
+                if len(block) == chunk_rows:
+                    yield excel_rows_to_frame(block, columns)
+                    block = []
+            if block:
+                yield excel_rows_to_frame(block, columns)
+
+        print(f"Lendo XLSX em blocos de {chunk_rows} linhas ({len(positions)} de {header_width} colunas)...")
+        yield plan, chunks()
+    finally:
+        rows.close()
+
+def _keep_keys(chunks, key_ids):
+    # Rows of the given (NumPedido, DataCriacao) groups only; chunks left empty are skipped
+    for chunk in chunks:
+        chunk = chunk[pd.Series(compute_key_ids(chunk["NumPedido"], chunk["DataCriacao"])).isin(key_ids).to_numpy()]
+        if len(chunk):
+            yield chunk
+
+def clean_chunked_source(file_path, is_csv=False, chunk_rows=SOURCE_CHUNK_ROWS, sheet=0, retries=3, delay=3):
+    """Streams an extract through map/clean chunk by chunk, parsing only the mapped columns.
+
+    Peak memory follows chunk_rows instead of the file size: each raw chunk is dropped once
+    cleaned and only the compact cleaned chunks are kept, then concatenated with their
+    categories unioned. Returns (df_clean, keys), where keys are the group hashes of the whole
+    file (None when the key columns are missing), or (None, None) if nothing could be read.
+    Opening the source is retried as in source_chunks.
+    """
+    source_label = "CSV" if is_csv else "XLSX"
+    with source_chunks(file_path, is_csv, chunk_rows, sheet, retries, delay) as (plan, chunks):
+        if plan is None:
+            return None, None
+        if not plan["with_keys"]:
+            print(f"Warning: Colunas chave {INCREMENTAL_KEY_COLUMNS} ausentes. Carga incremental desativada.")
+        return clean_source_chunks(chunks, plan["with_keys"], source_label)
+
+def clean_csv_in_chunks(file_path, chunk_rows=SOURCE_CHUNK_ROWS, retries=3, delay=3):
+    """clean_chunked_source for a CSV extract."""
+    return clean_chunked_source(file_path, True, chunk_rows, retries=retries, delay=delay)
+
+def hash_and_keep_changed(chunks, keys_history, source_label):
+    """One pass over renamed raw chunks: hashes every order group and keeps only the rows that may have changed.
+
+    Nothing is cleaned. A row is dropped when its group's hash within the chunk equals the
+    GroupHash of the history, i.e. the whole group is in that chunk and unchanged. Groups split
+    across chunks do not match on a partial hash, so their rows are kept until the summed
+    hashes decide. Returns (candidate raw chunks, keys of the whole file), or (None, None) when
+    no row was read.
+    """
+    history_index = pd.Index(keys_history["KeyHash"].to_numpy())
+    history_hashes = keys_history["GroupHash"].to_numpy()
+    candidates = []
+    key_chunks = []
+    chunk_iter = iter(chunks)
+    while True:
+        with trace_stage("source.hash_chunk", source=source_label) as stage:
+            chunk = next(chunk_iter, None)
+            stage["rows_in"] = len(chunk) if chunk is not None else 0
+            if chunk is not None:
+                row_key_ids, chunk_keys = compute_group_hashes(chunk)
+                positions = history_index.get_indexer(chunk_keys["KeyHash"].to_numpy())
+                unchanged = (positions >= 0) & (history_hashes[positions] == chunk_keys["GroupHash"].to_numpy())
+                changed_key_ids = chunk_keys["KeyHash"].to_numpy()[~unchanged]
+                kept = chunk[pd.Series(row_key_ids).isin(changed_key_ids).to_numpy()]
+                if len(kept):
+                    candidates.append(kept)
+                key_chunks.append(chunk_keys)
+                stage["rows_out"] = len(kept)
+        if chunk is None:
+            break
+        del chunk
+    if not key_chunks:
+        print("Error: Nenhuma linha de dados encontrada no arquivo.")
+        return None, None
+    return candidates, _sum_group_hashes(key_chunks)
+
+def _sum_group_hashes(key_chunks):
+    # Group hashes are wrapping sums, so partial sums of orders split across chunks add up
+    return (
+        pd.concat(key_chunks, ignore_index=True)
+        .groupby("KeyHash", sort=False)["GroupHash"].sum()
+        .reset_index()
+    )
+
+def clean_source_chunks(chunks, with_keys, source_label):
+    """Cleans renamed raw chunks one at a time and concatenates the results.
+
+    Each raw chunk is released once cleaned; group hashes are computed per chunk and summed.
+    Returns (df_clean, keys) or (None, None) when the iterator yields no rows.
+    """
+    start_time = time.time()
+    cleaned_chunks = []
+    key_chunks = []
+    rows_read = 0
+    chunk_iter = iter(chunks)
+    chunk_number = 0
+    while True:
+        # Parsing happens lazily inside the iterator, so each next() is the read of one chunk
+        with trace_stage("source.read_chunk", source=source_label) as stage:
+            chunk = next(chunk_iter, None)
+            stage["rows_out"] = len(chunk) if chunk is not None else 0
+        if chunk is None:
+            break
+        chunk_number += 1
+        rows_read += len(chunk)
+        if with_keys:
+            key_chunks.append(compute_group_hashes(chunk)[1])
+        # Same steps for every chunk; only the first one logs them per column
+        cleaned_chunks.append(clean_mapped_data(chunk, verbose=chunk_number == 1))
+        del chunk
+        print(f"Bloco {chunk_number}: {rows_read} linhas lidas.")
+
+    if rows_read == 0:
+        print("Error: Nenhuma linha de dados encontrada no arquivo.")
+        return None, None
+
+    with trace_stage("source.concat_chunks", rows_read) as stage:
+        df_clean = concat_cleaned_frames(cleaned_chunks)
+        stage["rows_out"] = len(df_clean)
+    del cleaned_chunks
+    keys = _sum_group_hashes(key_chunks) if with_keys else None
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    print(f"{source_label} processado em blocos: {rows_read} linhas em {elapsed:.1f}s ({rows_read / elapsed:.0f} linhas/s), {len(df_clean)} linhas limpas.")
+    report_memory_footprint(df_clean)
+    return df_clean, keys
+
+def list_excel_sheets(file_path):
+    """Returns the sheet names of a workbook without loading any cell."""
+    if CalamineWorkbook is not None:
+        return list(CalamineWorkbook.from_path(file_path).sheet_names)
+    import openpyxl
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+def iter_excel_rows(file_path, sheet=0):
+    """Yields the rows of one sheet (by index, first by default) as sequences of cell values, header first.
+
+    Uses python-calamine when installed, otherwise openpyxl in read-only mode; neither keeps
+    cell objects or styles around.
+    """
+    if CalamineWorkbook is not None:
+        workbook = CalamineWorkbook.from_path(file_path)
+        if sheet >= len(workbook.sheet_names):
+            return
+        print(f"Lendo planilha '{workbook.sheet_names[sheet]}' com python-calamine...")
+        yield from workbook.get_sheet_by_index(sheet).iter_rows()
+        return
+
+    import openpyxl
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if sheet >= len(workbook.worksheets):
+            return
+        print(f"Lendo planilha '{workbook.sheetnames[sheet]}' com openpyxl (somente leitura)...")
+        yield from workbook.worksheets[sheet].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def _excel_label(value):
+    """Text of one distinct cell value as read_excel would give it: whole numbers without '.0', '' as missing."""
+    if value is None or (isinstance(value, str) and value == ""):
+        return None
+    if isinstance(value, float):
+        if np.isnan(value):
+            return None
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+def _excel_text_column(series):
+    """Converts a column of raw cell values into a categorical over their text, one str() per distinct value."""
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    labels = np.array([_excel_label(value) for value in uniques], dtype=object)
+    remap, categories = pd.factorize(labels, sort=True, use_na_sentinel=True)
+    new_codes = np.where(codes < 0, -1, remap[codes]) if len(remap) else codes
+    return pd.Series(pd.Categorical.from_codes(new_codes, categories=categories), index=series.index, name=series.name)
+
+def excel_rows_to_frame(rows, columns):
+    """Builds a renamed raw chunk from selected Excel row values, typing it while the chunk is small.
+
+    Text dimensions become categoricals and order numbers strings (see csv_parse_dtypes),
+    amounts float64 and dates datetime64; empty cells are missing values, as with read_excel.
+    Types do not depend on the reader, so group hashes match with or without python-calamine.
+    """
+    return apply_excel_parse_dtypes(pd.DataFrame.from_records(rows, columns=columns))
+
+def apply_excel_parse_dtypes(df):
+    """Types a renamed raw Excel frame column by column with source_parse_dtype (see excel_rows_to_frame).
+
+    Also applied to the frame of read_excel, so a whole-file load hashes its groups like the
+    streamed chunks and the two can refresh each other's history.
+    """
+    for col in df.columns:
+        dtype = source_parse_dtype(col)
+        if dtype == "category":
+            df[col] = _excel_text_column(df[col])
+        elif dtype == "string":
+            df[col] = _excel_text_column(df[col]).astype(object).astype(STRING_DTYPE)
+        elif dtype == "float64":
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+        elif dtype == "datetime":
+            dates = pd.to_datetime(df[col], errors="coerce")
+            # Date-only cells parse at second resolution; use the resolution of datetime cells
+            df[col] = dates.dt.as_unit("us") if dates.dt.unit == "s" else dates
+        elif df[col].dtype == object:
+            df[col] = df[col].mask(df[col].eq(""))
+    return df
+
+def clean_excel_in_chunks(file_path, chunk_rows=SOURCE_CHUNK_ROWS, sheet=0, retries=3, delay=3):
+    """clean_chunked_source for one sheet (the first by default) of an XLSX extract.
+
+    The header is probed first (probe_source_schema), so a sheet that cannot be mapped fails
+    before the workbook is parsed. Rows are then read with iter_excel_rows, cut down to the
+    plan's columns as they are read and typed per chunk of chunk_rows, so the unused columns
+    are never materialized.
+    """
+    return clean_chunked_source(file_path, False, chunk_rows, sheet, retries, delay)
+
+@traced("source.read")
+def read_source_file(file_path, is_csv=False, retries=3, delay=3, usecols=None, dtype=None):
+    """Reads the raw extract (Excel or CSV) with retries and returns it unprocessed, or None on failure.
+
+    usecols (e.g. the source_columns of a column plan) limits the parse to those columns;
+    dtype (e.g. its csv_dtypes) is passed to read_csv.
+    """
     import sys
     print(f"File path to load: {file_path}")
     print(f"Is CSV: {is_csv}")
 
-    # Set locale to Portuguese for month names
-    try:
-        locale.setlocale(locale.LC_TIME, 'pt_BR.UTF-8')
-        print("Locale set to pt_BR.UTF-8 for month names.")
-    except locale.Error:
-        print("Warning: Locale pt_BR.UTF-8 not available. Using default locale for month names.")
-        # Consider fallback or error handling if pt_BR is critical
-
     df_base = None
 
     # Check if file exists before attempting to read
@@ -47,7 +710,7 @@ def load_and_clean_data_streamlit(file_path, is_csv=False, retries=3, delay=3):
         try:
             if is_csv:
                 print(f"Attempt {attempt + 1}/{retries}: Reading CSV file...")
-                df_base = pd.read_csv(file_path, low_memory=False)
+                df_base = pd.read_csv(file_path, low_memory=False, usecols=usecols, dtype=dtype)
                 print(f"Dados carregados do CSV: {df_base.shape[0]} linhas, {df_base.shape[1]} colunas.")
             else: # Original Excel logic
                 print(f"Attempt {attempt + 1}/{retries}: Reading Excel file directly using openpyxl engine...")
@@ -57,7 +720,7 @@ def load_and_clean_data_streamlit(file_path, is_csv=False, retries=3, delay=3):
                 if not xls.sheet_names:
                     print(f"Error: No sheets found in the Excel file: {file_path}")
                     return None
-                df_base = pd.read_excel(xls, sheet_name=xls.sheet_names[0], header=0)
+                df_base = pd.read_excel(xls, sheet_name=xls.sheet_names[0], header=0, usecols=usecols)
                 print(f"Dados originais carregados da planilha '{xls.sheet_names[0]}': {df_base.shape[0]} linhas, {df_base.shape[1]} colunas.")
                 # print("Preview das primeiras linhas:")
                 # print(df_base.head())
@@ -84,159 +747,269 @@ def load_and_clean_data_streamlit(file_path, is_csv=False, retries=3, delay=3):
         print("Failed to load df_base after all attempts.")
         return None
 
-    # --- Data Cleaning and Preparation --- 
-    try:
-        # Define expected column names based on previous analysis (adapt if needed)
-        expected_columns = {
-            "Order Creation Date: Date": "DataCriacao",
-            "Tipo Cliente": "TipoClienteY",
-            "Nome Completo": "NomeCompletoZ",
-            "CANAL": "CanalAA", # This seems duplicated later as "CanalBI", check source file
-            "3P": "TresP_AH",
-            "Customer By SO: Buying Group Name": "GrupoFranqueadoW", # Also duplicated as "Franqueado"?
-            "Sales Organization Code": "SalesOrgE",
-            "STATUS": "StatusKPI",
-            "Orders - TOTAL Orders Qty": "QuantidadeKPI",
-            "Orders - TOTAL Gross Amount (Document Currency)": "ValorFaturadoKPI",
-            "Orders Detail - Order Document Number": "NumPedido",
-            "Reject Reason Code": "MotivoRejeicao",
-            # "Customer By SO: Buying Group Name": "Franqueado", # Duplicated key, use distinct source if needed
-            "Brand & Segment - Code": "BrandCode",
-            "PLM Attributes - Collection Mix Desc": "CollectionDesc",
-            "Brand & Segment - Category": "BrandCategory",
-            "Otico/Sport": "OticoSport",
-            "Canal": "CanalBI" # Potential duplicate key, check source Excel header exactly
-        }
-
-        # Resolve duplicate keys in expected_columns if they point to different source columns
-        # Example: If "CANAL" and "Canal" are two distinct columns in Excel mapped to different desired names
-        # For now, assume the last definition ("Canal": "CanalBI") overrides the first if keys are identical strings
-        # And "Customer By SO: Buying Group Name" maps to "GrupoFranqueadoW"
-        # Add mapping for "Franqueado" if it comes from a different source column
-        # Assuming "Franqueado" should also map from "Customer By SO: Buying Group Name" for now
-        expected_columns["Customer By SO: Buying Group Name_Franqueado"] = "Franqueado" # Create a unique key if needed
-
-        actual_columns = df_base.columns.tolist()
-        print(f"Colunas encontradas no arquivo: {actual_columns}")
-
-        rename_map = {}
-        missing_expected = []
-        used_actual_columns = set()
-
-        # Special handling for potentially duplicated source columns mapped to different names
-        if "Customer By SO: Buying Group Name" in actual_columns:
-            rename_map["Customer By SO: Buying Group Name"] = "GrupoFranqueadoW"
-            used_actual_columns.add("Customer By SO: Buying Group Name")
-            # If "Franqueado" is meant to be the *same* column, we don't need a separate mapping.
-            # If it's a *different* column with a similar name, adjust `expected_columns` key.
-            # For now, let's assume Franqueado is derived or handled later if it's the same source.
-            if "Customer By SO: Buying Group Name_Franqueado" in expected_columns:
-                 del expected_columns["Customer By SO: Buying Group Name_Franqueado"] # Remove the temp key
-
-        if "CANAL" in actual_columns:
-             rename_map["CANAL"] = "CanalAA" # First mapping
-             used_actual_columns.add("CANAL")
-        if "Canal" in actual_columns and "Canal" not in used_actual_columns:
-             rename_map["Canal"] = "CanalBI" # Second mapping (case-sensitive)
-             used_actual_columns.add("Canal")
-        elif "Canal" not in actual_columns and "CANAL" in actual_columns: # If only "CANAL" exists
-             # Decide which mapping takes precedence or if one column serves both purposes
-             # Assuming CanalBI is the primary one if only "CANAL" exists:
-             if "CANAL" in rename_map: del rename_map["CANAL"] # Remove first mapping
-             rename_map["CANAL"] = "CanalBI"
-             used_actual_columns.add("CANAL")
-
-        # Map remaining columns
-        for excel_name, desired_name in expected_columns.items():
-            if excel_name in actual_columns and excel_name not in used_actual_columns:
-                rename_map[excel_name] = desired_name
-                used_actual_columns.add(excel_name)
-            elif excel_name not in actual_columns:
-                 # Check if it's one of the specially handled ones already mapped
-                 if desired_name not in ["GrupoFranqueadoW", "CanalAA", "CanalBI", "Franqueado"]:
-                     missing_expected.append(excel_name)
-                     print(f"Warning: Expected column \"{excel_name}\" not found in source file header.")
-
-        if not rename_map:
-             print("Error: Could not map any expected columns to the source file headers. Check file structure.")
-             print(f"Source Headers found: {actual_columns}")
-             return None
+    return df_base
+
+def resolve_column_mapping(actual_columns):
+    """Resolves the source headers against the expected columns; returns {source header: column name} or None."""
+    # Define expected column names based on previous analysis (adapt if needed)
+    expected_columns = {
+        "Order Creation Date: Date": "DataCriacao",
+        "Tipo Cliente": "TipoClienteY",
+        "Nome Completo": "NomeCompletoZ",
+        "CANAL": "CanalAA", # This seems duplicated later as "CanalBI", check source file
+        "3P": "TresP_AH",
+        "Customer By SO: Buying Group Name": "GrupoFranqueadoW", # Also duplicated as "Franqueado"?
+        "Sales Organization Code": "SalesOrgE",
+        "STATUS": "StatusKPI",
+        "Orders - TOTAL Orders Qty": "QuantidadeKPI",
+        "Orders - TOTAL Gross Amount (Document Currency)": "ValorFaturadoKPI",
+        "Orders Detail - Order Document Number": "NumPedido",
+        "Reject Reason Code": "MotivoRejeicao",
+        # "Customer By SO: Buying Group Name": "Franqueado", # Duplicated key, use distinct source if needed
+        "Brand & Segment - Code": "BrandCode",
+        "PLM Attributes - Collection Mix Desc": "CollectionDesc",
+        "Brand & Segment - Category": "BrandCategory",
+        "Otico/Sport": "OticoSport",
+        "Canal": "CanalBI" # Potential duplicate key, check source Excel header exactly
+    }
+
+    # Resolve duplicate keys in expected_columns if they point to different source columns
+    # Example: If "CANAL" and "Canal" are two distinct columns in Excel mapped to different desired names
+    # For now, assume the last definition ("Canal": "CanalBI") overrides the first if keys are identical strings
+    # And "Customer By SO: Buying Group Name" maps to "GrupoFranqueadoW"
+    # Add mapping for "Franqueado" if it comes from a different source column
+    # Assuming "Franqueado" should also map from "Customer By SO: Buying Group Name" for now
+    expected_columns["Customer By SO: Buying Group Name_Franqueado"] = "Franqueado" # Create a unique key if needed
+
+    actual_columns = list(actual_columns)
+    print(f"Colunas encontradas no arquivo: {actual_columns}")
+
+    rename_map = {}
+    missing_expected = []
+    used_actual_columns = set()
+
+    # Special handling for potentially duplicated source columns mapped to different names
+    if "Customer By SO: Buying Group Name" in actual_columns:
+        rename_map["Customer By SO: Buying Group Name"] = "GrupoFranqueadoW"
+        used_actual_columns.add("Customer By SO: Buying Group Name")
+        # If "Franqueado" is meant to be the *same* column, we don't need a separate mapping.
+        # If it's a *different* column with a similar name, adjust `expected_columns` key.
+        # For now, let's assume Franqueado is derived or handled later if it's the same source.
+        if "Customer By SO: Buying Group Name_Franqueado" in expected_columns:
+             del expected_columns["Customer By SO: Buying Group Name_Franqueado"] # Remove the temp key
+
+    if "CANAL" in actual_columns:
+         rename_map["CANAL"] = "CanalAA" # First mapping
+         used_actual_columns.add("CANAL")
+    if "Canal" in actual_columns and "Canal" not in used_actual_columns:
+         rename_map["Canal"] = "CanalBI" # Second mapping (case-sensitive)
+         used_actual_columns.add("Canal")
+    elif "Canal" not in actual_columns and "CANAL" in actual_columns: # If only "CANAL" exists
+         # Decide which mapping takes precedence or if one column serves both purposes
+         # Assuming CanalBI is the primary one if only "CANAL" exists:
+         if "CANAL" in rename_map: del rename_map["CANAL"] # Remove first mapping
+         rename_map["CANAL"] = "CanalBI"
+         used_actual_columns.add("CANAL")
+
+    # Map remaining columns
+    for excel_name, desired_name in expected_columns.items():
+        if excel_name in actual_columns and excel_name not in used_actual_columns:
+            rename_map[excel_name] = desired_name
+            used_actual_columns.add(excel_name)
+        elif excel_name not in actual_columns:
+             # Check if it's one of the specially handled ones already mapped
+             if desired_name not in ["GrupoFranqueadoW", "CanalAA", "CanalBI", "Franqueado"]:
+                 missing_expected.append(excel_name)
+                 print(f"Warning: Expected column \"{excel_name}\" not found in source file header.")
+
+    if not rename_map:
+         print("Error: Could not map any expected columns to the source file headers. Check file structure.")
+         print(f"Source Headers found: {actual_columns}")
+         return None
+
+    return rename_map
+
+@traced("source.map_columns")
+def map_source_columns(df_base):
+    """Resolves the source headers against the expected columns and returns the selected, renamed frame."""
+    plan = compile_column_plan(df_base.columns.tolist())
+    if plan is None:
+        return None
+
+    # Select and rename columns
+    df = df_base[plan["source_columns"]].copy()
+    df.rename(columns=plan["rename_map"], inplace=True)
+    print(f"Colunas renomeadas: {list(df.columns)}")
+
+    return df
+
+def add_date_features(df):
+    """Derives Ano, MesNumero, MesNome (PT-BR) and SemanaAno from DataCriacao using integer arithmetic only.
+
+    No strftime or process-wide locale is involved, so concurrent sessions cannot interfere.
+    """
+    dates = df["DataCriacao"].dt
+    df["Ano"] = dates.year
+    df["MesNumero"] = dates.month
+    # Month name as codes over the fixed PT-BR table; all 12 months stay as categories for the filters
+    df["MesNome"] = pd.Categorical.from_codes(df["MesNumero"].to_numpy() - 1, dtype=MONTH_NAME_DTYPE)
+    # Week of year starting on Sunday, same as strftime("%U"): days before the first Sunday are week 0
+    day_of_year = dates.dayofyear.to_numpy().astype(int) - 1
+    weekday_from_sunday = (dates.dayofweek.to_numpy().astype(int) + 1) % 7
+    df["SemanaAno"] = (day_of_year + 7 - weekday_from_sunday) // 7
+    return df
+
+def to_categorical(series, fill_value=None, verbose=True):
+    """Builds a string-valued categorical directly from the codes of the raw column.
 
-        # Select and rename columns
-        df = df_base[list(rename_map.keys())].copy()
-        df.rename(columns=rename_map, inplace=True)
-        print(f"Colunas renomeadas: {list(df.columns)}")
+    Only the distinct values are converted to str (then merged, so 1234 and "1234" share a
+    category); the rows never go through an object-string copy. Missing values become
+    fill_value, or stay missing when fill_value is None. Categories are sorted, as astype("category").
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
 
-        # --- Continue with cleaning steps --- 
+    str_uniques = pd.Index(uniques).astype(str).to_numpy(dtype=object)
+    missing = codes < 0
+    if fill_value is not None and missing.any():
+        if verbose:
+            print(f"Preenchendo valores nulos em \"{series.name}\" com \"{fill_value}\".")
+        str_uniques = np.append(str_uniques, fill_value)
+        codes = np.where(missing, len(str_uniques) - 1, codes)
+        missing = codes < 0
+
+    remap, categories = pd.factorize(str_uniques, sort=True)
+    new_codes = np.where(missing, -1, remap[codes]) if len(remap) else codes
+    result = pd.Categorical.from_codes(new_codes, categories=categories)
+    return pd.Series(result, index=series.index, name=series.name)
+
+def _downcast_int(series, dtype):
+    info = np.iinfo(dtype)
+    if series.empty or (series.min() >= info.min and series.max() <= info.max):
+        return series.astype(dtype)
+    print(f"Warning: Coluna \"{series.name}\" excede o intervalo de {dtype}; mantida como {series.dtype}.")
+    return series
+
+def apply_dtype_plan(df):
+    """Casts the cleaned frame to OUTPUT_DTYPE_PLAN (small ints, categoricals, Arrow strings)."""
+    df = df.copy(deep=False)
+    for col, dtype in OUTPUT_DTYPE_PLAN.items():
+        if col not in df.columns:
+            continue
+        if dtype.startswith("int"):
+            df[col] = _downcast_int(df[col], dtype)
+        elif dtype == "category":
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = to_categorical(df[col])
+        elif dtype == "string":
+            df[col] = df[col].astype(STRING_DTYPE)
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+def report_memory_footprint(df):
+    """Prints and returns the resident size of the frame in bytes (per column and total)."""
+    usage = df.memory_usage(deep=True, index=True)
+    total = int(usage.sum())
+    largest = usage.drop("Index", errors="ignore").sort_values(ascending=False).head(5)
+    print(f"Memória do DataFrame: {total / 1024 ** 2:.1f} MB ({total / max(len(df), 1):.0f} bytes/linha).")
+    print("Maiores colunas: " + ", ".join(f"{col}={size / 1024 ** 2:.1f} MB" for col, size in largest.items()))
+    return total
+
+def clean_mapped_data(df, verbose=True):
+    """Runs the typing, date feature and categorical steps over a frame already renamed by map_source_columns.
+
+    verbose=False skips the per-step log (used for every chunk after the first of a streamed file).
+    """
+    def log(message):
+        if verbose:
+            print(message)
+
+    with trace_stage("clean.datetime", len(df)) as stage:
         df["DataCriacao"] = pd.to_datetime(df["DataCriacao"], errors="coerce")
         df.dropna(subset=["DataCriacao"], inplace=True)
-        print("Coluna \"DataCriacao\" convertida para datetime e NaTs removidos.")
-
-        df["Ano"] = df["DataCriacao"].dt.year
-        df["MesNumero"] = df["DataCriacao"].dt.month
-        # Generate month name using the locale set earlier (pt_BR)
-        df["MesNome"] = df["DataCriacao"].dt.strftime("%B").str.capitalize()
-        # Ensure SemanaAno is numeric, handle potential errors
-        df["SemanaAno"] = pd.to_numeric(df["DataCriacao"].dt.strftime("%U"), errors='coerce').fillna(0).astype(int) # Using %U for week number starting Sunday
-        # df["SemanaAno"] = df["DataCriacao"].dt.isocalendar().week # ISO week number if preferred
+        stage["rows_out"] = len(df)
+    log("Coluna \"DataCriacao\" convertida para datetime e NaTs removidos.")
 
-        print("Colunas \"Ano\", \"MesNumero\", \"MesNome\" (PT-BR), \"SemanaAno\" extraídas de \"DataCriacao\".")
+    with trace_stage("clean.date_features", len(df)) as stage:
+        add_date_features(df)
+        stage["rows_out"] = len(df)
+    log("Colunas \"Ano\", \"MesNumero\", \"MesNome\" (PT-BR), \"SemanaAno\" extraídas de \"DataCriacao\".")
 
+    with trace_stage("clean.numeric", len(df)) as stage:
         df["QuantidadeKPI"] = pd.to_numeric(df["QuantidadeKPI"], errors="coerce").fillna(0).astype(int)
-        print("Coluna \"QuantidadeKPI\" verificada/convertida para inteiro.")
         df["ValorFaturadoKPI"] = pd.to_numeric(df["ValorFaturadoKPI"], errors="coerce").fillna(0)
-        print("Coluna \"ValorFaturadoKPI\" verificada/convertida para numérico.")
-
-        # Convert categorical columns
-        categorical_cols = [
-            "TipoClienteY", "CanalAA", "TresP_AH", "SalesOrgE", "StatusKPI",
-            "BrandCode", "CollectionDesc", "BrandCategory", "OticoSport", "CanalBI",
-            "GrupoFranqueadoW", "MotivoRejeicao" # Add Franqueado if it exists as a separate column
-        ]
-        if "Franqueado" not in df.columns and "GrupoFranqueadoW" in df.columns:
-             df["Franqueado"] = df["GrupoFranqueadoW"] # If Franqueado should be same as GrupoFranqueadoW
-             print("Coluna 'Franqueado' criada como cópia de 'GrupoFranqueadoW'.")
-             categorical_cols.append("Franqueado")
-        elif "Franqueado" in df.columns:
-             categorical_cols.append("Franqueado")
-
-        for col in categorical_cols:
-            if col in df.columns:
-                # Fill NaNs before converting to category
-                fill_value = "Não Especificado"
-                if df[col].isnull().any():
-                     print(f"Preenchendo valores nulos em \"{col}\" com \"{fill_value}\".")
-                     df[col].fillna(fill_value, inplace=True)
-                df[col] = df[col].astype(str).astype("category")
-                print(f"Coluna \"{col}\" convertida para category.")
-            else:
-                print(f"Warning: Coluna categórica esperada '{col}' não encontrada após renomeação.")
-
-        # Order MesNome chronologically using Portuguese names
-        month_order_pt = [
-            "Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
-            "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"
-        ]
-        present_months = df["MesNome"].unique().tolist()
-        # Always use the full list of months for categories to ensure all appear in filters
-        df["MesNome"] = pd.Categorical(df["MesNome"], categories=month_order_pt, ordered=True)
-        print("Coluna \"MesNome\" convertida para category ordenada (PT-BR) com todos os 12 meses.")
-
-        # Define final columns, ensuring they exist after processing
-        final_columns_base = [
-            "DataCriacao", "Ano", "MesNumero", "MesNome", "SemanaAno",
-            "NumPedido", "StatusKPI", "QuantidadeKPI", "ValorFaturadoKPI",
-            "CanalAA", "TipoClienteY", "TresP_AH", "SalesOrgE",
-            "GrupoFranqueadoW", "Franqueado", "NomeCompletoZ", "MotivoRejeicao",
-            "BrandCode", "CollectionDesc", "BrandCategory", "OticoSport", "CanalBI"
-        ]
-        final_columns = [col for col in final_columns_base if col in df.columns]
-        df_final = df[final_columns]
-
-        print("Tratamento de dados para Streamlit concluído.")
-        print(f"Dados processados: {df_final.shape[0]} linhas, {df_final.shape[1]} colunas.")
-        print(f"Colunas finais selecionadas: {list(df_final.columns)}")
-        return df_final
+        stage["rows_out"] = len(df)
+    log("Coluna \"QuantidadeKPI\" verificada/convertida para inteiro.")
+    log("Coluna \"ValorFaturadoKPI\" verificada/convertida para numérico.")
+
+    # Convert categorical columns
+    categorical_cols = list(CATEGORICAL_COLUMNS)
+    franqueado_from_grupo = False
+    if "Franqueado" not in df.columns and "GrupoFranqueadoW" in df.columns:
+         franqueado_from_grupo = True # If Franqueado should be same as GrupoFranqueadoW
+    elif "Franqueado" in df.columns:
+         categorical_cols.append("Franqueado")
+
+    for col in categorical_cols:
+        if col in df.columns:
+            # NaNs are filled while building the category, without an intermediate str column
+            with trace_stage("clean.categorical", len(df), column=col) as stage:
+                df[col] = to_categorical(df[col], CATEGORICAL_FILL_VALUE, verbose)
+                stage["rows_out"] = len(df)
+            log(f"Coluna \"{col}\" convertida para category.")
+        else:
+            log(f"Warning: Coluna categórica esperada '{col}' não encontrada após renomeação.")
+    if franqueado_from_grupo:
+         df["Franqueado"] = df["GrupoFranqueadoW"].copy()
+         log("Coluna 'Franqueado' criada como cópia de 'GrupoFranqueadoW'.")
+
+    # Define final columns, ensuring they exist after processing
+    final_columns_base = [
+        "DataCriacao", "Ano", "MesNumero", "MesNome", "SemanaAno",
+        "NumPedido", "StatusKPI", "QuantidadeKPI", "ValorFaturadoKPI",
+        "CanalAA", "TipoClienteY", "TresP_AH", "SalesOrgE",
+        "GrupoFranqueadoW", "Franqueado", "NomeCompletoZ", "MotivoRejeicao",
+        "BrandCode", "CollectionDesc", "BrandCategory", "OticoSport", "CanalBI"
+    ]
+    final_columns = [col for col in final_columns_base if col in df.columns]
+    with trace_stage("clean.dtype_plan", len(df)) as stage:
+        df_final = apply_dtype_plan(df[final_columns])
+        stage["rows_out"] = len(df_final)
+    if verbose:
+        report_memory_footprint(df_final)
+
+    log("Tratamento de dados para Streamlit concluído.")
+    log(f"Dados processados: {df_final.shape[0]} linhas, {df_final.shape[1]} colunas.")
+    log(f"Colunas finais selecionadas: {list(df_final.columns)}")
+    return df_final
+
+def load_and_clean_data_streamlit(file_path, is_csv=False, retries=3, delay=3, chunk_rows=SOURCE_CHUNK_ROWS):
+    """Loads data from the specified file (Excel or CSV), cleans it, and prepares it for the Streamlit dashboard.
+
+    The file is streamed in chunks of chunk_rows (chunk_rows=None reads it in one piece).
+    Either way, reading the file is retried up to retries times, delay seconds apart.
+    """
+    df_base = None
+    if not chunk_rows:
+        plan = probe_source_schema(file_path, is_csv, retries=retries, delay=delay)
+        if plan is None:
+            return None
+        df_base = read_source_file(file_path, is_csv, retries, delay, usecols=plan["source_columns"])
+        if df_base is None:
+            return None
+
+    # --- Data Cleaning and Preparation --- 
+    try:
+        if df_base is None:
+            clean_in_chunks = clean_csv_in_chunks if is_csv else clean_excel_in_chunks
+            return clean_in_chunks(file_path, chunk_rows, retries=retries, delay=delay)[0]
+        df = map_source_columns(df_base)
+        if df is None:
+            return None
+        return clean_mapped_data(df)
 
     except KeyError as e:
         print(f"Erro de Chave (Coluna não encontrada durante processamento): {e}. Verifique os nomes das colunas no arquivo fonte e mapeamento.")
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+import traceback
+from datetime import datetime
+
+import pandas as pd
+
+from multi_source_loader import load_source, is_multi_source, get_sources_signature
+from filter_index import build_filter_index, build_filter_catalog, apply_filter_index, compute_facets, _value_key
+from partition_store import load_partitions, get_partition_year_stats
+from kpi_cube import build_daily_cube
+from dashboard_engine import load_daily_cube, load_dashboard_aggregates
+from result_cache import ResultCache, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_BYTES, estimate_size
+from perf_trace import trace_stage, get_perf_tracer
+
+# The background refresher checks the source signature this often (seconds)
+DEFAULT_REFRESH_INTERVAL = 30
+
+
+def normalize_selection(selections, catalog=None):
+    """Turns a {dimension: values} selection into a hashable, order-independent cache key.
+
+    With catalog (a filter_catalog), dimensions whose values cover every option are dropped:
+    like an empty selection they do not filter, so both share one key.
+    """
+    key = []
+    for col, values in sorted(selections.items()):
+        values = {str(value) for value in values or []}
+        if not values:
+            continue
+        if catalog is not None and col in catalog and values.issuperset(map(str, catalog[col]["options"])):
+            continue
+        key.append((col, tuple(sorted(values))))
+    return tuple(key)
+
+
+def selection_key(dataset, selections):
+    """Cache key of a selection on a dataset bundle (normalize_selection over its filter catalog).
+
+    Under a history window, Ano also decides which partitions are read, so selecting every
+    year is not folded there.
+    """
+    catalog = dataset["filter_catalog"]
+    if dataset.get("offline_years") or dataset.get("period_years"):
+        catalog = {col: entry for col, entry in catalog.items() if col != "Ano"}
+    return normalize_selection(selections, catalog)
+
+
+def get_source_signature(file_path):
+    """Returns (mtime_ns, size) of the source file, or None when it does not exist.
+
+    For a directory or glob source, the signature covers every file in it.
+    """
+    if is_multi_source(file_path):
+        return get_sources_signature(file_path)
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def get_source_mtime(source_signature):
+    """Latest modification time recorded in a source signature, as a datetime (None if unknown)."""
+    if not source_signature:
+        return None
+    if isinstance(source_signature[0], tuple):
+        # Multi-file source: (path, mtime_ns, size) per file
+        mtime_ns = max(item[1] for item in source_signature)
+    else:
+        mtime_ns = source_signature[0]
+    return datetime.fromtimestamp(mtime_ns / 1e9)
+
+
+def build_dataset(df, version, file_path=None, source_signature=None, min_year=None, snapshot_dir=None):
+    """Bundles the cleaned frame with everything derived from it once per load.
+
+    The bundle is shared by reference between sessions and must be treated as read-only.
+    The daily cube comes from the artifacts precomputed by dashboard_engine when they are current.
+    min_year marks a frame holding only the years from min_year on (history window); the older
+    years are then listed from the partition stats and read from disk when selected.
+    snapshot_dir is where the snapshot, its partitions and artifacts live (default: next to the source).
+    """
+    filter_index = build_filter_index(df)
+    # Sorted sidebar options, cardinality and row counts per filter dimension
+    filter_catalog = build_filter_catalog(filter_index)
+    offline_years = {}
+    if min_year is not None and file_path:
+        year_stats = get_partition_year_stats(file_path, snapshot_dir) or {}
+        offline_years = {str(year): stats for year, stats in sorted(year_stats.items()) if year < min_year}
+        if offline_years and "Ano" in filter_catalog:
+            online = filter_catalog["Ano"]
+            counts = {year: rows for year, (rows, _) in offline_years.items()}
+            counts.update(online["counts"])
+            filter_catalog["Ano"] = {"options": list(offline_years) + online["options"], "counts": counts, "cardinality": len(counts)}
+    return {
+        "version": version,
+        "df": df,
+        "filter_index": filter_index,
+        "filter_catalog": filter_catalog,
+        "cube": load_daily_cube(file_path, df, snapshot_dir) if file_path else build_daily_cube(df),
+        "file_path": file_path,
+        "snapshot_dir": snapshot_dir,
+        "source_signature": source_signature,
+        "loaded_at": datetime.now(),
+        "min_year": min_year,
+        # {Ano: (rows, quantity)} of the years kept on disk only
+        "offline_years": offline_years,
+    }
+
+
+def build_period_dataset(dataset, df, years):
+    """Bundle of the rows of a few years read from the partitions, sharing the rest of dataset."""
+    filter_index = build_filter_index(df)
+    period = dict(dataset)
+    period.update({
+        "df": df,
+        "filter_index": filter_index,
+        "filter_catalog": build_filter_catalog(filter_index),
+        "period_years": tuple(years),
+    })
+    return period
+
+
+def _selected_years(selections):
+    years = set()
+    for value in selections.get("Ano") or []:
+        key = _value_key(value)
+        if key.lstrip("-").isdigit():
+            years.add(int(key))
+    return sorted(years)
+
+
+class DatasetStore:
+    """Process-wide, versioned holder of the current dataset and of the filtered views built from it.
+
+    Every Streamlit session reads the same dataset object. A reload builds a complete new
+    dataset first and then swaps the reference, so readers never see a partial state.
+    After the first load, changes to the source are picked up by a background refresher
+    thread (stale-while-revalidate): sessions keep the current version until the next is ready.
+
+    With history_years=N only the last N years of a single-file source are held in memory
+    (read from the Ano/MesNumero partitions); selecting an older year loads just the
+    partitions of the selected years. None keeps the whole history in memory.
+
+    snapshot_dir must be the directory given to dashboard_engine --snapshot-dir, so the
+    snapshot and the precomputed artifacts of the batch job are the ones read here.
+
+    A warm-up callback (set_warmup) fills the result cache of each new version: after the
+    first load in a background thread, and on refreshes before the version is swapped in.
+    """
+
+    def __init__(self, loader=load_source, max_cached_results=DEFAULT_MAX_ENTRIES, max_cache_bytes=DEFAULT_MAX_BYTES,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL, history_years=None, snapshot_dir=None):
+        self._loader = loader
+        self.snapshot_dir = snapshot_dir
+        # The YoY KPIs compare with the previous year, so at least two years stay in memory
+        self.history_years = max(history_years, 2) if history_years else None
+        self._dataset = None
+        self._version = 0
+        self._load_lock = threading.Lock()
+        self.results = ResultCache(max_cached_results, max_cache_bytes)
+        self.refresh_interval = refresh_interval
+        self._refresher = None
+        self._refresh_source = None
+        self._refresh_wakeup = threading.Event()
+        self._refresh_forced = False
+        self._refresh_lock = threading.Lock()
+        # Signature whose load failed: not retried until the source changes again or a refresh is forced
+        self._failed_signature = None
+        self.refresh_state = {"running": False, "last_check": None, "last_error": None}
+        self._warmup = None
+        # Version being warmed before its swap; its results are kept like those of the served version
+        self._warming_version = None
+
+    @property
+    def dataset(self):
+        return self._dataset
+
+    def get_dataset(self, file_path, is_csv=False):
+        """Returns the dataset being served; only the first load of a source blocks the caller.
+
+        Also starts the background refresher for the source, which swaps in a new version when
+        the file changes.
+        """
+        self.start_refresher(file_path, is_csv)
+        dataset = self._dataset
+        if dataset is not None and dataset["file_path"] == file_path:
+            return dataset
+        return self.reload(file_path, is_csv, current=dataset)
+
+    def start_refresher(self, file_path, is_csv=False):
+        """Starts (once per process) the daemon thread polling the source signature of file_path."""
+        with self._refresh_lock:
+            self._refresh_source = (file_path, is_csv)
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name="dataset-refresher", daemon=True)
+            self._refresher.start()
+
+    def request_refresh(self, file_path=None, is_csv=False):
+        """Asks the refresher to reload now, even if the source is unchanged, without waiting for it."""
+        if file_path is not None:
+            self.start_refresher(file_path, is_csv)
+        self._refresh_forced = True
+        self._refresh_wakeup.set()
+
+    def set_warmup(self, warmup):
+        """Sets the callable warmup(store, dataset) run for each new dataset version (None disables it)."""
+        self._warmup = warmup
+
+    def _run_warmup(self, dataset):
+        warmup = self._warmup
+        if warmup is None:
+            return
+        try:
+            warmup(self, dataset)
+        except Exception as e:
+            print(f"Warning: Pré-aquecimento do cache falhou: {e}")
+            traceback.print_exc()
+
+    def _refresh_loop(self):
+        get_perf_tracer().start_run("refresh")
+        while True:
+            self._refresh_wakeup.wait(self.refresh_interval)
+            self._refresh_wakeup.clear()
+            forced, self._refresh_forced = self._refresh_forced, False
+            file_path, is_csv = self._refresh_source
+            try:
+                self.refresh_state["last_check"] = datetime.now()
+                dataset = self._dataset
+                signature = get_source_signature(file_path)
+                if signature is None and not forced:
+                    continue
+                stale = dataset is None or dataset["file_path"] != file_path or dataset["source_signature"] != signature
+                if forced or (stale and signature != self._failed_signature):
+                    self.refresh_state["running"] = True
+                    served = self.reload(file_path, is_csv, current=dataset)
+                    failed = served is dataset
+                    self._failed_signature = signature if failed else None
+                    self.refresh_state["last_error"] = f"Falha ao recarregar {file_path}" if failed else None
+            except Exception as e:
+                self.refresh_state["last_error"] = str(e)
+                print(f"Erro na atualização em segundo plano: {e}")
+                traceback.print_exc()
+            finally:
+                self.refresh_state["running"] = False
+
+    def reload(self, file_path, is_csv=False, current=None):
+        """Loads the source into a new dataset version and swaps it in atomically.
+
+        Concurrent callers wait for the load already in progress instead of starting another one.
+        Returns the dataset being served (the previous one if the load failed).
+        """
+        with self._load_lock:
+            if self._dataset is not current:
+                # Another session finished a load while this one was waiting
+                return self._dataset
+
+            print(f"Tentando carregar dados de: {os.path.abspath(file_path)}")
+            start_time = time.time()
+            source_signature = get_source_signature(file_path)
+            min_year = None
+            if self.history_years and not is_multi_source(file_path):
+                min_year = datetime.now().year - self.history_years + 1
+            with trace_stage("dataset.load", min_year=min_year) as stage:
+                options = {"min_year": min_year} if min_year else {}
+                if self.snapshot_dir:
+                    options["snapshot_dir"] = self.snapshot_dir
+                df_loaded = self._loader(file_path, is_csv, **options)
+                stage["rows_out"] = len(df_loaded) if df_loaded is not None else None
+            if df_loaded is None:
+                print(f"Falha ao carregar ou processar dados de {file_path}.")
+                return self._dataset
+            if 'DataCriacao' not in df_loaded.columns or not pd.api.types.is_datetime64_any_dtype(df_loaded['DataCriacao']):
+                print("Coluna 'DataCriacao' não encontrada ou não está no formato datetime.")
+                return self._dataset
+
+            with trace_stage("dataset.build", len(df_loaded)):
+                dataset = build_dataset(df_loaded, self._version + 1, file_path, source_signature, min_year, self.snapshot_dir)
+            # Unfiltered dashboard data precomputed by the batch job is served as a cache hit. It
+            # covers every year, so it does not stand for a frame cut to the history window.
+            precomputed = load_dashboard_aggregates(file_path, self.snapshot_dir) if min_year is None else None
+            if precomputed is not None:
+                self.results.put((dataset["version"], (), "dashboard"), precomputed)
+            if current is not None:
+                # Refresh: sessions keep the current version while the new one is warmed
+                self._warming_version = dataset["version"]
+                try:
+                    self._run_warmup(dataset)
+                finally:
+                    self._warming_version = None
+                self._swap(dataset)
+            else:
+                # First load: someone is waiting for the page, so warm up after serving
+                self._swap(dataset)
+                if self._warmup is not None:
+                    threading.Thread(target=self._run_warmup, args=(dataset,), name="dataset-warmup", daemon=True).start()
+            print(f"Dados carregados e verificados em {time.time() - start_time:.2f} segundos (versão {dataset['version']}).")
+            return dataset
+
+    def _swap(self, dataset):
+        self._version = dataset["version"]
+        self._dataset = dataset
+        # Results of older versions can no longer be requested
+        self.results.discard_if(lambda key: key[0] != dataset["version"])
+
+    def resolve_dataset(self, dataset, selections):
+        """Returns the bundle holding every row the selection can reach.
+
+        That is the in-memory dataset, unless the selection asks for years older than its
+        history window: then a bundle of only the selected years, read from their partitions,
+        is built (and cached like any result). Without an Ano selection the window's years are used.
+        """
+        years = _selected_years(selections)
+        min_year = dataset.get("min_year")
+        if min_year is None or not years or years[0] >= min_year:
+            return dataset
+
+        key = (dataset["version"], normalize_selection({"Ano": years}), "period")
+        with trace_stage("dataset.period", years=len(years)) as stage:
+            period = self.results.get(key)
+            stage["cache"] = "hit" if period is not None else "miss"
+            if period is None:
+                df_period = load_partitions(dataset["file_path"], years=years, snapshot_dir=dataset.get("snapshot_dir"))
+                if df_period is None:
+                    # Layout went stale with the source; the refresher will swap in a new version
+                    print("Warning: Partições desatualizadas. Servindo apenas os anos em memória.")
+                    return dataset
+                period = build_period_dataset(dataset, df_period, years)
+                # Only the frame and index of the period are new; the rest is shared with the dataset
+                self._put_result(dataset, key, period, estimate_size(df_period) + estimate_size(period["filter_index"]))
+            stage["rows_out"] = len(period["df"])
+        return period
+
+    def get_facets(self, dataset, selections):
+        """Returns the faceted sidebar options of a selection (filter_index.compute_facets), cached.
+
+        Under a history window, Ano also lists the years kept on disk: selected ones are counted
+        over their rows, the others show their partition totals (not narrowed by other filters).
+        """
+        def compute():
+            source = self.resolve_dataset(dataset, selections)
+            facets = compute_facets(source["filter_index"], selections, source["df"]["QuantidadeKPI"].to_numpy())
+            if dataset.get("offline_years") and "Ano" in facets:
+                online = facets["Ano"]
+                if source is not dataset:
+                    # The period bundle only has the selected years; the in-memory ones come from the dataset
+                    online = compute_facets(dataset["filter_index"], selections, dataset["df"]["QuantidadeKPI"].to_numpy(), ["Ano"])["Ano"]
+                merged = {"options": [], "counts": {}, "quantities": {}}
+                for year, (rows, quantity) in dataset["offline_years"].items():
+                    if source is not dataset and year in facets["Ano"]["counts"]:
+                        rows, quantity = facets["Ano"]["counts"][year], facets["Ano"]["quantities"][year]
+                    merged["options"].append(year)
+                    merged["counts"][year] = rows
+                    merged["quantities"][year] = quantity
+                merged["options"] += online["options"]
+                merged["counts"].update(online["counts"])
+                merged["quantities"].update(online["quantities"])
+                facets["Ano"] = merged
+            return facets
+        return self.get_aggregate(dataset, selections, "facets", compute)
+
+    def get_filtered_view(self, dataset, selections):
+        """Returns the rows of the dataset matching the selection, cached by (version, selection)."""
+        key = (dataset["version"], selection_key(dataset, selections), "view")
+        with trace_stage("filter.view", len(dataset["df"])) as stage:
+            view = self.results.get(key)
+            stage["cache"] = "hit" if view is not None else "miss"
+            if view is None:
+                view = apply_filter_index(dataset["df"], dataset["filter_index"], selections)
+                # The unfiltered view is the shared frame itself and costs nothing extra
+                self._put_result(dataset, key, view, 0 if view is dataset["df"] else None)
+            stage["rows_out"] = len(view)
+        return view
+
+    def get_aggregate(self, dataset, selections, aggregate_id, compute):
+        """Returns a chart/KPI aggregate of the selection, computing it only on a cache miss."""
+        key = (dataset["version"], selection_key(dataset, selections), aggregate_id)
+        missing = object()
+        with trace_stage(f"aggregate.{aggregate_id}") as stage:
+            value = self.results.get(key, missing)
+            stage["cache"] = "hit" if value is not missing else "miss"
+            if value is missing:
+                value = compute()
+                self._put_result(dataset, key, value)
+        return value
+
+    def _put_result(self, dataset, key, value, size=None):
+        # Results of a version that was swapped out meanwhile are not kept
+        if dataset["version"] in (self._version, self._warming_version):
+            self.results.put(key, value, size)
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_dataset_store(history_years=None, snapshot_dir=None):
+    """Returns the single DatasetStore of this process (options apply when it is first created)."""
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = DatasetStore(history_years=history_years, snapshot_dir=snapshot_dir)
+    return _STORE
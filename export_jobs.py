@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from perf_trace import get_perf_tracer
+
+EXPORT_FORMATS = {
+    "xlsx": {"label": "Excel", "mime": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"},
+    "csv": {"label": "CSV", "mime": "text/csv"},
+    "parquet": {"label": "Parquet", "mime": "application/vnd.apache.parquet"},
+}
+EXPORT_CHUNK_ROWS = 50000
+# Excel sheets stop at 1,048,576 rows (header included)
+EXCEL_MAX_ROWS = 1048575
+DEFAULT_MAX_EXPORT_FILES = 8
+DEFAULT_EXPORT_WORKERS = 2
+
+
+def write_export(df, export_format, path, chunk_rows=EXPORT_CHUNK_ROWS, progress=None):
+    """Writes df to path in chunks of chunk_rows, calling progress(rows_written) after each chunk.
+
+    CSV keeps the ';' separator and BOM of the previous download, so Excel in pt-BR opens it
+    directly. XLSX is written row by row in xlsxwriter's constant-memory mode.
+    """
+    n_rows = len(df)
+    starts = range(0, n_rows, chunk_rows) if n_rows else [0]
+
+    if export_format == "csv":
+        with open(path, "w", encoding="utf-8-sig", newline="") as fp:
+            for start in starts:
+                df.iloc[start:start + chunk_rows].to_csv(fp, index=False, sep=";", header=(start == 0))
+                if progress:
+                    progress(min(start + chunk_rows, n_rows))
+
+    elif export_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for start in starts:
+                table = pa.Table.from_pandas(df.iloc[start:start + chunk_rows], preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                if progress:
+                    progress(min(start + chunk_rows, n_rows))
+        finally:
+            if writer is not None:
+                writer.close()
+
+    elif export_format == "xlsx":
+        if n_rows > EXCEL_MAX_ROWS:
+            raise ValueError(f"O Excel aceita no máximo {EXCEL_MAX_ROWS} linhas ({n_rows} filtradas). Use CSV ou Parquet.")
+        import xlsxwriter
+        # Constant-memory mode flushes each row once written, so rows must go out in order
+        # (pandas' to_excel writes column by column and cannot be used here)
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "default_date_format": "yyyy-mm-dd hh:mm:ss"})
+        try:
+            worksheet = workbook.add_worksheet("DadosFiltrados")
+            worksheet.write_row(0, 0, [str(col) for col in df.columns], workbook.add_format({"bold": True}))
+            for start in starts:
+                values = df.iloc[start:start + chunk_rows].to_numpy(dtype=object)
+                values[pd.isna(values)] = None
+                for offset, row in enumerate(values, start=start + 1):
+                    worksheet.write_row(offset, 0, row)
+                if progress:
+                    progress(min(start + chunk_rows, n_rows))
+        finally:
+            workbook.close()
+
+    else:
+        raise ValueError(f"Formato de exportação desconhecido: {export_format}")
+    return path
+
+
+class ExportManager:
+    """Process-wide registry of export files generated on demand in background threads.
+
+    Jobs are keyed like the result cache, (dataset version, normalized selection, format), so
+    sessions asking for the same export share one file. Exports are written to disk, never
+    held in memory, and only the max_files most recently requested files are kept.
+    """
+
+    def __init__(self, export_dir=None, max_workers=DEFAULT_EXPORT_WORKERS, max_files=DEFAULT_MAX_EXPORT_FILES):
+        self.export_dir = export_dir or tempfile.mkdtemp(prefix="dashboard_exports_")
+        self.max_files = max_files
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="export")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def get_job(self, key):
+        """Returns the job for key (a dict with status, progress and path), or None if never requested."""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                self._jobs.move_to_end(key)
+            return job
+
+    def submit(self, key, df, export_format):
+        """Starts building the export of df in the background, unless a job for key already exists.
+
+        df must not be modified afterwards; the views served by the dataset store are read-only.
+        A finished job whose file is gone (removed from the export directory) is built again.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and (job["status"] == "running" or (job["status"] == "done" and os.path.exists(job["path"]))):
+                self._jobs.move_to_end(key)
+                return job
+            self._counter += 1
+            job = {
+                "key": key,
+                "format": export_format,
+                "path": os.path.join(self.export_dir, f"export_{self._counter}.{export_format}"),
+                "status": "running",
+                "rows_total": int(len(df)),
+                "rows_written": 0,
+                "size": None,
+                "error": None,
+                "started_at": time.time(),
+                "finished_at": None,
+            }
+            self._jobs[key] = job
+            self._jobs.move_to_end(key)
+            self._evict()
+        self._executor.submit(self._run, job, df)
+        return job
+
+    def _run(self, job, df):
+        def progress(rows_written):
+            job["rows_written"] = rows_written
+        tracer = get_perf_tracer()
+        tracer.start_run("export")
+        try:
+            os.makedirs(self.export_dir, exist_ok=True)
+            tmp_path = job["path"] + ".tmp"
+            with tracer.stage(f"export.{job['format']}", job["rows_total"]) as stage:
+                write_export(df, job["format"], tmp_path, progress=progress)
+                stage["rows_out"] = job["rows_written"]
+            os.replace(tmp_path, job["path"])
+            job["size"] = os.path.getsize(job["path"])
+            job["status"] = "done"
+            print(f"Exportação {job['format']} pronta: {job['rows_total']} linhas, {job['size'] / 1024 ** 2:.1f} MB em {time.time() - job['started_at']:.1f}s.")
+        except Exception as e:
+            job["error"] = str(e)
+            job["status"] = "failed"
+            print(f"Falha na exportação {job['format']}: {e}")
+            traceback.print_exc()
+        finally:
+            job["finished_at"] = time.time()
+
+    def _evict(self):
+        # Oldest finished jobs go first; running jobs are never removed
+        while len(self._jobs) > self.max_files:
+            for key, job in self._jobs.items():
+                if job["status"] != "running":
+                    del self._jobs[key]
+                    for path in (job["path"], job["path"] + ".tmp"):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    break
+            else:
+                return
+
+
+_MANAGER = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def get_export_manager():
+    """Returns the single ExportManager of this process."""
+    global _MANAGER
+    if _MANAGER is None:
+        with _MANAGER_LOCK:
+            if _MANAGER is None:
+                _MANAGER = ExportManager()
+    return _MANAGER
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+from perf_trace import trace_stage, traced
+
+# Sidebar filter dimensions, in the order apply_filters receives them
+FILTER_DIMENSIONS = [
+    "Ano", "MesNumero", "SemanaAno", "CanalBI", "TresP_AH", "SalesOrgE",
+    "Franqueado", "BrandCode", "CollectionDesc", "BrandCategory", "OticoSport"
+]
+# Values that exist in the data but are not offered as options in the sidebar
+EXCLUDED_OPTION_VALUES = {
+    "Franqueado": {"", "Não Especificado"},
+}
+
+
+def _value_key(value):
+    """Normalizes a value to the string form used by the sidebar (2024.0 and 2024 both become '2024')."""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _build_dimension_index(series):
+    """Builds the code array and the per-value sorted row-position lists of one dimension."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        uniques = series.cat.categories
+    else:
+        codes, uniques = pd.factorize(series, sort=False)
+
+    n_values = len(uniques)
+    values = [_value_key(value) for value in uniques]
+    code_dtype = np.int32 if len(series) < np.iinfo(np.int32).max else np.int64
+    codes = codes.astype(code_dtype, copy=False)
+
+    # Missing values get code -1: park them after every real value so they are never selected
+    sortable_codes = np.where(codes < 0, n_values, codes)
+    counts = np.bincount(sortable_codes, minlength=n_values + 1)
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    order = np.argsort(sortable_codes, kind="stable").astype(code_dtype, copy=False)
+
+    value_to_code = {}
+    for code, value in enumerate(values):
+        value_to_code.setdefault(value, code)
+
+    # Sidebar options: present, non-excluded values with their row counts (2024 and 2024.0 merged)
+    excluded = EXCLUDED_OPTION_VALUES.get(series.name, set())
+    option_counts = {}
+    for code, value in enumerate(values):
+        if counts[code] > 0 and value not in excluded:
+            option_counts[value] = option_counts.get(value, 0) + int(counts[code])
+    return {
+        "codes": codes,
+        "values": values,
+        "value_to_code": value_to_code,
+        "counts": counts[:n_values],
+        "offsets": offsets,
+        "order": order,
+        "options": _sort_options(option_counts, series.dtype),
+        "option_counts": option_counts,
+        "n_options": len(option_counts),
+    }
+
+
+def _sort_options(option_counts, dtype):
+    """Orders options like the sidebar always did: category order for ordered categoricals,
+    numeric order when every value is an integer (Ano, SemanaAno), text order otherwise."""
+    if isinstance(dtype, pd.CategoricalDtype) and dtype.ordered:
+        return [value for value in dict.fromkeys(map(_value_key, dtype.categories)) if value in option_counts]
+    try:
+        return sorted(option_counts, key=int)
+    except ValueError:
+        return sorted(option_counts)
+
+
+@traced("filter.index_build")
+def build_filter_index(df, dimensions=None):
+    """Builds, once per data load, a per-value row-position index for every filter dimension."""
+    if dimensions is None:
+        dimensions = FILTER_DIMENSIONS
+    index = {"n_rows": len(df), "dimensions": {}}
+    for col in dimensions:
+        if col in df.columns:
+            index["dimensions"][col] = _build_dimension_index(df[col])
+    print(f"Índice de filtros construído para {len(index['dimensions'])} dimensões e {len(df)} linhas.")
+    return index
+
+
+def build_filter_catalog(index):
+    """Returns the sidebar option catalog of an index: {dimension: {options, counts, cardinality}}.
+
+    Built once per data load from the index, so the sidebar never scans the frame.
+    """
+    return {
+        col: {
+            "options": dimension["options"],
+            "counts": dimension["option_counts"],
+            "cardinality": dimension["n_options"],
+        }
+        for col, dimension in index["dimensions"].items()
+    }
+
+
+def _selected_codes(dimension, selected_values):
+    codes = {dimension["value_to_code"][key] for key in map(_value_key, selected_values) if key in dimension["value_to_code"]}
+    return np.fromiter(sorted(codes), dtype=np.int64, count=len(codes))
+
+
+def _active_filters(index, selections):
+    """Lists (matching rows, dimension name, dimension index, selected codes) of every filtering dimension."""
+    active = []
+    for col, selected_values in selections.items():
+        dimension = index["dimensions"].get(col)
+        if dimension is None or not selected_values or len(selected_values) >= dimension["n_options"]:
+            continue
+        codes = _selected_codes(dimension, selected_values)
+        active.append((int(dimension["counts"][codes].sum()), col, dimension, codes))
+    return active
+
+
+def select_positions(index, selections):
+    """Resolves a selection into the sorted row positions that pass every active filter.
+
+    selections maps a dimension to the selected values. A dimension with nothing selected, or
+    with every option selected, does not filter. Values are OR-ed within a dimension and the
+    dimensions are AND-ed. Returns None when no filter is active.
+    """
+    return _positions_of(index, _active_filters(index, selections))
+
+
+def _positions_of(index, active):
+    if not active:
+        return None
+
+    # Drive from the most selective dimension's position lists, then check the others by code lookup
+    active = sorted(active, key=lambda item: item[0])
+    _, driver_col, driver, driver_codes = active[0]
+    with trace_stage(f"filter.{driver_col}", index["n_rows"], values=len(driver_codes)) as stage:
+        positions = np.concatenate(
+            [driver["order"][driver["offsets"][code]:driver["offsets"][code + 1]] for code in driver_codes]
+            or [np.empty(0, dtype=driver["order"].dtype)]
+        )
+        if len(driver_codes) > 1:
+            positions.sort()
+        stage["rows_out"] = len(positions)
+
+    for _, col, dimension, codes in active[1:]:
+        if len(positions) == 0:
+            break
+        with trace_stage(f"filter.{col}", len(positions), values=len(codes)) as stage:
+            lookup = np.zeros(len(dimension["values"]) + 1, dtype=bool)
+            lookup[codes] = True
+            positions = positions[lookup[dimension["codes"][positions]]]
+            stage["rows_out"] = len(positions)
+    return positions
+
+
+def apply_filter_index(df, index, selections):
+    """Returns the rows of df matching the selection with a single take over the indexed positions."""
+    positions = select_positions(index, selections)
+    if positions is None:
+        return df
+    with trace_stage("filter.take", len(df)) as stage:
+        view = df.take(positions)
+        stage["rows_out"] = len(view)
+    return view
+
+
+def _facet_counts(dimension, positions, weights):
+    # Row and weight totals per code over the given positions (every row when positions is None)
+    n_values = len(dimension["values"])
+    codes = dimension["codes"] if positions is None else dimension["codes"][positions]
+    valid = codes >= 0
+    if positions is None:
+        rows = dimension["counts"]
+    else:
+        rows = np.bincount(codes[valid], minlength=n_values)
+    totals = None
+    if weights is not None:
+        selected_weights = weights if positions is None else weights[positions]
+        totals = np.rint(np.bincount(codes[valid], weights=selected_weights[valid], minlength=n_values)).astype(np.int64)
+
+    option_rows = {}
+    option_totals = {}
+    for code in np.flatnonzero(rows):
+        value = dimension["values"][code]
+        if value not in dimension["option_counts"]:
+            continue
+        option_rows[value] = option_rows.get(value, 0) + int(rows[code])
+        if totals is not None:
+            option_totals[value] = option_totals.get(value, 0) + int(totals[code])
+    return {
+        "options": [value for value in dimension["options"] if value in option_rows],
+        "counts": option_rows,
+        "quantities": option_totals,
+    }
+
+
+def compute_facets(index, selections, weights=None, dimensions=None):
+    """Returns the options still reachable in every dimension under the other active filters.
+
+    Each dimension is counted over the rows passing every active filter except its own, so
+    its own selected values stay available while values with no rows left disappear. The rows
+    come from the per-value position lists of the index (one intersection per active
+    dimension, shared by all inactive ones), never from a filtered copy of the frame.
+    weights (e.g. QuantidadeKPI as an array aligned with the indexed frame) adds per-value sums.
+    dimensions limits the result to those dimensions (default: every indexed one).
+    Returns {dimension: {"options": [...], "counts": {value: rows}, "quantities": {value: sum}}}.
+    """
+    active = _active_filters(index, selections)
+    with trace_stage("filter.facets", index["n_rows"], active=len(active)):
+        all_positions = _positions_of(index, active)
+        facets = {}
+        for col, dimension in index["dimensions"].items():
+            if dimensions is not None and col not in dimensions:
+                continue
+            others = [item for item in active if item[1] != col]
+            positions = all_positions if len(others) == len(active) else _positions_of(index, others)
+            facets[col] = _facet_counts(dimension, positions, weights)
+    return facets
+
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from datetime import date, timedelta
+
+import numpy as np
+
+# The comparative KPIs only need day x status; a per-selection cube is built on demand by
+# passing the selected dimensions to build_daily_cube
+CUBE_DIMENSIONS = []
+STATUS_FATURADO = "Faturado"
+
+
+def build_daily_cube(df, dimensions=None):
+    """Aggregates QuantidadeKPI into daily totals by StatusKPI (and the given filter dimensions).
+
+    Built once per data load; every comparative KPI is then answered from the cube instead of
+    rescanning the order rows. The default cube has at most days x statuses cells.
+    """
+    if dimensions is None:
+        dimensions = CUBE_DIMENSIONS
+    group_cols = ["StatusKPI"] + [col for col in dimensions if col in df.columns]
+    keys = [df["DataCriacao"].dt.normalize().rename("Dia")] + [df[col] for col in group_cols]
+    cube = (
+        df["QuantidadeKPI"]
+        .groupby(keys, observed=True, sort=False, dropna=False)
+        .sum()
+        .reset_index()
+    )
+    print(f"Cubo diário construído: {len(cube)} células para {len(df)} linhas.")
+    return cube
+
+
+def build_daily_totals(cube, selections=None):
+    """Collapses the cube into cumulative daily series of created and billed quantities.
+
+    selections maps a dimension to the list of accepted values (all values when absent).
+    Returns a dict with the first day and the cumulative arrays, each prefixed with a zero
+    so any inclusive window sum is a single subtraction.
+    """
+    if selections:
+        mask = np.ones(len(cube), dtype=bool)
+        for col, values in selections.items():
+            if not values:
+                continue
+            if col not in cube.columns:
+                raise ValueError(f"Dimensão '{col}' ausente do cubo; construa-o com build_daily_cube(df, [{col!r}, ...]).")
+            mask &= cube[col].astype(str).isin(values).to_numpy()
+        cube = cube[mask]
+
+    if cube.empty:
+        return {"first_day": None, "last_day": None, "criado": np.zeros(1), "faturado": np.zeros(1)}
+
+    first_day = cube["Dia"].min()
+    last_day = cube["Dia"].max()
+    n_days = (last_day - first_day).days + 1
+    offsets = ((cube["Dia"] - first_day).dt.days).to_numpy()
+    quantities = cube["QuantidadeKPI"].to_numpy(dtype=np.int64)
+    faturado = (cube["StatusKPI"] == STATUS_FATURADO).to_numpy()
+
+    daily_criado = np.bincount(offsets, weights=quantities, minlength=n_days)
+    daily_faturado = np.bincount(offsets[faturado], weights=quantities[faturado], minlength=n_days)
+    return {
+        "first_day": first_day.date(),
+        "last_day": last_day.date(),
+        "criado": np.concatenate(([0], np.cumsum(daily_criado))),
+        "faturado": np.concatenate(([0], np.cumsum(daily_faturado))),
+    }
+
+
+def window_sum(totals, series, start, end):
+    """Sums one cumulative series over the inclusive [start, end] date window in O(1)."""
+    if totals["first_day"] is None or end < start:
+        return 0
+    cumulative = totals[series]
+    n_days = len(cumulative) - 1
+    start_offset = min(max((start - totals["first_day"]).days, 0), n_days)
+    end_offset = min(max((end - totals["first_day"]).days + 1, 0), n_days)
+    if end_offset <= start_offset:
+        return 0
+    return int(round(cumulative[end_offset] - cumulative[start_offset]))
+
+
+def _delta_percentage(current, previous):
+    return ((current - previous) / previous * 100) if previous != 0 else (float('inf') if current > 0 else 0)
+
+
+def compute_comparative_kpis(totals, today=None):
+    """Computes the YTD/MTD/WTD created and billed quantities against the matching previous periods.
+
+    today defaults to the latest day present in the data, as in the dashboard header.
+    """
+    if today is None:
+        today = totals["last_day"] or date.today()
+
+    current_year = today.year
+    current_month = today.month
+    current_day = today.day
+
+    prev_year = current_year - 1
+    prev_month_year = current_year if current_month > 1 else current_year - 1
+    prev_month = current_month - 1 if current_month > 1 else 12
+    prev_week_date = today - timedelta(days=7)
+
+    # Períodos Atuais (YTD, MTD, WTD)
+    start_current_year = date(current_year, 1, 1)
+    start_current_month = date(current_year, current_month, 1)
+    start_current_week = today - timedelta(days=today.weekday()) # Segunda-feira da semana atual
+
+    # Períodos Anteriores Correspondentes (YTD, MTD, WTD)
+    start_prev_year_ytd = date(prev_year, 1, 1)
+    try:
+        end_prev_year_ytd = date(prev_year, current_month, current_day)
+    except ValueError: # Dia não existe no ano anterior (ex: 29 Fev)
+        end_prev_year_ytd = date(prev_year, current_month, current_day -1)
+
+    start_prev_month_mtd = date(prev_month_year, prev_month, 1)
+    last_day_prev_month = (start_current_month - timedelta(days=1)).day
+    end_prev_month_mtd = date(prev_month_year, prev_month, min(current_day, last_day_prev_month))
+
+    start_prev_week_wtd = start_current_week - timedelta(days=7)
+    end_prev_week_wtd = prev_week_date
+
+    windows = {
+        "ytd": (start_current_year, today),
+        "prev_ytd": (start_prev_year_ytd, end_prev_year_ytd),
+        "mtd": (start_current_month, today),
+        "prev_mtd": (start_prev_month_mtd, end_prev_month_mtd),
+        "wtd": (start_current_week, today),
+        "prev_wtd": (start_prev_week_wtd, end_prev_week_wtd),
+    }
+
+    kpis = {
+        "today": today,
+        "current_year": current_year,
+        "prev_year": prev_year,
+        "end_prev_month_mtd": end_prev_month_mtd,
+        "end_prev_week_wtd": end_prev_week_wtd,
+    }
+    for series in ("criado", "faturado"):
+        for window, (start, end) in windows.items():
+            kpis[f"{series}_{window}"] = window_sum(totals, series, start, end)
+        kpis[f"delta_{series}_yoy"] = _delta_percentage(kpis[f"{series}_ytd"], kpis[f"{series}_prev_ytd"])
+        kpis[f"delta_{series}_mom"] = _delta_percentage(kpis[f"{series}_mtd"], kpis[f"{series}_prev_mtd"])
+        kpis[f"delta_{series}_wow"] = _delta_percentage(kpis[f"{series}_wtd"], kpis[f"{series}_prev_wtd"])
+    return kpis
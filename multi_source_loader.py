@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Loads an extract split across several files (a directory or a glob of XLSX/CSV) in parallel.
+
+Each file, or each sheet with all_sheets=True, is parsed and cleaned in its own worker
+process; the cleaned parts are then concatenated with their categories unioned.
+"""
+import functools
+import glob
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from data_processor_streamlit_corrected_v2 import (
+    SOURCE_CHUNK_ROWS, load_and_clean_data_with_snapshot, clean_excel_in_chunks,
+    list_excel_sheets, concat_cleaned_frames, report_memory_footprint
+)
+from partition_store import load_partitions
+
+SOURCE_EXTENSIONS = (".xlsx", ".xlsm", ".csv")
+
+
+def is_multi_source(source):
+    """True when source names a directory or a glob pattern rather than a single file."""
+    return os.path.isdir(source) or glob.has_magic(source)
+
+
+def resolve_source_files(source):
+    """Returns the sorted XLSX/CSV files of a directory or glob, or [source] for a single file.
+
+    Office lock files (~$name.xlsx) are skipped.
+    """
+    if os.path.isdir(source):
+        candidates = [os.path.join(source, name) for name in os.listdir(source)]
+    elif glob.has_magic(source):
+        candidates = glob.glob(source)
+    else:
+        return [source]
+    return sorted(
+        path for path in candidates
+        if os.path.isfile(path)
+        and path.lower().endswith(SOURCE_EXTENSIONS)
+        and not os.path.basename(path).startswith("~$")
+    )
+
+
+def get_sources_signature(source):
+    """Returns a hashable (path, mtime_ns, size) tuple over every file of the source, or None if empty."""
+    signature = []
+    for path in resolve_source_files(source):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        signature.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(signature) or None
+
+
+def build_source_tasks(files, all_sheets=False):
+    """Lists one (path, is_csv, sheet) task per file, or per sheet of each workbook with all_sheets.
+
+    sheet=None means the first sheet through the per-file snapshot.
+    """
+    tasks = []
+    for path in files:
+        is_csv = path.lower().endswith(".csv")
+        if is_csv or not all_sheets:
+            tasks.append((path, is_csv, None))
+            continue
+        sheet_names = list_excel_sheets(path)
+        print(f"{os.path.basename(path)}: {len(sheet_names)} planilha(s) {sheet_names}")
+        tasks.extend((path, False, sheet) for sheet in range(len(sheet_names)))
+    return tasks
+
+
+def load_source_task(task, chunk_rows=SOURCE_CHUNK_ROWS, snapshot_dir=None):
+    """Cleans one file or sheet (runs in a worker process); returns the cleaned frame or None.
+
+    Whole files go through their own snapshot (in snapshot_dir when given), so unchanged files
+    of the set are not re-parsed. Single sheets are cleaned directly, since snapshots are keyed per file.
+    """
+    path, is_csv, sheet = task
+    try:
+        if sheet is None:
+            return load_and_clean_data_with_snapshot(path, is_csv, snapshot_dir)
+        return clean_excel_in_chunks(path, chunk_rows, sheet)[0]
+    except Exception as e:
+        print(f"Ocorreu um erro inesperado ao processar {path} (planilha {sheet}): {e}")
+        traceback.print_exc()
+        return None
+
+
+def load_and_clean_sources(source, all_sheets=False, max_workers=None, snapshot_dir=None):
+    """Loads every XLSX/CSV of a directory or glob in parallel and returns one cleaned frame.
+
+    Files are cleaned in a process pool of up to max_workers processes (default: one per
+    CPU core); a single file or sheet runs in the calling process. The parts are concatenated
+    in file/sheet order with concat_cleaned_frames. Returns None if no file was found or if
+    any part failed, since a partial set would understate every KPI.
+    """
+    files = resolve_source_files(source)
+    if not files:
+        print(f"Error: Nenhum arquivo XLSX/CSV encontrado em {source}")
+        return None
+    tasks = build_source_tasks(files, all_sheets)
+    load_task = functools.partial(load_source_task, snapshot_dir=snapshot_dir)
+
+    start_time = time.time()
+    workers = min(len(tasks), max_workers or os.cpu_count() or 1)
+    print(f"Carregando {len(tasks)} parte(s) de {len(files)} arquivo(s) com {workers} processo(s)...")
+    if workers <= 1:
+        frames = [load_task(task) for task in tasks]
+    else:
+        # spawn: forking a multi-threaded server process (Streamlit) is not safe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            frames = list(executor.map(load_task, tasks))
+
+    failed = [task for task, frame in zip(tasks, frames) if frame is None]
+    if failed:
+        for path, _, sheet in failed:
+            print(f"Error: Falha ao carregar {path}" + (f" (planilha {sheet})" if sheet is not None else ""))
+        return None
+
+    df = concat_cleaned_frames(frames)
+    del frames
+    print(f"{len(tasks)} parte(s) carregadas em {time.time() - start_time:.1f}s: {df.shape[0]} linhas, {df.shape[1]} colunas.")
+    report_memory_footprint(df)
+    return df
+
+
+def load_source(source, is_csv=False, min_year=None, snapshot_dir=None):
+    """Loader for a single extract file or for a multi-file source (directory or glob).
+
+    is_csv only applies to a single file; in a multi-file source the extension decides.
+    min_year keeps only the rows from that year on (single files only): when the partitioned
+    layout is current only those partitions are read, otherwise the snapshot is loaded and trimmed.
+    snapshot_dir is where the snapshots live (default: next to each source file).
+    """
+    if is_multi_source(source):
+        return load_and_clean_sources(source, snapshot_dir=snapshot_dir)
+    if min_year is None:
+        return load_and_clean_data_with_snapshot(source, is_csv, snapshot_dir)
+    df = load_partitions(source, start=pd.Timestamp(year=min_year, month=1, day=1), snapshot_dir=snapshot_dir)
+    if df is not None:
+        return df
+    df = load_and_clean_data_with_snapshot(source, is_csv, snapshot_dir)
+    if df is None:
+        return None
+    return df[df["Ano"] >= min_year].reset_index(drop=True)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""Time-partitioned copy of the snapshot: one Parquet file per Ano/MesNumero, with statistics.
+
+The layout sits beside the snapshot (Hive-style, <snapshot>_partitions/Ano=2024/MesNumero=3/):
+
+    _partitions.json              content hash of the snapshot it was built from + per-partition stats
+    Ano=2024/MesNumero=3/part-0.parquet
+
+Each partition records its rows, DataCriacao and SemanaAno min/max and its QuantidadeKPI total,
+so a loader can skip every partition a selection or date window cannot touch without opening it.
+"""
+import json
+import os
+import shutil
+import traceback
+
+import numpy as np
+import pandas as pd
+
+from snapshot_store import get_snapshot_paths, read_manifest, is_snapshot_current
+from perf_trace import trace_stage, traced
+
+PARTITION_COLUMNS = ["Ano", "MesNumero"]
+PARTITION_FORMAT_VERSION = 1
+PARTITION_MANIFEST_NAME = "_partitions.json"
+
+
+def get_partition_dir(file_path, snapshot_dir=None):
+    """Returns the directory holding the partitioned layout of the source's snapshot."""
+    data_path, _ = get_snapshot_paths(file_path, snapshot_dir)
+    return data_path[:-len(".parquet")] + "_partitions"
+
+
+def _partition_stats(part, year, month, relative_path):
+    dates = part["DataCriacao"]
+    return {
+        "Ano": int(year),
+        "MesNumero": int(month),
+        "path": relative_path,
+        "rows": int(len(part)),
+        "date_min": dates.min().isoformat(),
+        "date_max": dates.max().isoformat(),
+        "week_min": int(part["SemanaAno"].min()),
+        "week_max": int(part["SemanaAno"].max()),
+        "quantity": int(part["QuantidadeKPI"].sum()),
+    }
+
+
+@traced("partitions.write")
+def save_partitions(df, file_path, snapshot_dir=None, content_hash=None):
+    """Writes df partitioned by Ano/MesNumero with per-partition stats; returns True on success.
+
+    The layout is built in a temporary directory and swapped in, so readers never see a mix of
+    two versions. content_hash must be the one recorded for the snapshot of the same frame.
+    """
+    if any(col not in df.columns for col in PARTITION_COLUMNS + ["DataCriacao", "SemanaAno", "QuantidadeKPI"]):
+        print("Warning: Colunas de partição ausentes. Layout particionado não gerado.")
+        return False
+    target_dir = get_partition_dir(file_path, snapshot_dir)
+    tmp_dir = target_dir + ".tmp"
+    try:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        # One stable sort by (Ano, MesNumero) instead of a boolean mask per partition
+        partition_keys = df["Ano"].to_numpy().astype(np.int64) * 100 + df["MesNumero"].to_numpy().astype(np.int64)
+        order = np.argsort(partition_keys, kind="stable")
+        sorted_keys = partition_keys[order]
+        boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+        partitions = []
+        for positions in np.split(order, boundaries):
+            if len(positions) == 0:
+                continue
+            year, month = divmod(int(partition_keys[positions[0]]), 100)
+            relative_path = os.path.join(f"Ano={year}", f"MesNumero={month}", "part-0.parquet")
+            part = df.take(positions)
+            os.makedirs(os.path.join(tmp_dir, os.path.dirname(relative_path)), exist_ok=True)
+            part.to_parquet(os.path.join(tmp_dir, relative_path), engine="pyarrow", index=False)
+            partitions.append(_partition_stats(part, year, month, relative_path))
+
+        manifest = {
+            "format_version": PARTITION_FORMAT_VERSION,
+            "content_hash": content_hash,
+            "rows": int(len(df)),
+            "partitions": partitions,
+        }
+        with open(os.path.join(tmp_dir, PARTITION_MANIFEST_NAME), "w", encoding="utf-8") as fp:
+            json.dump(manifest, fp, indent=2)
+
+        old_dir = target_dir + ".old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(target_dir):
+            os.replace(target_dir, old_dir)
+        os.replace(tmp_dir, target_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        print(f"Layout particionado salvo em {target_dir}: {len(partitions)} partições Ano/Mês.")
+        return True
+    except ImportError:
+        print("Warning: pyarrow não instalado. Layout particionado desativado.")
+        return False
+    except Exception as e:
+        print(f"Warning: Não foi possível salvar o layout particionado: {e}")
+        traceback.print_exc()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
+
+
+def ensure_partitions(df, file_path, snapshot_dir=None):
+    """Writes the layout of df, the frame of the current snapshot, unless an up-to-date one exists."""
+    if read_partition_manifest(file_path, snapshot_dir) is not None:
+        return True
+    snapshot_manifest = read_manifest(file_path, snapshot_dir)
+    if not snapshot_manifest or "content_hash" not in snapshot_manifest:
+        return False
+    return save_partitions(df, file_path, snapshot_dir, snapshot_manifest["content_hash"])
+
+
+def read_partition_manifest(file_path, snapshot_dir=None):
+    """Returns the partition manifest if it was built from the snapshot that is still current, else None."""
+    manifest_path = os.path.join(get_partition_dir(file_path, snapshot_dir), PARTITION_MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Manifesto das partições ilegível ({manifest_path}): {e}")
+        return None
+    snapshot_manifest = read_manifest(file_path, snapshot_dir)
+    if (manifest.get("format_version") != PARTITION_FORMAT_VERSION or not snapshot_manifest
+            or manifest.get("content_hash") != snapshot_manifest.get("content_hash")
+            or not is_snapshot_current(file_path, snapshot_dir, snapshot_manifest)):
+        return None
+    return manifest
+
+
+def prune_partitions(partitions, years=None, months=None, weeks=None, start=None, end=None):
+    """Keeps the partitions that can hold rows of the given years, months, weeks and date window.
+
+    Empty or None arguments do not prune. Weeks and dates are checked against the min/max stats.
+    """
+    years = {int(year) for year in years} if years else None
+    months = {int(month) for month in months} if months else None
+    weeks = sorted(int(week) for week in weeks) if weeks else None
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    kept = []
+    for partition in partitions:
+        if years is not None and partition["Ano"] not in years:
+            continue
+        if months is not None and partition["MesNumero"] not in months:
+            continue
+        if weeks is not None and not any(partition["week_min"] <= week <= partition["week_max"] for week in weeks):
+            continue
+        if start is not None and pd.Timestamp(partition["date_max"]) < start:
+            continue
+        if end is not None and pd.Timestamp(partition["date_min"]) > end:
+            continue
+        kept.append(partition)
+    return kept
+
+
+def load_partitions(file_path, years=None, months=None, weeks=None, start=None, end=None, snapshot_dir=None):
+    """Reads only the partitions that survive prune_partitions and returns them as one cleaned frame.
+
+    Rows inside a kept partition are not filtered further (a partition is the unit of I/O).
+    Returns None when the layout is missing or stale, so the caller can fall back to the snapshot.
+    """
+    manifest = read_partition_manifest(file_path, snapshot_dir)
+    if manifest is None:
+        return None
+    kept = prune_partitions(manifest["partitions"], years, months, weeks, start, end)
+    partition_dir = get_partition_dir(file_path, snapshot_dir)
+    with trace_stage("partitions.read", manifest["rows"], partitions=len(kept)) as stage:
+        try:
+            frames = [pd.read_parquet(os.path.join(partition_dir, partition["path"]), engine="pyarrow") for partition in kept]
+        except Exception as e:
+            print(f"Warning: Falha ao ler as partições: {e}")
+            return None
+        if frames:
+            # Imported here: the data processor writes the layout and imports this module
+            from data_processor_streamlit_corrected_v2 import concat_cleaned_frames
+            df = concat_cleaned_frames(frames)
+        else:
+            # No partition matches: an empty frame with the layout's columns and dtypes
+            sample = manifest["partitions"][:1]
+            sample_path = os.path.join(partition_dir, sample[0]["path"]) if sample else get_snapshot_paths(file_path, snapshot_dir)[0]
+            df = pd.read_parquet(sample_path, engine="pyarrow").iloc[0:0]
+        stage["rows_out"] = len(df)
+    print(f"Partições lidas: {len(kept)} de {len(manifest['partitions'])} ({len(df)} de {manifest['rows']} linhas).")
+    return df
+
+
+def get_partition_year_stats(file_path, snapshot_dir=None):
+    """Returns {Ano: (rows, quantity)} from the partition stats, or None when the layout is not current."""
+    manifest = read_partition_manifest(file_path, snapshot_dir)
+    if manifest is None:
+        return None
+    stats = {}
+    for partition in manifest["partitions"]:
+        rows, quantity = stats.get(partition["Ano"], (0, 0))
+        stats[partition["Ano"]] = (rows + partition["rows"], quantity + partition["quantity"])
+    return stats
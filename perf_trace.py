@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Per-stage timing and memory instrumentation of the dashboard pipeline.
+
+Every stage (file read, column mapping, each cleaning step, each filter, each aggregate, each
+chart and each export) records its wall time, rows in/out and the change in process RSS. The
+records are kept in a bounded in-memory log, read by the sidebar performance panel, and are
+also appended as JSON lines to the file named by DASHBOARD_PERF_LOG when it is set:
+
+    DASHBOARD_PERF_LOG=logs/perf.jsonl streamlit run app_streamlit_v4.py
+"""
+import contextlib
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import pandas as pd
+
+PERF_LOG_ENV = "DASHBOARD_PERF_LOG"
+DEFAULT_MAX_RECORDS = 5000
+
+
+def current_rss():
+    """Resident set size of this process in bytes (Linux /proc, psutil elsewhere), or None."""
+    try:
+        with open("/proc/self/statm", "r") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+def count_rows(value):
+    """Number of rows of a DataFrame/Series, None for any other value."""
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+
+class PerfTracer:
+    """Process-wide recorder of pipeline stages.
+
+    Stages are grouped into runs (one Streamlit rerun, one export job...): start_run tags every
+    later stage of the calling thread with a new run id. Stages may nest; depth records the level.
+    """
+
+    def __init__(self, log_path=None, max_records=DEFAULT_MAX_RECORDS):
+        self.log_path = log_path
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._run_ids = itertools.count(1)
+
+    def start_run(self, label):
+        """Starts a new run for the calling thread and returns its id."""
+        run_id = next(self._run_ids)
+        self._local.run = (run_id, label)
+        return run_id
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None, **context):
+        """Records the enclosed block as one stage.
+
+        Yields the record dict; set record["rows_out"] (or any extra field) inside the block.
+        Extra keyword arguments are stored as-is in the record.
+        """
+        record = {"stage": name, "rows_in": rows_in, "rows_out": None}
+        record.update(context)
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        rss_before = current_rss()
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield record
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            rss_after = current_rss()
+            self._local.depth = depth
+            run_id, run_label = getattr(self._local, "run", (None, None))
+            record.update({
+                "ts": datetime.now().isoformat(timespec="milliseconds"),
+                "run_id": run_id,
+                "run": run_label,
+                "pid": os.getpid(),
+                "depth": depth,
+                "seconds": seconds,
+                "rss_delta": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+                "rss": rss_after,
+                "status": status,
+            })
+            self._add(record)
+
+    def _add(self, record):
+        with self._lock:
+            self._records.append(record)
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a", encoding="utf-8") as fp:
+                        fp.write(json.dumps(record, default=str) + "\n")
+                except OSError as e:
+                    print(f"Warning: Não foi possível gravar o log de desempenho em {self.log_path}: {e}")
+                    self.log_path = None
+
+    def records(self, run_id=None):
+        """Returns the recorded stages (oldest first), only those of run_id when given."""
+        with self._lock:
+            records = list(self._records)
+        if run_id is not None:
+            records = [record for record in records if record["run_id"] == run_id]
+        return records
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+def summarize_stages(records):
+    """Aggregates stage records per stage name: calls, total/max seconds, rows and memory delta.
+
+    Only top-level time adds up to the run's wall time; nested stages are already inside their parent.
+    """
+    columns = ["stage", "calls", "seconds", "max_seconds", "rows_in", "rows_out", "rss_delta_mb"]
+    if not records:
+        return pd.DataFrame(columns=columns)
+    frame = pd.DataFrame.from_records(records, columns=["stage", "seconds", "rows_in", "rows_out", "rss_delta"])
+    summary = frame.groupby("stage", sort=False).agg(
+        calls=("seconds", "size"),
+        seconds=("seconds", "sum"),
+        max_seconds=("seconds", "max"),
+        rows_in=("rows_in", "sum"),
+        rows_out=("rows_out", "sum"),
+        rss_delta_mb=("rss_delta", "sum"),
+    ).reset_index()
+    summary["rss_delta_mb"] = summary["rss_delta_mb"] / 1024 ** 2
+    return summary.sort_values("seconds", ascending=False, ignore_index=True)[columns]
+
+
+_TRACER = None
+_TRACER_LOCK = threading.Lock()
+
+
+def get_perf_tracer():
+    """Returns the single PerfTracer of this process (logging to DASHBOARD_PERF_LOG when set)."""
+    global _TRACER
+    if _TRACER is None:
+        with _TRACER_LOCK:
+            if _TRACER is None:
+                _TRACER = PerfTracer(log_path=os.environ.get(PERF_LOG_ENV) or None)
+    return _TRACER
+
+
+def trace_stage(name, rows_in=None, **context):
+    """Shortcut for get_perf_tracer().stage(...)."""
+    return get_perf_tracer().stage(name, rows_in, **context)
+
+
+def traced(name):
+    """Decorator recording each call as a stage; rows in/out come from a DataFrame first argument and result."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rows_in = count_rows(args[0]) if args else None
+            with trace_stage(name, rows_in) as record:
+                result = func(*args, **kwargs)
+                record["rows_out"] = count_rows(result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""Pluggable engines for the dashboard aggregates of a filter selection.
+
+"pandas" filters through the per-value filter index and aggregates with bincounts
+(chart_aggregates). "duckdb" runs the same selection and aggregate set as SQL in an embedded
+DuckDB over the Parquet snapshot (or over the in-memory frame when there is no current
+snapshot); filters and projections are pushed into the scan, which runs in parallel.
+Both return the dict of compute_dashboard_aggregates, and can be cross-checked:
+
+    python query_backend.py upload/teste_d11.xlsx
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from filter_index import apply_filter_index, _value_key
+from chart_aggregates import compute_dashboard_aggregates, STATUS_FATURADO, STATUS_CANCELADO, TOP_RANKINGS
+from snapshot_store import get_snapshot_paths, read_manifest, is_snapshot_current
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+QUERY_BACKENDS = ["pandas", "duckdb"]
+DEFAULT_QUERY_BACKEND = "pandas"
+
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def build_where_clause(index, selections):
+    """Translates a sidebar selection into a SQL WHERE clause and its parameters.
+
+    Same rules as select_positions: empty selections and selections holding every option do
+    not filter, values are OR-ed within a dimension and dimensions are AND-ed. Values are
+    compared in the normalized string form of the filter index.
+    """
+    conditions = []
+    parameters = []
+    for col, selected_values in selections.items():
+        dimension = index["dimensions"].get(col)
+        if dimension is None or not selected_values or len(selected_values) >= dimension["n_options"]:
+            continue
+        keys = sorted({_value_key(value) for value in selected_values})
+        conditions.append(f"CAST({_quote(col)} AS VARCHAR) IN ({', '.join('?' for _ in keys)})")
+        parameters.extend(keys)
+    if not conditions:
+        return "", []
+    return "WHERE " + " AND ".join(conditions), parameters
+
+
+class PandasBackend:
+    """In-memory engine: filter index + single-pass bincount aggregates."""
+
+    name = "pandas"
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def compute_aggregates(self, selections):
+        return compute_dashboard_aggregates(apply_filter_index(self.dataset["df"], self.dataset["filter_index"], selections))
+
+
+class DuckDBBackend:
+    """Embedded DuckDB engine over the Parquet snapshot of the dataset (or its in-memory frame).
+
+    One connection per backend; each query runs on its own cursor, so concurrent sessions
+    can share it.
+    """
+
+    name = "duckdb"
+
+    def __init__(self, dataset, threads=None):
+        if duckdb is None:
+            raise ImportError("duckdb não instalado (pip install duckdb).")
+        self.dataset = dataset
+        self._connection = duckdb.connect(database=":memory:")
+        if threads:
+            self._connection.execute(f"SET threads TO {int(threads)}")
+
+        parquet_path = _current_snapshot_path(dataset)
+        if parquet_path is not None:
+            self.source = f"read_parquet('{parquet_path.replace(chr(39), chr(39) * 2)}')"
+            self.source_description = parquet_path
+        else:
+            self.source = "dataset_frame"
+            self.source_description = "DataFrame em memória"
+        self.columns = set(dataset["df"].columns)
+
+    def _query(self, sql, parameters):
+        cursor = self._connection.cursor()
+        try:
+            if self.source == "dataset_frame":
+                # Registered frames are visible to one cursor only; registering is zero-copy
+                cursor.register("dataset_frame", self.dataset["df"])
+            return cursor.execute(sql, parameters).fetchdf()
+        finally:
+            cursor.close()
+
+    def _top_query(self, label_col, where, parameters, n, faturado_only, exclude=()):
+        # Ties keep label order, like the stable ranking of the pandas path (categories are sorted)
+        label = _quote(label_col)
+        conditions = [f"{label} IS NOT NULL"]
+        condition_parameters = []
+        if faturado_only:
+            conditions.append('"StatusKPI" = ?')
+            condition_parameters.append(STATUS_FATURADO)
+        if exclude:
+            conditions.append(f"CAST({label} AS VARCHAR) NOT IN ({', '.join('?' for _ in exclude)})")
+            condition_parameters.extend(exclude)
+        where_all = (where + " AND " if where else "WHERE ") + " AND ".join(conditions)
+        frame = self._query(
+            f"SELECT CAST({label} AS VARCHAR) AS {label}, CAST(SUM(\"QuantidadeKPI\") AS BIGINT) AS \"QuantidadeKPI\" "
+            f"FROM {self.source} {where_all} GROUP BY 1 ORDER BY 2 DESC, 1 LIMIT {int(n)}",
+            parameters + condition_parameters,
+        )
+        frame["QuantidadeKPI"] = frame["QuantidadeKPI"].astype(np.int64)
+        return frame
+
+    def compute_aggregates(self, selections):
+        """Runs the dashboard aggregate set for a selection; returns the compute_dashboard_aggregates dict."""
+        where, parameters = build_where_clause(self.dataset["filter_index"], selections)
+
+        status = self._query(
+            "SELECT CAST(COALESCE(SUM(\"QuantidadeKPI\"), 0) AS BIGINT) AS criada, "
+            "CAST(COALESCE(SUM(\"QuantidadeKPI\") FILTER (WHERE \"StatusKPI\" = ?), 0) AS BIGINT) AS cancelada, "
+            "CAST(COALESCE(SUM(\"QuantidadeKPI\") FILTER (WHERE \"StatusKPI\" = ?), 0) AS BIGINT) AS faturada "
+            f"FROM {self.source} {where}",
+            [STATUS_CANCELADO, STATUS_FATURADO] + parameters,
+        ).iloc[0]
+        qtd_criada, qtd_cancelada, qtd_faturada = (int(status[key]) for key in ("criada", "cancelada", "faturada"))
+        aggregates = {
+            "status": {
+                "criada": qtd_criada,
+                "cancelada": qtd_cancelada,
+                "faturada": qtd_faturada,
+                "aberta": qtd_criada - qtd_cancelada - qtd_faturada,
+            }
+        }
+
+        # One pass for the month-level series; years and the month range are rebuilt from it
+        months = self._query(
+            "SELECT CAST(\"Ano\" AS BIGINT) * 12 + CAST(\"MesNumero\" AS BIGINT) - 1 AS month_index, "
+            "CAST(SUM(\"QuantidadeKPI\") AS BIGINT) AS criado, "
+            "CAST(COALESCE(SUM(\"QuantidadeKPI\") FILTER (WHERE \"StatusKPI\" = ?), 0) AS BIGINT) AS faturado, "
+            "COUNT(*) FILTER (WHERE \"StatusKPI\" = ?) AS faturado_rows "
+            f"FROM {self.source} {where} GROUP BY 1 ORDER BY 1",
+            [STATUS_FATURADO, STATUS_FATURADO] + parameters,
+        )
+        faturado_months = months[months["faturado_rows"] > 0]
+        aggregates["criado_mes"] = _month_range_frame(months["month_index"], months["criado"])
+        aggregates["faturado_mes"] = _month_range_frame(faturado_months["month_index"], faturado_months["faturado"])
+        aggregates["criado_ano"] = _year_frame(months["month_index"], months["criado"])
+        aggregates["faturado_ano"] = _year_frame(faturado_months["month_index"], faturado_months["faturado"])
+
+        for aggregate_id, (col, n, faturado_only, exclude) in TOP_RANKINGS.items():
+            if col in self.columns:
+                aggregates[aggregate_id] = self._top_query(col, where, parameters, n, faturado_only, exclude)
+        if "BrandCategory" in self.columns:
+            where_category = (where + " AND " if where else "WHERE ") + '"BrandCategory" IS NOT NULL'
+            pizza = self._query(
+                "SELECT CAST(\"BrandCategory\" AS VARCHAR) AS \"BrandCategory\", COUNT(*) AS \"count\" "
+                f"FROM {self.source} {where_category} GROUP BY 1 ORDER BY 1",
+                parameters,
+            )
+            pizza["count"] = pizza["count"].astype(np.int64)
+            aggregates["pizza_categoria"] = pizza
+        return aggregates
+
+    def close(self):
+        self._connection.close()
+
+
+def _month_range_frame(month_index, totals):
+    """Expands month totals into the contiguous month-start series of the pandas path (missing months = 0)."""
+    if len(month_index) == 0:
+        return pd.DataFrame({"DataCriacao": pd.DatetimeIndex([]), "QuantidadeKPI": np.array([], dtype=np.int64)})
+    month_index = month_index.to_numpy(dtype=np.int64)
+    first_month = int(month_index.min())
+    series = np.zeros(int(month_index.max()) - first_month + 1, dtype=np.int64)
+    series[month_index - first_month] = totals.to_numpy(dtype=np.int64)
+    start = pd.Timestamp(year=first_month // 12, month=first_month % 12 + 1, day=1)
+    return pd.DataFrame({"DataCriacao": pd.date_range(start, periods=len(series), freq="MS"), "QuantidadeKPI": series})
+
+
+def _year_frame(month_index, totals):
+    years = month_index.to_numpy(dtype=np.int64) // 12
+    frame = pd.DataFrame({"Ano": years, "QuantidadeKPI": totals.to_numpy(dtype=np.int64)})
+    return frame.groupby("Ano", as_index=False, sort=True)["QuantidadeKPI"].sum()
+
+
+def _current_snapshot_path(dataset):
+    """Parquet snapshot holding exactly the dataset's rows, or None (multi-file source, stale or missing)."""
+    file_path = dataset.get("file_path")
+    if not file_path or not os.path.isfile(file_path):
+        return None
+    snapshot_dir = dataset.get("snapshot_dir")
+    manifest = read_manifest(file_path, snapshot_dir)
+    if not manifest or manifest.get("rows") != len(dataset["df"]) or not is_snapshot_current(file_path, snapshot_dir, manifest):
+        return None
+    return get_snapshot_paths(file_path, snapshot_dir)[0]
+
+
+_BACKENDS = {}
+_BACKENDS_LOCK = threading.Lock()
+
+
+def get_query_backend(dataset, name=DEFAULT_QUERY_BACKEND):
+    """Returns the backend of the given name bound to the dataset version (reused across sessions).
+
+    Falls back to pandas when DuckDB is not installed.
+    """
+    if name == "duckdb" and duckdb is None:
+        print("Warning: duckdb não instalado. Usando o backend pandas.")
+        name = "pandas"
+    # Bundles of older years read from the partitions get a backend of their own
+    key = (dataset["version"], name, dataset.get("period_years"))
+    with _BACKENDS_LOCK:
+        backend = _BACKENDS.get(key)
+        if backend is None:
+            # Backends of older dataset versions are released
+            for old_key in [old_key for old_key in _BACKENDS if old_key[0] != dataset["version"]]:
+                old_backend = _BACKENDS.pop(old_key)
+                if hasattr(old_backend, "close"):
+                    old_backend.close()
+            backend = DuckDBBackend(dataset) if name == "duckdb" else PandasBackend(dataset)
+            _BACKENDS[key] = backend
+        return backend
+
+
+def _normalized(frame):
+    # Label columns come back as categorical, object or Arrow strings depending on the engine
+    frame = frame.reset_index(drop=True)
+    labels = [col for col in frame.columns
+              if not (pd.api.types.is_numeric_dtype(frame[col]) or pd.api.types.is_datetime64_any_dtype(frame[col]))]
+    return frame.astype({col: str for col in labels})
+
+
+def compare_aggregates(expected, actual):
+    """Lists the aggregate ids whose values differ between two backends (dtypes of label columns aside)."""
+    differences = []
+    for key in sorted(set(expected) | set(actual)):
+        left, right = expected.get(key), actual.get(key)
+        if isinstance(left, dict) or isinstance(right, dict):
+            if left != right:
+                differences.append(key)
+            continue
+        if left is None or right is None:
+            differences.append(key)
+            continue
+        try:
+            pd.testing.assert_frame_equal(_normalized(left), _normalized(right), check_dtype=False)
+        except AssertionError:
+            differences.append(key)
+    return differences
+
+
+def cross_check(dataset, selections_list):
+    """Runs every selection on both backends; returns [(selection, differing aggregate ids, pandas s, duckdb s)]."""
+    pandas_backend = PandasBackend(dataset)
+    duckdb_backend = DuckDBBackend(dataset)
+    report = []
+    try:
+        for selections in selections_list:
+            start = time.perf_counter()
+            expected = pandas_backend.compute_aggregates(selections)
+            pandas_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            actual = duckdb_backend.compute_aggregates(selections)
+            duckdb_seconds = time.perf_counter() - start
+            report.append((selections, compare_aggregates(expected, actual), pandas_seconds, duckdb_seconds))
+    finally:
+        duckdb_backend.close()
+    return report
+
+
+def sample_selections(dataset, n_random=8, seed=0):
+    """Unfiltered, one per year and a few random multi-dimension selections drawn from the filter index."""
+    rng = np.random.default_rng(seed)
+    dimensions = dataset["filter_index"]["dimensions"]
+    selections_list = [{}]
+    if "Ano" in dimensions:
+        selections_list.extend({"Ano": [year]} for year in dimensions["Ano"]["values"])
+    names = list(dimensions)
+    for _ in range(n_random):
+        selection = {}
+        for col in rng.choice(names, size=min(3, len(names)), replace=False):
+            values = dimensions[col]["values"]
+            picked = rng.choice(len(values), size=min(len(values), int(rng.integers(1, 4))), replace=False)
+            selection[str(col)] = [values[i] for i in picked]
+        selections_list.append(selection)
+    return selections_list
+
+
+def main(argv=None):
+    from dataset_store import DatasetStore
+
+    parser = argparse.ArgumentParser(description="Compara os backends pandas e DuckDB nos agregados do dashboard.")
+    parser.add_argument("source", help="Arquivo de origem (XLSX ou CSV), ou diretório/glob com vários arquivos")
+    parser.add_argument("--csv", action="store_true", help="O arquivo de origem é CSV")
+    parser.add_argument("--random", type=int, default=8, help="Quantidade de seleções aleatórias")
+    args = parser.parse_args(argv)
+    if duckdb is None:
+        print("Error: duckdb não instalado.", file=sys.stderr)
+        return 1
+
+    dataset = DatasetStore().get_dataset(args.source, args.csv or args.source.lower().endswith(".csv"))
+    if dataset is None:
+        print(f"Falha ao carregar ou processar dados de {args.source}.", file=sys.stderr)
+        return 1
+    report = cross_check(dataset, sample_selections(dataset, args.random))
+    failures = 0
+    for selections, differences, pandas_seconds, duckdb_seconds in report:
+        failures += bool(differences)
+        status = "OK" if not differences else "DIVERGENTE: " + ", ".join(differences)
+        print(f"{status:<12} pandas {pandas_seconds * 1000:7.1f} ms | duckdb {duckdb_seconds * 1000:7.1f} ms | {selections}")
+    print(f"{len(report) - failures}/{len(report)} seleções idênticas.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
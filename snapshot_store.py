@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import traceback
+
+import pandas as pd
+
+from perf_trace import traced
+
+# Snapshots live next to the source extract unless another directory is given
+SNAPSHOT_DIR_NAME = ".snapshot_cache"
+# Bump whenever the cleaned frame layout changes so old snapshots are ignored
+SNAPSHOT_FORMAT_VERSION = 3
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def get_snapshot_dir(file_path, snapshot_dir=None):
+    """Returns the directory that holds the snapshots for the given source file."""
+    if snapshot_dir:
+        return snapshot_dir
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), SNAPSHOT_DIR_NAME)
+
+
+def get_snapshot_paths(file_path, snapshot_dir=None):
+    """Returns the (data, manifest) paths of the snapshot keyed on the source path."""
+    source_key = hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest()[:16]
+    base = os.path.join(get_snapshot_dir(file_path, snapshot_dir), source_key)
+    return base + ".parquet", base + ".json"
+
+
+def get_snapshot_keys_path(file_path, snapshot_dir=None):
+    """Returns the path of the sidecar holding the per-order hashes used by the incremental load."""
+    data_path, _ = get_snapshot_paths(file_path, snapshot_dir)
+    return data_path[:-len(".parquet")] + ".keys.parquet"
+
+
+def compute_content_hash(file_path):
+    """Hashes the raw bytes of the source file in fixed-size chunks."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_source_signature(file_path):
+    """Returns the cheap part of the snapshot key (path, size and mtime)."""
+    stat = os.stat(file_path)
+    return {
+        "source_path": os.path.abspath(file_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def read_manifest(file_path, snapshot_dir=None):
+    """Reads the manifest of the snapshot for the given source, or None if absent/corrupt."""
+    _, manifest_path = get_snapshot_paths(file_path, snapshot_dir)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as fp:
+            return json.load(fp)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Manifesto do snapshot ilegível ({manifest_path}): {e}")
+        return None
+
+
+def _write_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fp:
+        json.dump(manifest, fp, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def is_snapshot_current(file_path, snapshot_dir=None, manifest=None):
+    """Checks whether the snapshot still matches the source file.
+
+    Path, size and mtime are compared first; when only the mtime moved (file copied
+    or touched) the content hash decides, so an unchanged extract is never re-parsed.
+    """
+    if manifest is None:
+        manifest = read_manifest(file_path, snapshot_dir)
+    if not manifest or manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        return False
+    data_path, manifest_path = get_snapshot_paths(file_path, snapshot_dir)
+    if not os.path.exists(data_path):
+        return False
+
+    signature = get_source_signature(file_path)
+    if signature["source_path"] != manifest.get("source_path") or signature["size"] != manifest.get("size"):
+        return False
+    if signature["mtime_ns"] == manifest.get("mtime_ns"):
+        return True
+
+    if compute_content_hash(file_path) != manifest.get("content_hash"):
+        return False
+    # Same bytes with a new mtime: refresh the manifest so the next check is cheap again
+    manifest["mtime_ns"] = signature["mtime_ns"]
+    try:
+        _write_manifest(manifest, manifest_path)
+    except OSError as e:
+        print(f"Warning: Não foi possível atualizar o manifesto do snapshot: {e}")
+    return True
+
+
+@traced("snapshot.read")
+def load_snapshot(file_path, snapshot_dir=None):
+    """Loads the cleaned frame from the snapshot if it is still current, otherwise returns None."""
+    try:
+        if not is_snapshot_current(file_path, snapshot_dir):
+            return None
+        data_path, _ = get_snapshot_paths(file_path, snapshot_dir)
+        df = pd.read_parquet(data_path, engine="pyarrow", memory_map=True)
+        print(f"Snapshot carregado de {data_path}: {df.shape[0]} linhas, {df.shape[1]} colunas.")
+        return df
+    except ImportError:
+        print("Warning: pyarrow não instalado. Snapshot em disco desativado.")
+        return None
+    except Exception as e:
+        print(f"Warning: Falha ao ler o snapshot, o arquivo fonte será processado novamente: {e}")
+        traceback.print_exc()
+        return None
+
+
+def load_snapshot_history(file_path, snapshot_dir=None):
+    """Loads the last snapshot and its order-hash sidecar even if the source changed since.
+
+    Returns (df, keys) or (None, None) when there is no usable history for this source. The
+    history lives only in this cache, so whenever one existed but cannot be used a warning says
+    that the orders absent from the current extract are dropped.
+    """
+    manifest = read_manifest(file_path, snapshot_dir)
+    if not manifest:
+        print(f"Sem histórico de snapshot para {file_path}: somente os pedidos deste arquivo serão carregados.")
+        return None, None
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        print(f"Warning: Snapshot no formato {manifest.get('format_version')} (atual: {SNAPSHOT_FORMAT_VERSION}). "
+              "Histórico descartado: pedidos ausentes do arquivo fonte deixam de aparecer.")
+        return None, None
+    data_path, _ = get_snapshot_paths(file_path, snapshot_dir)
+    keys_path = get_snapshot_keys_path(file_path, snapshot_dir)
+    if not os.path.exists(data_path) or not os.path.exists(keys_path):
+        print("Warning: Snapshot ou hashes por pedido ausentes. Histórico descartado: pedidos ausentes do arquivo fonte deixam de aparecer.")
+        return None, None
+    try:
+        df = pd.read_parquet(data_path, engine="pyarrow", memory_map=True)
+        keys = pd.read_parquet(keys_path, engine="pyarrow")
+        print(f"Histórico do snapshot carregado: {df.shape[0]} linhas, {keys.shape[0]} pedidos.")
+        return df, keys
+    except ImportError:
+        return None, None
+    except Exception as e:
+        print(f"Warning: Falha ao ler o histórico do snapshot ({e}). Histórico descartado: pedidos ausentes do arquivo fonte deixam de aparecer.")
+        return None, None
+
+
+@traced("snapshot.write")
+def save_snapshot(df, file_path, snapshot_dir=None, content_hash=None, row_keys=None, source_signature=None):
+    """Writes the cleaned frame to the Parquet snapshot and records the source key in the manifest.
+
+    source_signature and content_hash should be taken before the source was read (see
+    load_and_clean_data_with_snapshot): if the file is replaced during the parse, the manifest
+    then keeps the old key and the next check rebuilds the snapshot. Without them the file is
+    stat'ed and hashed now. row_keys, when given, is stored as a sidecar so the next refresh
+    can run incrementally.
+    """
+    data_path, manifest_path = get_snapshot_paths(file_path, snapshot_dir)
+    keys_path = get_snapshot_keys_path(file_path, snapshot_dir)
+    try:
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        manifest = dict(source_signature) if source_signature else get_source_signature(file_path)
+        manifest["content_hash"] = content_hash or compute_content_hash(file_path)
+        manifest["format_version"] = SNAPSHOT_FORMAT_VERSION
+        manifest["rows"] = int(df.shape[0])
+
+        # Write to a temp file and swap it in so readers never see a half-written snapshot
+        tmp_path = data_path + ".tmp"
+        df.to_parquet(tmp_path, engine="pyarrow", index=False)
+        os.replace(tmp_path, data_path)
+        if row_keys is not None:
+            row_keys.to_parquet(keys_path + ".tmp", engine="pyarrow", index=False)
+            os.replace(keys_path + ".tmp", keys_path)
+        elif os.path.exists(keys_path):
+            os.remove(keys_path)
+        _write_manifest(manifest, manifest_path)
+        print(f"Snapshot salvo em {data_path} ({manifest['rows']} linhas).")
+        return True
+    except ImportError:
+        print("Warning: pyarrow não instalado. Snapshot em disco desativado.")
+        return False
+    except Exception as e:
+        print(f"Warning: Não foi possível salvar o snapshot: {e}")
+        traceback.print_exc()
+        return False
+
+
+def get_artifact_path(file_path, name, snapshot_dir=None):
+    """Returns the path of a precomputed artifact (cube, aggregates) stored beside the snapshot."""
+    data_path, _ = get_snapshot_paths(file_path, snapshot_dir)
+    return data_path[:-len(".parquet")] + f".{name}.parquet"
+
+
+def save_artifact(df, file_path, name, snapshot_dir=None):
+    """Stores a frame derived from the current snapshot; it stays valid until the snapshot is rewritten."""
+    manifest = read_manifest(file_path, snapshot_dir)
+    if not manifest or "content_hash" not in manifest:
+        print(f"Warning: Artefato '{name}' não salvo: não há snapshot para {file_path}.")
+        return False
+    artifact_path = get_artifact_path(file_path, name, snapshot_dir)
+    _, manifest_path = get_snapshot_paths(file_path, snapshot_dir)
+    try:
+        df.to_parquet(artifact_path + ".tmp", engine="pyarrow", index=False)
+        os.replace(artifact_path + ".tmp", artifact_path)
+        manifest.setdefault("artifacts", {})[name] = manifest["content_hash"]
+        _write_manifest(manifest, manifest_path)
+        return True
+    except ImportError:
+        print("Warning: pyarrow não instalado. Artefatos em disco desativados.")
+        return False
+    except Exception as e:
+        print(f"Warning: Não foi possível salvar o artefato '{name}': {e}")
+        return False
+
+
+def load_artifact(file_path, name, snapshot_dir=None):
+    """Loads a precomputed artifact if it was built from the snapshot that is still current, else None."""
+    manifest = read_manifest(file_path, snapshot_dir)
+    if not manifest or manifest.get("artifacts", {}).get(name) != manifest.get("content_hash"):
+        return None
+    artifact_path = get_artifact_path(file_path, name, snapshot_dir)
+    if not os.path.exists(artifact_path) or not is_snapshot_current(file_path, snapshot_dir, manifest):
+        return None
+    try:
+        return pd.read_parquet(artifact_path, engine="pyarrow")
+    except Exception as e:
+        print(f"Warning: Falha ao ler o artefato '{name}': {e}")
+        return None
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Server-side pagination and sorting of the filtered-data table.
+
+Only the rows of the visible page are materialized and sent to the browser, so the payload
+does not grow with the number of filtered rows.
+"""
+import numpy as np
+
+TABLE_PAGE_SIZES = [50, 100, 250, 500]
+DEFAULT_PAGE_SIZE = 100
+
+
+def sort_order(df, column, ascending=True):
+    """Returns the row positions of df ordered by column (stable, missing values last).
+
+    Categoricals sort in category order, so MesNome stays chronological.
+    """
+    ordered = df[column].reset_index(drop=True).sort_values(ascending=ascending, kind="stable", na_position="last")
+    return ordered.index.to_numpy(dtype=np.int64)
+
+
+def page_count(n_rows, page_size):
+    """Number of pages needed for n_rows (at least one, so an empty table still has a page)."""
+    return max(1, -(-n_rows // page_size))
+
+
+def get_page(df, page, page_size, order=None, columns=None):
+    """Returns the 1-based page of df as a small frame, in the given row order (positions) if any.
+
+    The page rows are taken before the columns are selected, so nothing but the page is copied.
+    """
+    page = min(max(int(page), 1), page_count(len(df), page_size))
+    start = (page - 1) * page_size
+    stop = min(start + page_size, len(df))
+    positions = order[start:stop] if order is not None else np.arange(start, stop)
+    page_df = df.take(positions)
+    return page_df[columns] if columns is not None else page_df
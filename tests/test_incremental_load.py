@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""The streamed and whole-file loads must hash order groups alike, so either refreshes the other's history."""
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+from synthetic_extract import generate_order_extract, write_extract
+from data_processor_streamlit_corrected_v2 import load_and_clean_data_incremental
+
+
+def _dirty_groups(output):
+    for line in output.splitlines():
+        if line.startswith("Carga incremental:"):
+            return int(line.split()[2])
+    raise AssertionError("incremental load did not report its changed groups")
+
+
+@pytest.mark.parametrize("fmt", ["csv", "xlsx"])
+def test_whole_file_refresh_of_chunked_load_finds_no_changes(fmt, tmp_path, capsys):
+    path = str(tmp_path / f"extract.{fmt}")
+    write_extract(generate_order_extract(3000, seed=3), path)
+    is_csv = fmt == "csv"
+
+    df_history, keys_history = load_and_clean_data_incremental(path, is_csv=is_csv, chunk_rows=700)
+    assert keys_history is not None
+    capsys.readouterr()
+
+    df_clean, _ = load_and_clean_data_incremental(path, df_history, keys_history, is_csv=is_csv, chunk_rows=None)
+    assert _dirty_groups(capsys.readouterr().out) == 0
+    assert df_clean is df_history